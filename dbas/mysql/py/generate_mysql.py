@@ -3,18 +3,24 @@
 gen_mysql_heavy_full.py
 Создаёт 10 «тяжёлых» таблиц и заполняет их данными батчами.
 Цель размера: TARGET_GB (по умолчанию 8.0 GB).
-Работает через pymysql и INSERT (executemany).
+Работает через pymysql: INSERT (executemany) или LOAD DATA LOCAL INFILE (MODE = "load_data").
 """
 
 import os
-import sys
+import re
 import time
 import math
 import random
 import string
 import base64
+import queue
+import tempfile
+import threading
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import json
+
+from json_synth import RandomDocument
 
 try:
     import pymysql
@@ -39,9 +45,31 @@ DB = {
 # Параметры генерации
 # -----------------------
 TARGET_GB = 10.0           # целевой размер базы в ГБ (измените: 5..30)
-MODE = "insert"           # только 'insert' поддержан по умолчанию (без LOAD DATA)
-BATCH_SIZE = 1000         # строки за INSERT executemany
-COMMIT_EVERY = 20000      # количество строк до вызова conn.commit()
+MODE = "insert"           # 'insert' (executemany) или 'load_data' (LOAD DATA LOCAL INFILE, нужен local_infile=ON на сервере)
+BATCH_SIZE = 1000         # строки за INSERT executemany (если ADAPTIVE_BATCH = False)
+COMMIT_EVERY = 20000      # количество строк до вызова conn.commit() (если ADAPTIVE_BATCH = False)
+ADAPTIVE_BATCH = True     # размер батча в байтах, подстраивается по max_allowed_packet и задержке INSERT
+TARGET_BATCH_SECONDS = 0.5   # дольше — батч уменьшается
+TARGET_COMMIT_SECONDS = 5.0  # примерно столько работы между commit()
+LOAD_CHUNK_ROWS = 50000   # строк на один LOAD DATA (MODE='load_data'), для files делится на 50
+WORKERS = 4               # процессов-вставщиков на таблицу (у каждого своё соединение); 1 = в текущем процессе
+TABLE_WORKERS = {         # переопределение параллельности по таблицам
+    "files": 2,           # тяжёлые blob-строки: упираемся в сеть/сжатие, много воркеров только мешают
+    "metrics": 8,
+    "orders": 6,
+    "logs": 6,
+}
+RANGE_BYTES = 128 * 1024**2  # объём одного задания воркера: строк в диапазоне ~ RANGE_BYTES / EST_ROW_BYTES
+MIN_RANGE_ROWS = 1000     # таблицы не больше этого грузятся в текущем процессе, без пула
+PREFETCH_BATCHES = 4      # глубина очереди генерация -> отправка внутри воркера
+DEFER_INDEXES = True      # таблицы создаются только с PK, вторичные и FULLTEXT индексы — после загрузки
+INDEX_PARALLEL = 4        # сколько таблиц индексировать одновременно (каждая на своём соединении)
+# Сессионные настройки для ALTER TABLE ... ADD INDEX; что сервер не разрешит (версия/права/read-only) — пропускаем
+DDL_SESSION_SETTINGS = {
+    "innodb_ddl_threads": 8,                      # MySQL 8.0.27+
+    "innodb_ddl_buffer_size": 256 * 1024 * 1024,  # MySQL 8.0.27+
+    "innodb_sort_buffer_size": 64 * 1024 * 1024,  # обычно read-only, но на некоторых сборках/форках доступна
+}
 VERBOSE = True
 
 # Эмпирические средние размеры строки в байтах (используются для расчёта количества строк)
@@ -262,21 +290,20 @@ def rnd_text(min_len=100, max_len=2000):
         words.append(''.join(random.choices(string.ascii_lowercase, k=wlen)))
     return ' '.join(words)[:size]
 
-def rnd_json_kv(n=5, depth=1):
-    obj = {}
-    for i in range(n):
-        k = "k"+str(i)
-        if depth > 0 and random.random() < 0.3:
-            obj[k] = rnd_json_kv(n=3, depth=depth-1)
-        else:
-            obj[k] = rnd_string(3,20)
-    return obj
+_JSON_DOCS = {}
+
+def rnd_json(n=5, depth=1):
+    # JSON-текст "k0..kN -> строка" со случайной вложенностью; скелеты компилируются один раз (RandomDocument)
+    doc = _JSON_DOCS.get((n, depth))
+    if doc is None:
+        doc = _JSON_DOCS[(n, depth)] = RandomDocument(n=n, depth=depth)
+    return doc.render()
 
 def gen_user(i):
     username = f"user{i}_{rnd_string(4,8)}"
     email = f"{username}@example.com"
     full_name = rnd_string(10,40)
-    profile = rnd_json_kv(6, depth=2)
+    profile = rnd_json(6, depth=2)
     bio = rnd_text(200, 1200)
     country = random.choice(COUNTRIES)
     created = datetime.now() - timedelta(days=random.randint(0, 3650))
@@ -286,7 +313,7 @@ def gen_user(i):
         username,
         email,
         full_name,
-        json.dumps(profile, ensure_ascii=False),  # ✅ правильный JSON
+        profile,  # ✅ правильный JSON (текст из шаблона)
         bio,
         country,
         created.strftime("%Y-%m-%d %H:%M:%S"),
@@ -298,13 +325,13 @@ def gen_product(i):
     sku = f"SKU-{i:012d}"
     name = " ".join([rnd_string(4,12) for _ in range(6)])[:300]
     category = random.choice(["electronics","books","clothing","home","garden","sports","auto","software"])
-    attributes = rnd_json_kv(10, depth=2)
+    attributes = rnd_json(10, depth=2)
     description = rnd_text(400, 2000)
     price = round(random.uniform(0.5, 10000.0), 4)
     stock = random.randint(0, 10000)
     vendor = rnd_string(6, 40)
     created = datetime.now() - timedelta(days=random.randint(0, 3650))
-    return (sku, name, category, json.dumps(attributes, ensure_ascii=False), description, price, stock, vendor, created.strftime("%Y-%m-%d %H:%M:%S"))
+    return (sku, name, category, attributes, description, price, stock, vendor, created.strftime("%Y-%m-%d %H:%M:%S"))
 
 def gen_order(i, max_user_id, max_product_id):
     user_id = random.randint(1, max(1, max_user_id))
@@ -325,21 +352,21 @@ def gen_log(i):
     pid = random.randint(100, 99999)
     thread = rnd_string(6, 20)
     message = rnd_text(300, 2500)
-    context = rnd_json_kv(6, depth=2)
+    context = rnd_json(6, depth=2)
     created = datetime.now() - timedelta(seconds=random.randint(0, 60*60*24*365))
-    return (level, service, host, pid, thread, message, json.dumps(context, ensure_ascii=False), created.strftime("%Y-%m-%d %H:%M:%S"))
+    return (level, service, host, pid, thread, message, context, created.strftime("%Y-%m-%d %H:%M:%S"))
 
 def gen_audit(i):
     user_id = random.randint(1, 1000000)
     object_type = random.choice(["order","product","user","session","payment","file"])
     object_id = str(random.randint(1, 1000000000))
     action = random.choice(["create","update","delete","access","permission_change"])
-    payload = rnd_json_kv(10, depth=2)
+    payload = rnd_json(10, depth=2)
     old = rnd_text(50, 800)
     new = rnd_text(50, 800)
     ip = f"{random.randint(1,255)}.{random.randint(0,255)}.{random.randint(0,255)}.{random.randint(0,255)}"
     created = datetime.now() - timedelta(days=random.randint(0, 3650))
-    return (user_id, object_type, object_id, action, json.dumps(payload, ensure_ascii=False), old, new, ip, created.strftime("%Y-%m-%d %H:%M:%S"))
+    return (user_id, object_type, object_id, action, payload, old, new, ip, created.strftime("%Y-%m-%d %H:%M:%S"))
 
 def gen_file(i):
     owner_id = random.randint(1, 1000000)
@@ -350,37 +377,37 @@ def gen_file(i):
     # random bytes then base64 to simulate content stored as base64 MEDIUMTEXT
     b = os.urandom(size)
     b64 = base64.b64encode(b).decode('ascii')
-    metadata = rnd_json_kv(6, depth=1)
+    metadata = rnd_json(6, depth=1)
     created = datetime.now() - timedelta(days=random.randint(0, 3650))
-    return (owner_id, filename, mime, size, b64, json.dumps(metadata, ensure_ascii=False), created.strftime("%Y-%m-%d %H:%M:%S"))
+    return (owner_id, filename, mime, size, b64, metadata, created.strftime("%Y-%m-%d %H:%M:%S"))
 
 def gen_metric(i):
     metric_name = random.choice(["cpu.usage","mem.usage","disk.io","http.requests","db.connections","latency"])
     ts = datetime.now() - timedelta(seconds=random.randint(0, 60*60*24*365))
     value = random.random() * 1000.0
-    tags = rnd_json_kv(5, depth=1)
+    tags = rnd_json(5, depth=1)
     sample_rate = random.choice([1,5,10,60])
     created = ts
-    return (metric_name, ts.strftime("%Y-%m-%d %H:%M:%S"), value, json.dumps(tags, ensure_ascii=False), sample_rate, created.strftime("%Y-%m-%d %H:%M:%S"))
+    return (metric_name, ts.strftime("%Y-%m-%d %H:%M:%S"), value, tags, sample_rate, created.strftime("%Y-%m-%d %H:%M:%S"))
 
 def gen_message(i, max_user_id):
     from_user = random.randint(1, max(1, max_user_id))
     to_user = random.randint(1, max(1, max_user_id))
     subject = rnd_string(20, 200)[:300]
     body = rnd_text(200, 3000)
-    attachments = rnd_json_kv(3, depth=1)
+    attachments = rnd_json(3, depth=1)
     is_read = random.choice([0,1])
     created = datetime.now() - timedelta(days=random.randint(0, 3650))
-    return (from_user, to_user, subject, body, json.dumps(attachments, ensure_ascii=False), is_read, created.strftime("%Y-%m-%d %H:%M:%S"))
+    return (from_user, to_user, subject, body, attachments, is_read, created.strftime("%Y-%m-%d %H:%M:%S"))
 
 def gen_session(i, max_user_id):
     sid = ''.join(random.choices('0123456789abcdef', k=36))
     user_id = random.randint(1, max(1, max_user_id))
     token = ''.join(random.choices(string.ascii_letters + string.digits, k=120))
-    data = rnd_json_kv(8, depth=2)
+    data = rnd_json(8, depth=2)
     created = datetime.now() - timedelta(days=random.randint(0, 3650))
     expires = created + timedelta(days=random.randint(1, 365))
-    return (sid, user_id, token, json.dumps(data, ensure_ascii=False), created.strftime("%Y-%m-%d %H:%M:%S"), expires.strftime("%Y-%m-%d %H:%M:%S"))
+    return (sid, user_id, token, data, created.strftime("%Y-%m-%d %H:%M:%S"), expires.strftime("%Y-%m-%d %H:%M:%S"))
 
 def gen_payment(i, max_user_id):
     order_id = random.randint(1, 20000000)
@@ -438,147 +465,475 @@ def connect():
     return pymysql.connect(host=DB["host"], port=DB["port"],
                            user=DB["user"], password=DB["password"],
                            database=DB["database"], charset=DB["charset"],
-                           cursorclass=DB["cursorclass"], autocommit=False)
+                           cursorclass=DB["cursorclass"], autocommit=False,
+                           local_infile=(MODE == "load_data"),
+                           # клиентский лимит pymysql (16MB по умолчанию) не должен быть меньше серверного
+                           max_allowed_packet=1024**3)
+
+_INDEX_LINE = re.compile(r"^\s*(INDEX|KEY|UNIQUE|FULLTEXT)\b", re.IGNORECASE)
+
+def split_table_sql(sql):
+    """Делит CREATE TABLE на DDL только с PK и список определений вторичных/FULLTEXT индексов."""
+    keep, indexes = [], []
+    for line in sql.splitlines():
+        if _INDEX_LINE.match(line):
+            indexes.append(line.strip().rstrip(","))
+        else:
+            keep.append(line)
+    create = re.sub(r",\s*\n\)", "\n)", "\n".join(keep))
+    return create, indexes
 
-def create_tables(conn):
+def create_tables(conn, defer_indexes=DEFER_INDEXES):
     cur = conn.cursor()
     for name, sql in TABLE_SQL.items():
         if VERBOSE:
-            print(f"[DDL] creating table {name} ...")
+            print(f"[DDL] creating table {name}{' (PK only)' if defer_indexes else ''} ...")
+        if defer_indexes:
+            sql, _ = split_table_sql(sql)
         cur.execute(sql)
     conn.commit()
 
-def batched_insert(conn, table, count, gen_fn, batch_size=BATCH_SIZE, commit_every=COMMIT_EVERY, start_index=0, max_user_id_hint=1000000, max_product_id_hint=1000000):
+def apply_ddl_settings(cur):
+    for name, value in DDL_SESSION_SETTINGS.items():
+        try:
+            cur.execute(f"SET SESSION {name} = %s", (value,))
+        except pymysql.MySQLError as e:
+            if VERBOSE:
+                print(f"[DDL] {name} not set: {e.args[-1] if e.args else e}")
+
+def add_indexes(table):
+    """ALTER TABLE ... ADD INDEX, ALGORITHM=INPLACE для индексов, отложенных в create_tables."""
+    _, defs = split_table_sql(TABLE_SQL[table])
+    conn = connect()
+    t0 = time.time()
+    try:
+        cur = conn.cursor()
+        apply_ddl_settings(cur)
+        cur.execute("SELECT DISTINCT index_name FROM information_schema.statistics "
+                    "WHERE table_schema = DATABASE() AND table_name = %s", (table,))
+        existing = {r[0] for r in cur.fetchall()}
+        plain, fulltext = [], []
+        for d in defs:
+            name = d.split()[2] if d.upper().startswith(("FULLTEXT", "UNIQUE")) else d.split()[1]
+            if name in existing:
+                continue
+            (fulltext if d.upper().startswith("FULLTEXT") else plain).append(d)
+        if plain:
+            cur.execute(f"ALTER TABLE {table} " + ", ".join(f"ADD {d}" for d in plain) + ", ALGORITHM=INPLACE, LOCK=NONE")
+        # InnoDB добавляет FULLTEXT только по одному за ALTER и не допускает LOCK=NONE
+        for d in fulltext:
+            cur.execute(f"ALTER TABLE {table} ADD {d}, ALGORITHM=INPLACE, LOCK=SHARED")
+        conn.commit()
+    finally:
+        conn.close()
+    elapsed = time.time() - t0
+    if VERBOSE:
+        print(f"[DDL] {table}: {len(plain) + len(fulltext)} indexes built in {elapsed:.1f}s")
+    return elapsed
+
+def build_deferred_indexes(tables, parallel=INDEX_PARALLEL):
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as ex:
+        return dict(zip(tables, ex.map(add_indexes, tables)))
+
+def gen_row(table, gen_fn, idx, max_user_id_hint, max_product_id_hint):
+    # generate row based on table specifics
+    if table == "orders":
+        return gen_fn(idx, max_user_id_hint, max_product_id_hint)
+    if table in ("messages", "sessions", "payments"):
+        return gen_fn(idx, max_user_id_hint)
+    # generic single-arg generator
+    return gen_fn(idx)
+
+class AdaptiveBatcher:
+    """
+    Размер INSERT-батча в байтах: растёт, пока растёт throughput и INSERT укладывается
+    в TARGET_BATCH_SECONDS; уменьшается, если INSERT стал долгим или throughput упал.
+    Потолок — max_allowed_packet сервера (с запасом на экранирование).
+    Коммит — примерно раз в TARGET_COMMIT_SECONDS по наблюдаемой скорости.
+    """
+    MIN_BYTES = 64 * 1024
+    START_BYTES = 1024 * 1024
+
+    def __init__(self, table, max_packet, target_seconds=TARGET_BATCH_SECONDS, commit_seconds=TARGET_COMMIT_SECONDS):
+        self.table = table
+        self.max_packet = max_packet
+        self.cap = max(self.MIN_BYTES, int(max_packet * 0.75))
+        self.target_seconds = target_seconds
+        self.commit_seconds = commit_seconds
+        self.batch_bytes = min(self.START_BYTES, self.cap)
+        self.commit_bytes = self.batch_bytes * 8
+        self.rate = None
+        self.best_rate = 0.0
+        self.avg_row_bytes = None
+        self._logged_bytes = 0
+
+    def observe(self, nbytes, rows, seconds):
+        seconds = max(seconds, 1e-6)
+        rate = nbytes / seconds
+        self.rate = rate if self.rate is None else 0.7 * self.rate + 0.3 * rate
+        self.avg_row_bytes = nbytes / max(1, rows)
+        if seconds > self.target_seconds * 1.5:
+            new = self.batch_bytes * 0.7
+        elif self.rate >= self.best_rate * 0.97:
+            self.best_rate = max(self.best_rate, self.rate)
+            new = self.batch_bytes * 1.25
+        else:
+            # рост батча перестал давать throughput — откатываемся и понемногу забываем рекорд
+            new = self.batch_bytes * 0.9
+            self.best_rate *= 0.98
+        self.batch_bytes = int(min(self.cap, max(self.MIN_BYTES, new)))
+        self.commit_bytes = int(max(self.batch_bytes, self.rate * self.commit_seconds))
+        if VERBOSE and not (self._logged_bytes / 2 <= self.batch_bytes <= self._logged_bytes * 2):
+            self._logged_bytes = self.batch_bytes
+            print(f"[{self.table}] batch -> {self.describe()}")
+
+    def stmt_limit(self, nbytes):
+        # pymysql.executemany режет INSERT по cursor.max_stmt_length — держим батч одним запросом
+        return max(self.MIN_BYTES, min(self.max_packet - 4096, int(nbytes * 1.3) + 4096))
+
+    def describe(self):
+        rows = f"~{self.batch_bytes / self.avg_row_bytes:.0f} rows, " if self.avg_row_bytes else ""
+        rate = f", {self.rate / 1024**2:.1f} MB/s" if self.rate else ""
+        return (f"{rows}{self.batch_bytes // 1024} KB per INSERT, commit every {self.commit_bytes // 1024**2} MB"
+                f"{rate} (max_allowed_packet={self.max_packet // 1024**2} MB)")
+
+def server_max_packet(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT @@max_allowed_packet")
+    return int(cur.fetchone()[0])
+
+def row_bytes(row):
+    return sum(len(v) if isinstance(v, str) else 8 for v in row) + 4 * len(row)
+
+def iter_batches(table, gen_fn, count, batch_size, start_index, max_user_id_hint, max_product_id_hint, batcher=None):
+    """Батчи (rows, nbytes): по batch_size строк или, с batcher, по его текущему размеру в байтах."""
+    end = start_index + count + 1
+    if batcher is None:
+        for first in range(start_index + 1, end, batch_size):
+            rows = [gen_row(table, gen_fn, idx, max_user_id_hint, max_product_id_hint)
+                    for idx in range(first, min(first + batch_size, end))]
+            yield rows, sum(row_bytes(r) for r in rows)
+        return
+    rows, nbytes = [], 0
+    for idx in range(start_index + 1, end):
+        row = gen_row(table, gen_fn, idx, max_user_id_hint, max_product_id_hint)
+        rows.append(row)
+        nbytes += row_bytes(row)
+        if nbytes >= batcher.batch_bytes:
+            yield rows, nbytes
+            rows, nbytes = [], 0
+    if rows:
+        yield rows, nbytes
+
+def prefetch(iterable, depth=PREFETCH_BATCHES):
+    """Генерирует элементы в отдельном потоке: пока отправляется батч N, готовятся следующие."""
+    q = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        q.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            q.put(done)
+        except BaseException as e:
+            q.put(e)
+
+    t = threading.Thread(target=produce, daemon=True)
+    t.start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def batched_insert(conn, table, count, gen_fn, batch_size=BATCH_SIZE, commit_every=COMMIT_EVERY, start_index=0, max_user_id_hint=1000000, max_product_id_hint=1000000, batcher=None):
+    # batcher передаёт воркер parallel_insert, чтобы подобранный размер переходил из диапазона в диапазон
     cur = conn.cursor()
     sql, _ = INSERT_SQL[table]
+    if batcher is None and ADAPTIVE_BATCH:
+        batcher = AdaptiveBatcher(table, server_max_packet(conn))
     inserted = 0
     to_commit = 0
+    to_commit_bytes = 0
+    next_report = batch_size * 5
     t0 = time.time()
-    batch = []
-    while inserted < count:
-        idx = start_index + inserted + 1
-        # generate row based on table specifics
-        if table == "orders":
-            row = gen_fn(idx, max_user_id_hint, max_product_id_hint)
-        elif table == "messages":
-            row = gen_fn(idx, max_user_id_hint)
-        elif table == "sessions":
-            row = gen_fn(idx, max_user_id_hint)
-        elif table == "payments":
-            row = gen_fn(idx, max_user_id_hint)
-        else:
-            # generic single-arg generator
-            row = gen_fn(idx)
-        batch.append(row)
-        if len(batch) >= batch_size:
-            cur.executemany(sql, batch)
-            inserted += len(batch)
-            to_commit += len(batch)
-            batch = []
-            if to_commit >= commit_every:
-                conn.commit()
-                to_commit = 0
-            if VERBOSE and inserted % (batch_size*5) == 0:
-                elapsed = time.time() - t0
-                print(f"[{table}] inserted {inserted}/{count} rows, elapsed {elapsed:.1f}s")
-    # final flush
-    if batch:
+    batches = iter_batches(table, gen_fn, count, batch_size, start_index, max_user_id_hint, max_product_id_hint, batcher)
+    for batch, nbytes in prefetch(batches):
+        t1 = time.time()
+        if batcher is not None:
+            cur.max_stmt_length = batcher.stmt_limit(nbytes)
         cur.executemany(sql, batch)
+        if batcher is not None:
+            batcher.observe(nbytes, len(batch), time.time() - t1)
         inserted += len(batch)
+        to_commit += len(batch)
+        to_commit_bytes += nbytes
+        if batcher is not None:
+            due = to_commit_bytes >= batcher.commit_bytes
+        else:
+            due = to_commit >= commit_every
+        if due:
+            conn.commit()
+            to_commit = 0
+            to_commit_bytes = 0
+        if VERBOSE and inserted >= next_report:
+            next_report = inserted + batch_size * 5
+            elapsed = time.time() - t0
+            print(f"[{table}] inserted {inserted}/{count} rows, elapsed {elapsed:.1f}s")
     conn.commit()
     if VERBOSE:
         print(f"[{table}] done. inserted {inserted} rows in {time.time()-t0:.1f}s")
+        if batcher is not None:
+            print(f"[{table}] adaptive batch: {batcher.describe()}")
     return inserted
 
+# -----------------------
+# LOAD DATA LOCAL INFILE (MODE = "load_data")
+# Строки генерируются в отдельном потоке и пишутся TSV-чанками в именованный FIFO,
+# pymysql читает его как "локальный файл" и стримит на сервер — на диск ничего не пишется.
+# -----------------------
+_TSV_ESCAPE = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+
+def tsv_field(v):
+    if v is None:
+        return "\\N"
+    if isinstance(v, str):
+        return v.translate(_TSV_ESCAPE)
+    return str(v)
+
+def table_columns(table):
+    sql, _ = INSERT_SQL[table]
+    m = re.search(r"INSERT INTO \w+ \(([^)]*)\)", sql)
+    return m.group(1)
+
+def _write_tsv(path, rows_iter, errors, cancel=None):
+    try:
+        with open(path, "w", encoding="utf-8", newline="\n") as f:
+            for row in rows_iter:
+                if cancel is not None and cancel.is_set():
+                    break
+                f.write("\t".join(tsv_field(v) for v in row))
+                f.write("\n")
+    except BrokenPipeError:
+        # сервер/клиент прервал LOAD DATA — ошибку поднимет основной поток
+        pass
+    except Exception as e:
+        errors.append(e)
+
+def load_data_chunk(cur, table, columns, rows_iter, path):
+    """Один LOAD DATA LOCAL INFILE; строки стримятся через FIFO (или temp-файл, если mkfifo нет)."""
+    errors = []
+    sql = (f"LOAD DATA LOCAL INFILE %s INTO TABLE {table} CHARACTER SET utf8mb4 "
+           f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({columns})")
+    if not hasattr(os, "mkfifo"):
+        _write_tsv(path, rows_iter, errors)
+        if errors:
+            raise errors[0]
+        try:
+            return cur.execute(sql, (path,))
+        finally:
+            os.unlink(path)
+
+    os.mkfifo(path)
+    cancel = threading.Event()
+    writer = threading.Thread(target=_write_tsv, args=(path, rows_iter, errors, cancel), daemon=True)
+    writer.start()
+    try:
+        loaded = cur.execute(sql, (path,))
+    finally:
+        if writer.is_alive():
+            # LOAD DATA упал, не дочитав FIFO: останавливаем writer и вычитываем остаток, чтобы он не завис
+            cancel.set()
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            try:
+                while writer.is_alive():
+                    try:
+                        os.read(fd, 1 << 16)
+                    except BlockingIOError:
+                        writer.join(0.01)
+            finally:
+                os.close(fd)
+        writer.join()
+        os.unlink(path)
+    if errors:
+        raise errors[0]
+    return loaded
+
+def load_data_insert(conn, table, count, gen_fn, chunk_rows=LOAD_CHUNK_ROWS, start_index=0, max_user_id_hint=1000000, max_product_id_hint=1000000):
+    cur = conn.cursor()
+    columns = table_columns(table)
+    fifo_dir = tempfile.mkdtemp(prefix="gen_mysql_")
+    path = os.path.join(fifo_dir, f"{table}.tsv")
+    cur.execute("SET SESSION unique_checks = 0")
+    cur.execute("SET SESSION foreign_key_checks = 0")
+    inserted = 0
+    t0 = time.time()
+    try:
+        while inserted < count:
+            n = min(chunk_rows, count - inserted)
+            first = start_index + inserted + 1
+            rows_iter = (gen_row(table, gen_fn, idx, max_user_id_hint, max_product_id_hint)
+                         for idx in range(first, first + n))
+            load_data_chunk(cur, table, columns, rows_iter, path)
+            conn.commit()
+            inserted += n
+            if VERBOSE:
+                elapsed = time.time() - t0
+                print(f"[{table}] loaded {inserted}/{count} rows, elapsed {elapsed:.1f}s, {inserted/max(elapsed,1e-9):.0f} rows/s")
+    finally:
+        cur.execute("SET SESSION unique_checks = 1")
+        cur.execute("SET SESSION foreign_key_checks = 1")
+        os.rmdir(fifo_dir)
+    if VERBOSE:
+        print(f"[{table}] done. loaded {inserted} rows in {time.time()-t0:.1f}s")
+    return inserted
+
+def insert_rows(conn, table, count, gen_fn, batch_size=BATCH_SIZE, **kwargs):
+    if MODE == "load_data":
+        # крупные строки (files) — меньшие чанки, чтобы один LOAD не тянул гигабайты
+        chunk_rows = max(1, LOAD_CHUNK_ROWS // 50) if table == "files" else LOAD_CHUNK_ROWS
+        return load_data_insert(conn, table, count, gen_fn, chunk_rows=chunk_rows, **kwargs)
+    if MODE != "insert":
+        raise ValueError(f"unknown MODE={MODE!r}, expected 'insert' or 'load_data'")
+    return batched_insert(conn, table, count, gen_fn, batch_size=batch_size, **kwargs)
+
+# -----------------------
+# Параллельная загрузка: пул процессов, у каждого своё соединение
+# -----------------------
+_worker_conn = None
+_worker_batchers = {}  # таблица -> AdaptiveBatcher процесса: диапазоны продолжают подбор, а не начинают заново
+
+def _worker_init():
+    global _worker_conn, VERBOSE
+    # после fork у всех процессов одинаковое состояние random — иначе дубли (sessions.id)
+    random.seed()
+    VERBOSE = False
+    _worker_conn = connect()
+    _worker_batchers.clear()
+
+def _worker_insert_range(task):
+    table, start_index, count, batch_size, max_user_id_hint, max_product_id_hint = task
+    _, gen_fn = INSERT_SQL[table]
+    kwargs = {}
+    if MODE == "insert" and ADAPTIVE_BATCH:
+        if table not in _worker_batchers:
+            _worker_batchers[table] = AdaptiveBatcher(table, server_max_packet(_worker_conn))
+        kwargs["batcher"] = _worker_batchers[table]
+    n = insert_rows(_worker_conn, table, count, gen_fn, batch_size=batch_size, start_index=start_index,
+                    max_user_id_hint=max_user_id_hint, max_product_id_hint=max_product_id_hint, **kwargs)
+    batcher = kwargs.get("batcher")
+    # итог подбора этого процесса после диапазона — родитель собирает последний от каждого воркера
+    state = (batcher.batch_bytes, batcher.commit_bytes, batcher.rate or 0.0) if batcher is not None else None
+    return n, os.getpid(), state
+
+def describe_batchers(states):
+    """Итог подбора AdaptiveBatcher по воркерам таблицы: (batch_bytes, commit_bytes, rate) от каждого."""
+    batch = sorted(s[0] for s in states)
+    commit = sorted(s[1] for s in states)
+    rate = sum(s[2] for s in states)
+    return (f"{batch[len(batch) // 2] // 1024} KB per INSERT ({batch[0] // 1024}..{batch[-1] // 1024} KB), "
+            f"commit every {commit[len(commit) // 2] // 1024**2} MB, {rate / 1024**2:.1f} MB/s total "
+            f"over {len(states)} workers")
+
+def range_rows(table, count, workers):
+    # задание — примерно RANGE_BYTES данных (для files это сотни строк, для orders — сотни тысяч),
+    # но заданий не меньше, чем воркеров таблицы: иначе TABLE_WORKERS у небольших таблиц не работает
+    rows = RANGE_BYTES // EST_ROW_BYTES.get(table, 500)
+    return max(MIN_RANGE_ROWS, min(rows, math.ceil(count / workers)))
+
+def parallel_insert(table, count, batch_size, workers, max_user_id_hint=1000000, max_product_id_hint=1000000):
+    step = range_rows(table, count, workers)
+    tasks = [(table, start, min(step, count - start), batch_size, max_user_id_hint, max_product_id_hint)
+             for start in range(0, count, step)]
+    inserted = 0
+    t0 = time.time()
+    with mp.Pool(processes=min(workers, len(tasks)), initializer=_worker_init) as pool:
+        batchers = {}  # pid воркера -> его последнее состояние AdaptiveBatcher
+        for n, pid, state in pool.imap_unordered(_worker_insert_range, tasks):
+            inserted += n
+            if state is not None:
+                batchers[pid] = state
+            if VERBOSE:
+                elapsed = time.time() - t0
+                print(f"[{table}] inserted {inserted}/{count} rows, elapsed {elapsed:.1f}s, {inserted/max(elapsed,1e-9):.0f} rows/s")
+    if VERBOSE:
+        print(f"[{table}] done. inserted {inserted} rows in {time.time()-t0:.1f}s ({workers} workers)")
+        if batchers:
+            print(f"[{table}] adaptive batch: {describe_batchers(list(batchers.values()))}")
+    return inserted
+
+def load_table(conn, table, count, batch_size=BATCH_SIZE, **hints):
+    workers = TABLE_WORKERS.get(table, WORKERS)
+    if workers <= 1 or count <= MIN_RANGE_ROWS:
+        _, gen_fn = INSERT_SQL[table]
+        return insert_rows(conn, table, count, gen_fn, batch_size=batch_size, **hints)
+    return parallel_insert(table, count, batch_size, workers, **hints)
+
 # -----------------------
 # Основной поток
 # -----------------------
+# Порядок важен: orders/messages/sessions/payments ссылаются на уже созданных users/products
+LOAD_ORDER = ["users", "products", "orders", "logs", "audit_trail", "files", "metrics", "messages", "sessions", "payments"]
+BATCH_OVERRIDES = {
+    "files": max(1, min(BATCH_SIZE, 200)),  # reduce batch for large rows to avoid memory spikes
+    "metrics": 2000,
+}
+
 def main():
-    print(f"Target ~= {TARGET_GB} GB; mode={MODE}; batch_size={BATCH_SIZE}")
+    print(f"Target ~= {TARGET_GB} GB; mode={MODE}; batch_size={BATCH_SIZE}; workers={WORKERS}; defer_indexes={DEFER_INDEXES}")
     rows_plan = estimate_rows_per_table(TARGET_GB)
     print("Estimated rows per table (approx):")
     for k,v in rows_plan.items():
         print(f"  {k:12s}: {v:,}")
 
+    phases = {}
+    load_times = {}
+    index_times = {}
     conn = connect()
     try:
+        t0 = time.time()
         create_tables(conn)
-        # We will insert tables in an order so that orders/messages refer to users/products counts
+        phases["create"] = time.time() - t0
+
         # Keep track of max id hints (we assume autoincrement starts at 1)
         max_ids = {}
-
-        # users
-        t = "users"
-        cnt = rows_plan[t]
-        print(f"\nInserting {cnt:,} rows into {t} ...")
-        inserted = batched_insert(conn, t, cnt, gen_user)
-        max_ids["users"] = inserted
-
-        # products
-        t = "products"
-        cnt = rows_plan[t]
-        print(f"\nInserting {cnt:,} rows into {t} ...")
-        inserted = batched_insert(conn, t, cnt, gen_product)
-        max_ids["products"] = inserted
-
-        # orders (referencing users/products)
-        t = "orders"
-        cnt = rows_plan[t]
-        print(f"\nInserting {cnt:,} rows into {t} ...")
-        inserted = batched_insert(conn, t, cnt, gen_order, max_user_id_hint=max_ids["users"], max_product_id_hint=max_ids["products"])
-        max_ids["orders"] = inserted
-
-        # logs
-        t = "logs"
-        cnt = rows_plan[t]
-        print(f"\nInserting {cnt:,} rows into {t} ...")
-        inserted = batched_insert(conn, t, cnt, gen_log)
-        max_ids["logs"] = inserted
-
-        # audit_trail
-        t = "audit_trail"
-        cnt = rows_plan[t]
-        print(f"\nInserting {cnt:,} rows into {t} ...")
-        inserted = batched_insert(conn, t, cnt, gen_audit)
-        max_ids["audit_trail"] = inserted
-
-        # files (heavy - base64 content)
-        t = "files"
-        cnt = rows_plan[t]
-        # reduce batch for large rows to avoid memory spikes
-        file_batch_size = max(1, min(BATCH_SIZE, 200))
-        print(f"\nInserting {cnt:,} rows into {t} (large blobs) ...")
-        inserted = batched_insert(conn, t, cnt, gen_file, batch_size=file_batch_size)
-        max_ids["files"] = inserted
-
-        # metrics
-        t = "metrics"
-        cnt = rows_plan[t]
-        print(f"\nInserting {cnt:,} rows into {t} ...")
-        inserted = batched_insert(conn, t, cnt, gen_metric, batch_size=2000)
-        max_ids["metrics"] = inserted
-
-        # messages
-        t = "messages"
-        cnt = rows_plan[t]
-        print(f"\nInserting {cnt:,} rows into {t} ...")
-        inserted = batched_insert(conn, t, cnt, gen_message, max_user_id_hint=max_ids["users"])
-        max_ids["messages"] = inserted
-
-        # sessions
-        t = "sessions"
-        cnt = rows_plan[t]
-        print(f"\nInserting {cnt:,} rows into {t} ...")
-        inserted = batched_insert(conn, t, cnt, gen_session, max_user_id_hint=max_ids["users"])
-        max_ids["sessions"] = inserted
-
-        # payments
-        t = "payments"
-        cnt = rows_plan[t]
-        print(f"\nInserting {cnt:,} rows into {t} ...")
-        inserted = batched_insert(conn, t, cnt, gen_payment, max_user_id_hint=max_ids["users"])
-        max_ids["payments"] = inserted
-
+        t0 = time.time()
+        for t in LOAD_ORDER:
+            cnt = rows_plan[t]
+            workers = TABLE_WORKERS.get(t, WORKERS)
+            print(f"\nInserting {cnt:,} rows into {t} (workers={workers}) ...")
+            t1 = time.time()
+            max_ids[t] = load_table(conn, t, cnt, batch_size=BATCH_OVERRIDES.get(t, BATCH_SIZE),
+                                    max_user_id_hint=max_ids.get("users", 1000000),
+                                    max_product_id_hint=max_ids.get("products", 1000000))
+            load_times[t] = time.time() - t1
+        phases["load"] = time.time() - t0
+
+        if DEFER_INDEXES:
+            print(f"\nBuilding deferred indexes ({INDEX_PARALLEL} tables in parallel) ...")
+            t0 = time.time()
+            index_times = build_deferred_indexes(LOAD_ORDER)
+            phases["indexes"] = time.time() - t0
+
+        print("\nTimings:")
+        for t in LOAD_ORDER:
+            idx = f", indexes {index_times[t]:.1f}s" if t in index_times else ""
+            print(f"  {t:12s}: load {load_times[t]:.1f}s{idx}")
+        for name, sec in phases.items():
+            print(f"  phase {name:8s}: {sec:.1f}s")
         print("\nGeneration finished. Verify disk usage and consider running OPTIMIZE TABLE if needed.")
     finally:
         conn.close()
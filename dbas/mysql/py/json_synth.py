@@ -0,0 +1 @@
+../../postgres/py/json_synth.py
\ No newline at end of file
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+json_synth.py
+Быстрый генератор JSON-документов для JSON/JSONB-колонок по шаблонам.
+
+Вместо построения dict на каждую строку и json.dumps() скелет документа сериализуется
+один раз: шаблон хранит готовые куски текста, а на месте листьев-"слотов" подставляются
+заранее закодированные случайные скаляры. Результат — валидный JSON-текст (str).
+
+Лежит рядом с synth_prod_db.py и модулями load_test_prod.py — импортируется как соседний модуль;
+dbas/mysql/py/json_synth.py — симлинк на этот файл для generate_mysql.py (одна реализация на оба скрипта):
+
+    from json_synth import JsonTemplate, Choice, Int, Text
+
+    prefs = JsonTemplate({"lang": Choice(["en", "de"]), "age": Int(18, 90), "tags": [Text(3, 8), Text(3, 8)]})
+    prefs.render()   # '{"lang": "de", "age": 37, "tags": ["aZ3k", "Qw0pL1"]}'
+"""
+
+import json
+import random
+import string
+
+ALNUM = string.ascii_letters + string.digits
+_TEXT_POOL_SIZE = 1 << 20
+_text_pools = {}
+
+
+def _text_pool(alphabet):
+    # Один большой случайный буфер на алфавит: строки берутся срезом со случайного смещения
+    pool = _text_pools.get(alphabet)
+    if pool is None:
+        pool = _text_pools[alphabet] = "".join(random.choices(alphabet, k=_TEXT_POOL_SIZE))
+    return pool
+
+
+class Spec:
+    """Распределение значения листа. make() возвращает функцию без аргументов -> JSON-текст скаляра."""
+
+    def make(self):
+        raise NotImplementedError
+
+
+class Const(Spec):
+    def __init__(self, value):
+        self.value = value
+
+    def make(self):
+        text = json.dumps(self.value, ensure_ascii=False)
+        return lambda: text
+
+
+class Choice(Spec):
+    """Значение из списка (с весами или без); кодируется в JSON один раз при компиляции."""
+
+    def __init__(self, values, weights=None):
+        self.values = list(values)
+        self.weights = weights
+
+    def make(self):
+        encoded = [json.dumps(v, ensure_ascii=False) for v in self.values]
+        if self.weights is None:
+            return lambda choice=random.choice: choice(encoded)
+        cum, acc = [], 0.0
+        for w in self.weights:
+            acc += w
+            cum.append(acc)
+        return lambda choices=random.choices: choices(encoded, cum_weights=cum)[0]
+
+
+class Int(Spec):
+    def __init__(self, lo, hi):
+        self.lo, self.hi = lo, hi
+
+    def make(self):
+        lo, span = self.lo, self.hi - self.lo + 1
+        # int(random()*n) заметно дешевле randint() на горячем пути
+        return lambda rnd=random.random: str(lo + int(rnd() * span))
+
+
+class Float(Spec):
+    def __init__(self, lo, hi, ndigits=2):
+        self.lo, self.hi, self.ndigits = lo, hi, ndigits
+
+    def make(self):
+        lo, span, fmt = self.lo, self.hi - self.lo, f"%.{self.ndigits}f"
+        return lambda rnd=random.random: fmt % (lo + span * rnd())
+
+
+class Normal(Spec):
+    """
+    Целое |N(mu, sigma)| (например latency_ms) — отрицательные значения отражаются, как int(abs(np.random.normal()))
+    в прежнем генераторе, а не обрезаются в 0 (иначе при sigma, сравнимой с mu, у нуля копится пик).
+    """
+
+    def __init__(self, mu, sigma):
+        self.mu, self.sigma = mu, sigma
+
+    def make(self):
+        mu, sigma = self.mu, self.sigma
+        return lambda gauss=random.gauss: str(int(abs(gauss(mu, sigma))))
+
+
+class LogNormal(Spec):
+    def __init__(self, mu, sigma, ndigits=2):
+        self.mu, self.sigma, self.ndigits = mu, sigma, ndigits
+
+    def make(self):
+        mu, sigma, fmt = self.mu, self.sigma, f"%.{self.ndigits}f"
+        return lambda lv=random.lognormvariate: fmt % lv(mu, sigma)
+
+
+class Bool(Spec):
+    def __init__(self, p_true=0.5):
+        self.p_true = p_true
+
+    def make(self):
+        p = self.p_true
+        return lambda rnd=random.random: "true" if rnd() < p else "false"
+
+
+class Text(Spec):
+    """Случайная строка длиной min_len..max_len; алфавит не должен требовать JSON-экранирования."""
+
+    def __init__(self, min_len=3, max_len=20, alphabet=ALNUM):
+        if '"' in alphabet or "\\" in alphabet or any(ord(c) < 0x20 for c in alphabet):
+            raise ValueError("alphabet must not contain quotes, backslashes or control characters")
+        self.min_len, self.max_len, self.alphabet = min_len, max_len, alphabet
+
+    def make(self):
+        pool = _text_pool(self.alphabet)
+        lo, span = self.min_len, self.max_len - self.min_len + 1
+        top = len(pool) - self.max_len
+
+        def gen(rnd=random.random):
+            o = int(rnd() * top)
+            return '"' + pool[o:o + lo + int(rnd() * span)] + '"'
+        return gen
+
+
+class Pattern(Spec):
+    """Строка по маске как faker.bothify: '?' — буква, '#' — цифра, остальное как есть."""
+
+    def __init__(self, mask):
+        self.mask = mask
+
+    def make(self):
+        parts = [(string.ascii_letters if c == "?" else string.digits if c == "#" else c) for c in self.mask]
+        return lambda choice=random.choice: '"' + "".join(choice(p) if len(p) > 1 else p for p in parts) + '"'
+
+
+class Uuid(Spec):
+    def make(self):
+        def gen(bits=random.getrandbits):
+            h = "%032x" % bits(128)
+            return f'"{h[:8]}-{h[8:12]}-4{h[13:16]}-{h[16:20]}-{h[20:]}"'
+        return gen
+
+
+class Nullable(Spec):
+    def __init__(self, spec, p_null=0.5):
+        self.spec, self.p_null = spec, p_null
+
+    def make(self):
+        inner, p = self.spec.make(), self.p_null
+        return lambda rnd=random.random: "null" if rnd() < p else inner()
+
+
+class JsonTemplate:
+    """
+    Скелет документа (dict/list/скаляры + Spec в листьях) компилируется в список
+    статических кусков JSON-текста и функций-слотов между ними.
+    """
+
+    def __init__(self, skeleton):
+        fns = []
+        marker = "\x00slot\x00"
+
+        def walk(node):
+            if isinstance(node, Spec):
+                if isinstance(node, Const):
+                    return node.value
+                fns.append(node.make())
+                return marker + str(len(fns) - 1) + marker
+            if isinstance(node, dict):
+                return {k: walk(v) for k, v in node.items()}
+            if isinstance(node, (list, tuple)):
+                return [walk(v) for v in node]
+            return node
+
+        text = json.dumps(walk(skeleton), ensure_ascii=False)
+        # json.dumps экранирует \x00 как \u0000 — по этому маркеру и режем текст
+        esc = json.dumps(marker)[1:-1]
+        pieces = text.split('"' + esc)
+        self._head = pieces[0]
+        self._tail = []
+        for piece in pieces[1:]:
+            idx, rest = piece.split(esc + '"', 1)
+            self._tail.append((fns[int(idx)], rest))
+
+    def render(self):
+        return self._head + "".join([fn() + seg for fn, seg in self._tail])
+
+    __call__ = render
+
+
+class RandomDocument:
+    """
+    Документ "k0..k{n-1} -> value" со случайной вложенностью (ключ с вероятностью nest_prob — объект
+    из nested_n ключей, до depth уровней): variants случайных скелетов компилируются в JsonTemplate
+    один раз, render() берёт случайный из них.
+    """
+
+    def __init__(self, n=5, depth=1, nest_prob=0.3, nested_n=3, value=None, variants=64):
+        value = value if value is not None else Text(3, 20, ALNUM + " ")
+
+        def skeleton(names, d):
+            return {k: skeleton([f"k{i}" for i in range(nested_n)], d - 1) if d > 0 and random.random() < nest_prob else value
+                    for k in names}
+
+        # вариантов с разной структурой не больше, чем вообще возможно (2^n)
+        variants = max(1, min(variants, 2 ** min(n, 16) if depth > 0 else 1))
+        self.templates = [JsonTemplate(skeleton([f"k{i}" for i in range(n)], depth)) for _ in range(variants)]
+
+    def render(self):
+        return random.choice(self.templates).render()
+
+    __call__ = render
+
+
+def _selftest(rows=20000):
+    import time
+    doc = JsonTemplate({"id": Uuid(), "lang": Choice(["en", "de"]), "age": Int(18, 90), "score": Normal(120, 90),
+                        "tags": [Text(3, 8), Text(3, 8)], "meta": {"ok": Bool(), "note": Nullable(Text(3, 20))}})
+    for _ in range(1000):
+        json.loads(doc.render())
+    t0 = time.time()
+    for _ in range(rows):
+        doc.render()
+    dt = time.time() - t0
+    print(f"JsonTemplate (7 slots): {rows / dt:,.0f} docs/s")
+    nested = RandomDocument(n=10, depth=2)
+    for _ in range(1000):
+        json.loads(nested.render())
+    t0 = time.time()
+    for _ in range(rows):
+        nested.render()
+    dt = time.time() - t0
+    print(f"RandomDocument (10 keys, depth 2): {rows / dt:,.0f} docs/s")
+
+
+if __name__ == "__main__":
+    _selftest()
@@ -0,0 +1,1878 @@
+"""
+load_test_backends.py
+Работа с базой для load_test_prod.py: пулы соединений PostgreSQL/MySQL, выбор ключей, реплики,
+операции нагрузок prod_sim, ecommerce, contention и OLAP, наполнение таблиц (--seed).
+"""
+
+import ctypes
+import json
+import multiprocessing
+import random
+import select
+import string
+import time
+import os
+import threading
+import sys
+import uuid
+import weakref
+from contextlib import contextmanager
+from collections import defaultdict
+from datetime import timedelta
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
+
+from json_synth import JsonTemplate, Choice, Nullable, Normal, Pattern, Uuid
+from load_test_common import (
+    psycopg, mysql_driver, MYSQL_CLIENT, STOP, now_ts, rand_string, quote_ident, quote_mysql_ident, to_dollar_params,
+)
+from load_test_stats import LatencyHistogram, OpRecorder, format_latency_table
+
+
+DEFAULT_DURATION = 300
+DEFAULT_KEY_DIST = "uniform"
+DEFAULT_KEY_MODE = "range"
+DEFAULT_KEY_REFRESH = 10.0
+DEFAULT_KEY_SAMPLE_SIZE = 10000
+DEFAULT_KEY_RETRIES = 3
+
+DEFAULT_PROTOCOL = "simple"
+
+# --churn: состояние libpq (PQstatus) во время установки соединения -> фаза в отчёте
+CONNECT_PHASES = ('tcp', 'tls', 'auth', 'startup', 'query')
+PQSTATUS_PHASE = {
+    2: 'tcp',      # CONNECTION_STARTED — ждём TCP connect
+    3: 'tcp',      # CONNECTION_MADE — соединение есть, отправляем startup/SSLRequest
+    7: 'tls',      # CONNECTION_SSL_STARTUP
+    11: 'tls',     # CONNECTION_GSS_STARTUP
+    4: 'auth',     # CONNECTION_AWAITING_RESPONSE — startup packet и обмен аутентификацией (в т.ч. fork бэкенда)
+    5: 'startup',  # CONNECTION_AUTH_OK — ждём ReadyForQuery от бэкенда
+    6: 'startup',  # CONNECTION_SETENV
+}
+
+# --replica: маршрутизация чтений и замер задержки репликации по heartbeat
+READ_EWMA_ALPHA = 0.2   # least_latency: вес последней операции в скользящем среднем времени реплики
+READ_PROBE = 0.05       # least_latency: доля случайных выборов, чтобы оценка «медленной» реплики обновлялась
+
+LAG_POLL = 0.01         # как часто каждая реплика опрашивается на новый heartbeat (точность замера)
+HEARTBEAT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS lt_heartbeat (id int PRIMARY KEY, seq bigint NOT NULL, ts timestamptz NOT NULL DEFAULT now());
+    INSERT INTO lt_heartbeat (id, seq) VALUES (1, 0) ON CONFLICT (id) DO NOTHING"""
+HEARTBEAT_WRITE_SQL = "UPDATE lt_heartbeat SET seq = seq + 1, ts = now() WHERE id = 1 RETURNING seq"
+HEARTBEAT_READ_SQL = "SELECT seq FROM lt_heartbeat WHERE id = 1"
+
+DEFAULT_SEED_JOBS = min(8, os.cpu_count() or 1)
+SEED_CHUNK_ROWS = 1_000_000        # строк на одну COPY-задачу (задачи идут параллельно в --seed_jobs процессах)
+SEED_BATCH_ROWS = 10_000           # строк на один read() потока COPY
+SEED_REBUILD_INDEXES_MIN = 100_000 # пустую таблицу от стольких строк грузим без индексов и строим их после
+SEED_MAINTENANCE_WORK_MEM = "512MB"
+
+# Шаблоны запросов операций: {tbl} — имя таблицы, %s — параметры.
+# simple отправляет их как есть, prepared — через PREPARE/EXECUTE, pipeline — пачкой в pipeline mode libpq.
+STATEMENTS = {
+    'select_point': "SELECT id, key_text, data, value FROM {tbl} WHERE id = %s",
+    'select_range': "SELECT id,key_text,value FROM {tbl} WHERE value BETWEEN %s AND %s LIMIT 200",
+    'insert': "INSERT INTO {tbl} (key_text, data, value) VALUES (%s,%s,%s) RETURNING id",
+    # в pipeline ошибка одного запроса отменяет всю пачку до Sync — случайный дубль key_text так не роняет соседей
+    'insert_pipelined': "INSERT INTO {tbl} (key_text, data, value) VALUES (%s,%s,%s) ON CONFLICT (key_text) DO NOTHING RETURNING id",
+    'update': "UPDATE {tbl} SET data = %s, value = %s WHERE id = %s",
+    'delete': "DELETE FROM {tbl} WHERE id = %s",
+    'upsert': """
+        INSERT INTO {tbl} (key_text, data, value) VALUES (%s,%s,%s)
+        ON CONFLICT (key_text) DO UPDATE SET data = EXCLUDED.data, value = EXCLUDED.value
+        RETURNING id""",
+    'lock_row': "SELECT id, value FROM {tbl} WHERE id = %s FOR UPDATE",
+    'bump': "UPDATE {tbl} SET value = value + 1 WHERE id = %s",
+    'insert_plain': "INSERT INTO {tbl} (key_text, data, value) VALUES (%s,%s,%s)",
+    # строка batch_insert для executemany (asyncpg, MySQL); psycopg2 собирает один VALUES через execute_values
+    'batch_insert': "INSERT INTO {tbl} (key_text, data, value) VALUES (%s,%s,%s) ON CONFLICT (key_text) DO NOTHING",
+    'join': """
+        SELECT m.id, m.key_text, l.name, l.meta
+        FROM {tbl} m
+        JOIN lookup_table l ON (l.id = (m.id %% 200) + 1)
+        WHERE m.value BETWEEN %s AND %s
+        LIMIT 100""",
+}
+# --backend mysql: те же операции на InnoDB. RETURNING нет — id новой строки из cursor.lastrowid
+# (в upsert id = LAST_INSERT_ID(id) отдаёт id и обновлённой строки); ON CONFLICT -> ON DUPLICATE KEY UPDATE
+MYSQL_STATEMENTS = dict(
+    STATEMENTS,
+    insert="INSERT INTO {tbl} (key_text, data, value) VALUES (%s,%s,%s)",
+    upsert="""
+        INSERT INTO {tbl} (key_text, data, value) VALUES (%s,%s,%s)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), data = VALUES(data), value = VALUES(value)""",
+    # аналог ON CONFLICT DO NOTHING: INSERT IGNORE глушил бы и ошибки данных, не только дубли ключа
+    batch_insert="INSERT INTO {tbl} (key_text, data, value) VALUES (%s,%s,%s) ON DUPLICATE KEY UPDATE id = id",
+)
+# key_text — VARCHAR(191): уникальный индекс utf8mb4 укладывается в 767 байт и на старых форматах строк
+MYSQL_TABLE_DDL = """
+CREATE TABLE IF NOT EXISTS {tbl} (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    key_text VARCHAR(191) NOT NULL,
+    data TEXT,
+    value INT,
+    created TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+    UNIQUE KEY uk_key_text (key_text),
+    KEY idx_value (value)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+MYSQL_LOOKUP_DDL = """
+CREATE TABLE IF NOT EXISTS lookup_table (
+    id INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(191),
+    meta TEXT,
+    UNIQUE KEY uk_name (name)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"""
+
+MYSQL_SERVER_STATUS_IN_TRANS = 0x0001  # флаг SERVER_STATUS_IN_TRANS в OK/EOF-пакетах сервера
+
+ECOMMERCE_STATEMENTS = {
+    # в synth_prod_db.py email аккаунта id=N — userN-1@example.com, так что логин по email не требует выборки email
+    'login_lookup': "SELECT id, full_name, preferences FROM accounts WHERE email = %s AND is_active",
+    'login_touch': "UPDATE accounts SET last_login = now() WHERE id = %s",
+    'session_start': "INSERT INTO sessions (id, account_id, ip, user_agent, started_at) VALUES (%s, %s, %s, %s, now())",
+    'event': "INSERT INTO events (account_id, type, payload, created_at) VALUES (%s, %s, %s, now())",
+    'browse': """
+        SELECT p.id, p.name, p.price, p.currency, c.name, coalesce(s.available, 0)
+        FROM products p
+        JOIN categories c ON c.id = p.category_id
+        LEFT JOIN LATERAL (SELECT sum(i.qty - i.reserved) AS available FROM inventory i WHERE i.product_id = p.id) s ON true
+        WHERE p.category_id = %s
+        ORDER BY p.created_at DESC
+        LIMIT %s OFFSET %s""",
+    'product': "SELECT id, name, price, currency, attributes FROM products WHERE id = %s",
+    'product_prices': "SELECT id, price, currency FROM products WHERE id = ANY(%s) ORDER BY id",
+    'reserve': """
+        UPDATE inventory SET reserved = reserved + %s, updated_at = now()
+        WHERE product_id = %s AND warehouse_id = (
+            SELECT warehouse_id FROM inventory WHERE product_id = %s AND qty - reserved >= %s
+            ORDER BY qty - reserved DESC LIMIT 1)""",
+    'order_insert': """
+        INSERT INTO orders (id, account_id, status, total_amount, currency, created_at, updated_at, metadata)
+        VALUES (nextval('lt_orders_id_seq'), %s, 'new', %s, %s, now(), now(), %s)
+        RETURNING id, created_at""",
+    'item_insert': """
+        INSERT INTO order_items (id, order_id, order_created, product_id, qty, unit_price, discount)
+        VALUES (nextval('lt_order_items_id_seq'), %s, %s, %s, %s, %s, 0)""",
+    'payment_insert': """
+        INSERT INTO payments (id, order_id, order_created, amount, method, status, details, paid_at)
+        VALUES (nextval('lt_payments_id_seq'), %s, %s, %s, %s, 'authorized', %s, now())""",
+    'order_history': """
+        SELECT o.id, o.created_at, o.status, o.total_amount, o.currency, count(oi.id) AS items
+        FROM orders o
+        LEFT JOIN order_items oi ON oi.order_id = o.id AND oi.order_created = o.created_at
+        WHERE o.account_id = %s
+        GROUP BY o.id, o.created_at, o.status, o.total_amount, o.currency
+        ORDER BY o.created_at DESC
+        LIMIT %s OFFSET %s""",
+    # GIN-индексы products_attr_gin, products_tags_gin, accounts_prefs_gin, events_payload_gin
+    'search_product_attrs': "SELECT id, name, price FROM products WHERE attributes @> %s::jsonb LIMIT 50",
+    'search_product_tags': "SELECT id, name, price FROM products WHERE tags @> ARRAY[%s]::text[] LIMIT 50",
+    'search_account_prefs': "SELECT id FROM accounts WHERE preferences @> %s::jsonb LIMIT 50",
+    'search_events': "SELECT id, type, created_at FROM events WHERE payload @> %s::jsonb AND created_at > now() - interval '1 day' LIMIT 50",
+}
+# Таблицы с явными BIGINT id без sequence: новые id берутся из своих sequence, выставленных за max(id)
+ECOMMERCE_ID_SEQUENCES = ('orders', 'order_items', 'payments')
+ECOMMERCE_PARTITIONED = ('orders', 'events')
+ECOMMERCE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_products_category ON products (category_id);
+CREATE INDEX IF NOT EXISTS products_tags_gin ON products USING gin (tags);
+CREATE INDEX IF NOT EXISTS products_attr_gin ON products USING gin (attributes);
+CREATE INDEX IF NOT EXISTS accounts_prefs_gin ON accounts USING gin (preferences);
+CREATE INDEX IF NOT EXISTS idx_orders_account ON orders (account_id);
+CREATE INDEX IF NOT EXISTS idx_orderitems_order ON order_items (order_id, order_created);
+CREATE INDEX IF NOT EXISTS events_payload_gin ON events USING gin (payload);
+"""
+# значения как в synth_prod_db.py
+EVENT_TYPES = ["auth.login", "auth.logout", "cart.add", "cart.remove", "order.create", "order.pay", "order.cancel",
+               "shipment.create", "page.view", "search.query", "profile.update", "review.create"]
+PRODUCT_TAGS = ["sale", "new", "exclusive", "eco", "refurbished", "bundle", "limited"]
+PRODUCT_ATTRS = {"color": ["red", "green", "blue", "black", "white", "silver", "gold"], "size": ["XS", "S", "M", "L", "XL"],
+                 "material": ["cotton", "plastic", "metal", "leather", "glass", "wood"]}
+PAYMENT_METHODS = ["card", "cash", "paypal", "crypto", "bank_transfer", "apple_pay", "google_pay"]
+PAYMENT_WEIGHTS = [60, 5, 15, 3, 10, 4, 3]
+USER_AGENTS = ["Mozilla/5.0 (Windows NT 10.0; Win64; x64)", "Mozilla/5.0 (Macintosh; Intel Mac OS X 13_4)",
+               "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)", "Mozilla/5.0 (Linux; Android 14)"]
+EVENT_PAYLOAD_DOC = JsonTemplate({"request_id": Uuid(), "ua": Choice(USER_AGENTS), "path": Pattern("/catalog/??????/#####"),
+                                  "latency_ms": Normal(120, 90), "ab": Choice(["A", "B", "C"])})
+ORDER_META_DOC = JsonTemplate({"channel": Choice(["web", "mobile", "support"]),
+                               "campaign": Nullable(Choice(["spring", "black_friday", "newsletter", "retargeting"]), p_null=0.8)})
+PAYMENT_DETAILS_DOC = JsonTemplate({"auth_code": Pattern("????-########")})
+
+CONTENTION_COUNTERS = 100
+CONTENTION_SKUS = 1000
+CONTENTION_STOCK = 1000  # начальный остаток и размер пополнения, когда остатка не хватает
+CONTENTION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lt_counters (id INT PRIMARY KEY, n BIGINT NOT NULL DEFAULT 0, updated_at TIMESTAMPTZ NOT NULL DEFAULT now());
+CREATE TABLE IF NOT EXISTS lt_stock (id INT PRIMARY KEY, qty INT NOT NULL, sold BIGINT NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS lt_jobs (id BIGSERIAL PRIMARY KEY, payload TEXT NOT NULL, created_at TIMESTAMPTZ NOT NULL DEFAULT now());
+"""
+CONTENTION_STATEMENTS = {
+    'counter_bump': "UPDATE lt_counters SET n = n + 1, updated_at = now() WHERE id = %s",
+    'counter_move': "UPDATE lt_counters SET n = n + %s, updated_at = now() WHERE id = %s",
+    'stock_lock': "SELECT qty FROM lt_stock WHERE id = %s FOR UPDATE",
+    'stock_take': "UPDATE lt_stock SET qty = qty - %s, sold = sold + %s WHERE id = %s",
+    'stock_refill': "UPDATE lt_stock SET qty = qty + %s WHERE id = %s",
+    'job_push': "INSERT INTO lt_jobs (payload) VALUES (%s)",
+    # потребители не ждут друг друга: занятые строки пропускаются
+    'job_pop': """
+        DELETE FROM lt_jobs WHERE id = (
+            SELECT id FROM lt_jobs ORDER BY id FOR UPDATE SKIP LOCKED LIMIT 1)
+        RETURNING id, payload""",
+}
+# --olap: аналитические запросы над данными synth_prod_db; (таблица, по диапазону created_at которой берётся окно, SQL)
+OLAP_STATEMENTS = {
+    'daily_revenue': ('orders', """
+        SELECT date_trunc('day', o.created_at) AS day, c.name, count(DISTINCT o.id) AS orders, sum(oi.subtotal) AS revenue
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id AND oi.order_created = o.created_at
+        JOIN products p ON p.id = oi.product_id
+        JOIN categories c ON c.id = p.category_id
+        WHERE o.created_at >= %s AND o.created_at < %s
+        GROUP BY 1, 2 ORDER BY 1, 4 DESC"""),
+    'top_products': ('orders', """
+        SELECT * FROM (
+            SELECT p.category_id, oi.product_id, sum(oi.qty) AS units, sum(oi.subtotal) AS revenue,
+                   rank() OVER (PARTITION BY p.category_id ORDER BY sum(oi.qty) DESC) AS rnk
+            FROM order_items oi JOIN products p ON p.id = oi.product_id
+            WHERE oi.order_created >= %s AND oi.order_created < %s
+            GROUP BY 1, 2) t
+        WHERE rnk <= 10 ORDER BY category_id, rnk"""),
+    'running_totals': ('orders', """
+        SELECT account_id, created_at, total_amount,
+               sum(total_amount) OVER w AS running_total,
+               total_amount - lag(total_amount) OVER w AS delta,
+               ntile(10) OVER (ORDER BY total_amount) AS decile
+        FROM orders WHERE created_at >= %s AND created_at < %s
+        WINDOW w AS (PARTITION BY account_id ORDER BY created_at)
+        ORDER BY running_total DESC LIMIT 100"""),
+    'payment_mix': ('orders', """
+        SELECT pm.method, o.status, a.is_active, count(*) AS orders, sum(pm.amount) AS amount,
+               avg(pm.paid_at - o.created_at) AS time_to_pay, count(DISTINCT o.account_id) AS buyers
+        FROM orders o
+        JOIN payments pm ON pm.order_id = o.id AND pm.order_created = o.created_at
+        JOIN accounts a ON a.id = o.account_id
+        WHERE o.created_at >= %s AND o.created_at < %s
+        GROUP BY 1, 2, 3 ORDER BY 5 DESC"""),
+    'event_funnel': ('events', """
+        SELECT date_trunc('hour', created_at) AS hour, type, count(*) AS events, count(DISTINCT account_id) AS accounts,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY (payload->>'latency_ms')::numeric) AS latency_p50
+        FROM events WHERE created_at >= %s AND created_at < %s
+        GROUP BY 1, 2 ORDER BY 1, 2"""),
+}
+DEFAULT_OLAP_WINDOW = 30.0   # дней данных на один аналитический запрос (случайное окно внутри диапазона таблицы)
+DEFAULT_OLAP_TIMEOUT = 300.0 # statement_timeout аналитических соединений, секунды
+ISOLATION_LEVELS = {'read_committed': 'READ COMMITTED', 'repeatable_read': 'REPEATABLE READ', 'serializable': 'SERIALIZABLE'}
+
+
+def mysql_connect(conn_kwargs):
+    """Соединение MySQL из тех же conn_kwargs, что у psycopg2; host с '/' — путь к unix-сокету."""
+    kw = conn_kwargs
+    where = dict(unix_socket=kw['host']) if kw['host'].startswith('/') else dict(host=kw['host'], port=int(kw['port']))
+    # FOUND_ROWS: rowcount UPDATE — найденные, а не изменённые строки, как в PostgreSQL (иначе UPDATE тем же значением — промах)
+    return mysql_driver.connect(user=kw['user'], password=kw['password'], database=kw['dbname'], charset='utf8mb4',
+                                autocommit=False, client_flag=MYSQL_CLIENT.FOUND_ROWS, **where)
+
+
+class MySQLPool:
+    """Пул соединений MySQL с интерфейсом psycopg2 ThreadedConnectionPool (getconn/putconn/closeall)."""
+
+    def __init__(self, minconn, maxconn, **conn_kwargs):
+        self.maxconn = maxconn
+        self.conn_kwargs = conn_kwargs
+        self.lock = threading.Lock()
+        self.idle = [mysql_connect(conn_kwargs) for _ in range(minconn)]
+        self.all = list(self.idle)
+        self.used = 0
+
+    def getconn(self):
+        with self.lock:
+            if self.idle:
+                self.used += 1
+                return self.idle.pop()
+            if self.used >= self.maxconn:
+                raise psycopg2.pool.PoolError("connection pool exhausted")
+            self.used += 1
+        try:
+            conn = mysql_connect(self.conn_kwargs)
+        except Exception:
+            with self.lock:
+                self.used -= 1
+            raise
+        with self.lock:
+            self.all.append(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        if not close:
+            # как ThreadedConnectionPool: соединение возвращается без открытой транзакции, иначе следующий
+            # клиент читает старый снимок REPEATABLE READ, а InnoDB не может делать purge весь прогон.
+            # PyMySQL знает статус транзакции из последнего ответа сервера; у mysqlclient его нет — откатываем всегда
+            status = getattr(conn, 'server_status', None)
+            if status is None or status & MYSQL_SERVER_STATUS_IN_TRANS:
+                try:
+                    conn.rollback()
+                except mysql_driver.MySQLError:
+                    close = True
+        with self.lock:
+            self.used -= 1
+            if not close:
+                self.idle.append(conn)
+                return
+            self.all.remove(conn)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def closeall(self):
+        with self.lock:
+            conns, self.all, self.idle = self.all, [], []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def make_pool(backend, minconn, maxconn, conn_kwargs):
+    if backend == 'mysql':
+        return MySQLPool(minconn, maxconn, **conn_kwargs)
+    return ThreadedConnectionPool(minconn, maxconn, **conn_kwargs)
+
+
+class KeyDistribution:
+    """
+    Выбор ранга 0..n-1 по распределению: uniform | zipf:<theta> | hotspot:<fraction>:<probability> |
+    latest:<theta> (zipf от конца: чаще всего — самые новые id).
+    """
+
+    # мультипликативное перемешивание рангов: горячие ключи zipf не должны быть просто самыми старыми id
+    SCRAMBLE = 2654435761
+
+    def __init__(self, spec=DEFAULT_KEY_DIST):
+        self.spec = spec
+        parts = spec.split(':')
+        self.kind = parts[0]
+        try:
+            if self.kind == 'uniform' and len(parts) == 1:
+                return
+            if self.kind in ('zipf', 'latest') and len(parts) <= 2:
+                self.theta = float(parts[1]) if len(parts) == 2 else 0.99
+                if self.theta <= 0:
+                    raise ValueError
+                return
+            if self.kind == 'hotspot' and len(parts) <= 3:
+                self.hot_fraction = float(parts[1]) if len(parts) > 1 else 0.1
+                self.hot_prob = float(parts[2]) if len(parts) > 2 else 0.9
+                if not (0 < self.hot_fraction < 1 and 0 <= self.hot_prob <= 1):
+                    raise ValueError
+                return
+        except ValueError:
+            pass
+        raise ValueError(f"Bad key distribution {spec!r}: expected uniform, zipf:<theta>, hotspot:<fraction>:<probability> "
+                         f"or latest:<theta>")
+
+    def rank(self, n, rnd=random.random):
+        u = rnd()
+        if self.kind == 'uniform':
+            return int(u * n)
+        if self.kind in ('zipf', 'latest'):
+            # обратная функция непрерывного приближения закона Ципфа, O(1) на выбор
+            if self.theta == 1.0:
+                r = int(n ** u)
+            else:
+                a = 1.0 - self.theta
+                r = int(((n ** a - 1.0) * u + 1.0) ** (1.0 / a))
+            r = min(max(r, 1), n)
+            if self.kind == 'latest':
+                return n - r  # ранг 1 — наибольший id диапазона (или выборки)
+            return ((r - 1) * self.SCRAMBLE) % n
+        hot = max(1, int(n * self.hot_fraction))
+        if u < self.hot_prob or hot >= n:
+            return int(rnd() * hot)
+        return hot + int(rnd() * (n - hot))
+
+
+class KeySampler:
+    """
+    Клиентский выбор существующих id вместо ORDER BY random():
+    - mode='range': живой диапазон [min(id), max(id)] по таблице (обновляется раз в refresh_interval
+      и расширяется id, которые вернули наши же INSERT ... RETURNING);
+    - mode='sample': периодически обновляемая выборка существующих id (TABLESAMPLE SYSTEM).
+    Промахи (удалённые строки, дыры в serial) считаются, операция повторяет выбор до max_retries раз.
+    dist — распределение по умолчанию и по операциям: "zipf:0.99,update=hotspot:0.01:0.9,select_point=latest".
+    """
+
+    def __init__(self, dist=DEFAULT_KEY_DIST, mode=DEFAULT_KEY_MODE, refresh_interval=DEFAULT_KEY_REFRESH,
+                 sample_size=DEFAULT_KEY_SAMPLE_SIZE, max_retries=DEFAULT_KEY_RETRIES, quote=quote_ident):
+        if mode not in ('range', 'sample'):
+            raise ValueError(f"Bad key mode {mode!r}: expected range or sample")
+        self.dist, self.op_dists = self.parse_dists(dist)
+        self.mode = mode
+        self.refresh_interval = refresh_interval
+        self.sample_size = sample_size
+        self.max_retries = max(1, max_retries)
+        self.quote = quote  # --backend mysql: `имя`
+        self.lock = threading.Lock()
+        self.bounds = {}
+        self.samples = {}
+        self.refreshed = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def parse_dists(spec):
+        """'dist,op=dist,...' -> (распределение по умолчанию, {op: распределение})."""
+        if isinstance(spec, KeyDistribution):
+            return spec, {}
+        default, per_op = None, {}
+        for item in (x.strip() for x in spec.split(',')):
+            op, eq, dist = item.partition('=')
+            if not eq:
+                if default is not None:
+                    raise ValueError(f"Bad key distribution {spec!r}: more than one default distribution")
+                default = KeyDistribution(item)
+            elif not op.strip() or op.strip() in per_op:
+                raise ValueError(f"Bad key distribution {spec!r}: expected <dist>,<op>=<dist>,...")
+            else:
+                per_op[op.strip()] = KeyDistribution(dist.strip())
+        return default or KeyDistribution(DEFAULT_KEY_DIST), per_op
+
+    def _claim_refresh(self, table):
+        # только один поток обновляет таблицу; остальные продолжают со старыми границами
+        with self.lock:
+            now = time.time()
+            if now - self.refreshed.get(table, 0.0) < self.refresh_interval:
+                return False
+            self.refreshed[table] = now
+            return True
+
+    def _set_bounds(self, table, lo, hi):
+        with self.lock:
+            if lo is None:
+                self.bounds.pop(table, None)
+            else:
+                old = self.bounds.get(table)
+                # max(id) мог уже устареть относительно note_insert() других потоков
+                self.bounds[table] = (lo, max(hi, old[1]) if old else hi)
+
+    def _sample_pct(self, reltuples):
+        return min(100.0, 200.0 * self.sample_size / max(1.0, float(reltuples)))
+
+    def _set_sample(self, table, ids):
+        ids = sorted(ids)
+        with self.lock:
+            self.samples[table] = ids
+
+    def refresh(self, table, cur):
+        # строки, а не psycopg2.sql: тот же код работает и с курсором psycopg 3 (--protocol pipeline) и MySQL
+        tbl = self.quote(table)
+        if self.mode == 'range':
+            cur.execute(f"SELECT min(id), max(id) FROM {tbl}")
+            self._set_bounds(table, *cur.fetchone())
+            return
+        cur.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", (table,))
+        pct = self._sample_pct(cur.fetchone()[0])
+        cur.execute(f"SELECT id FROM {tbl} TABLESAMPLE SYSTEM (%s) LIMIT %s", (pct, self.sample_size))
+        self._set_sample(table, [r[0] for r in cur.fetchall()])
+
+    async def refresh_async(self, table, conn):
+        tbl = quote_ident(table)
+        if self.mode == 'range':
+            row = await conn.fetchrow(f"SELECT min(id), max(id) FROM {tbl}")
+            self._set_bounds(table, row[0], row[1])
+            return
+        reltuples = await conn.fetchval("SELECT reltuples FROM pg_class WHERE oid = $1::regclass", table)
+        rows = await conn.fetch(f"SELECT id FROM {tbl} TABLESAMPLE SYSTEM ({self._sample_pct(reltuples):f}) LIMIT $1",
+                                self.sample_size)
+        self._set_sample(table, [r[0] for r in rows])
+
+    def _pick_cached(self, table, op=None, rnd=random.random):
+        dist = self.op_dists.get(op, self.dist)
+        if self.mode == 'range':
+            b = self.bounds.get(table)
+            if b is None:
+                return None
+            lo, hi = b
+            return lo + dist.rank(hi - lo + 1, rnd)
+        ids = self.samples.get(table)
+        if not ids:
+            return None
+        return ids[dist.rank(len(ids), rnd)]
+
+    def pick(self, table, cur, op=None, rnd=random.random):
+        """Случайный id таблицы по распределению операции op или None, если таблица пуста; rnd — генератор клиента."""
+        if self._claim_refresh(table):
+            self.refresh(table, cur)
+        return self._pick_cached(table, op, rnd)
+
+    async def pick_async(self, table, conn, op=None, rnd=random.random):
+        if self._claim_refresh(table):
+            await self.refresh_async(table, conn)
+        return self._pick_cached(table, op, rnd)
+
+    def note_insert(self, table, key):
+        if self.mode != 'range' or key is None:
+            return
+        with self.lock:
+            b = self.bounds.get(table)
+            if b is not None and key > b[1]:
+                self.bounds[table] = (b[0], key)
+
+    def hit(self):
+        with self.lock:
+            self.hits += 1
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def snapshot(self):
+        with self.lock:
+            return self.hits, self.misses
+
+
+def green_wait(conn, on_poll=None):
+    """
+    wait callback green-режима psycopg2: libpq опрашивается из Python, ожидание сокета — select.
+    on_poll(conn) вызывается после каждого poll(), пока соединение в том состоянии, в котором будем ждать.
+    """
+    while True:
+        state = conn.poll()
+        if on_poll is not None:
+            on_poll(conn)
+        if state == psycopg2.extensions.POLL_OK:
+            break
+        elif state == psycopg2.extensions.POLL_READ:
+            select.select([conn.fileno()], [], [])
+        elif state == psycopg2.extensions.POLL_WRITE:
+            select.select([], [conn.fileno()], [])
+        else:
+            raise psycopg2.OperationalError(f"bad state from poll: {state}")
+
+
+class ConnectTracer:
+    """
+    --churn: новое соединение на долю операций и разбивка его установки на фазы tcp/tls/auth/startup
+    плюс query (сама операция на свежем соединении). psycopg2 не отдаёт фазы, поэтому ставим wait callback
+    (green_wait) и на каждом шаге читаем PQstatus соединения через ctypes — тот же libpq, с которым собран
+    psycopg2. Callback в psycopg2 один на процесс, так что запросы пуловых соединений тоже опрашиваются
+    из Python: плюс единицы-десятки микросекунд и GIL на запрос. Базовый прогон без --churn для сравнения
+    запускайте с --green — тот же callback без трассировки.
+    """
+
+    def __init__(self, conn_kwargs):
+        self.conn_kwargs = conn_kwargs
+        self.lib = ctypes.CDLL(psycopg2._psycopg.__file__)
+        self.lib.PQstatus.restype = ctypes.c_int
+        self.lib.PQstatus.argtypes = [ctypes.c_void_p]
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hists = defaultdict(LatencyHistogram)
+        self.opened = 0
+        self.failed = 0
+        self.prev_opened = 0
+        self.prev_time = time.time()
+
+    def install(self):
+        # после --seed: в green-режиме psycopg2 не умеет COPY
+        psycopg2.extensions.set_wait_callback(self.wait)
+
+    def wait(self, conn):
+        trace = getattr(self.local, 'trace', None)
+        if trace is None:
+            green_wait(conn)
+            return
+        # состояние после poll() — то, в котором сейчас будем ждать сокет
+        green_wait(conn, lambda c: trace.append((time.perf_counter(), self.lib.PQstatus(c.pgconn_ptr))))
+
+    def record(self, phase, seconds):
+        with self.lock:
+            self.hists[phase].record(seconds)
+
+    def connect(self):
+        """Новое соединение на --churn_host/--churn_port; время фаз — в hists."""
+        trace = self.local.trace = []
+        start = time.perf_counter()
+        try:
+            conn = psycopg2.connect(**self.conn_kwargs)
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            self.local.trace = None
+        end = time.perf_counter()
+        phases = defaultdict(float)
+        # до первой точки — PQconnectStart (резолв имени, socket(), начало connect) и первый poll(): tcp
+        points = trace + [(end, 0)]
+        phases['tcp'] += points[0][0] - start
+        for (t0, status), (t1, _) in zip(points, points[1:]):
+            phases[PQSTATUS_PHASE.get(status, 'startup')] += t1 - t0
+        with self.lock:
+            self.opened += 1
+            for phase, seconds in phases.items():
+                self.hists[phase].record(seconds)
+            self.hists['connect'].record(end - start)
+        return conn
+
+    def status(self):
+        with self.lock:
+            now = time.time()
+            rate = (self.opened - self.prev_opened) / max(now - self.prev_time, 1e-9)
+            self.prev_opened, self.prev_time = self.opened, now
+            p50 = self.hists['connect'].percentile(50) * 1000
+            return f"connects={self.opened} ({rate:.1f}/s) connect_failed={self.failed} connect_p50={p50:.2f}ms"
+
+    def report(self, span):
+        with self.lock:
+            hists = {phase: LatencyHistogram().merge(self.hists[phase]) for phase in CONNECT_PHASES + ('connect',)
+                     if self.hists[phase].total}
+            opened, failed = self.opened, self.failed
+        print(f"[{now_ts()}] Connections: opened={opened} failed={failed} conn/s={opened / span if span > 0 else 0:.2f}")
+        print(format_latency_table(hists, span, total_row=False))
+
+
+class Replicas:
+    """
+    --replica: пулы реплик для читающих операций и задержка репликации.
+    Маршрутизация (--read_policy): round_robin — по кругу; least_latency — реплика с наименьшим скользящим
+    средним времени операции, умноженным на (1 + операций в полёте), плюс доля READ_PROBE случайных выборов.
+    Задержка: раз в --lag_interval поток на primary увеличивает seq в lt_heartbeat (autocommit) и запоминает
+    момент подтверждения COMMIT; поток на каждую реплику опрашивает seq раз в LAG_POLL с и, увидев новое значение,
+    записывает lag = момент, когда увидел, - момент COMMIT (точность — LAG_POLL плюс round trip опроса).
+    """
+
+    def __init__(self, replicas, pool_size, policy, primary_kwargs, lag_interval):
+        self.names = [name for name, _ in replicas]
+        self.kwargs = [kw for _, kw in replicas]
+        self.pools = [make_pool('postgres', 1, pool_size, kw) for kw in self.kwargs]
+        self.policy = policy
+        self.primary_kwargs = primary_kwargs
+        self.lag_interval = lag_interval
+        self.lock = threading.Lock()
+        self.next = 0
+        self.ewma = [None] * len(self.names)
+        self.inflight = [0] * len(self.names)
+        # по реплике: (seq, момент COMMIT) ещё не увиденных на ней heartbeat
+        self.pending = [[] for _ in self.names]
+        self.reads = OpRecorder()
+        self.lag = OpRecorder()
+        self.total_reads = defaultdict(LatencyHistogram)
+        self.total_lag = defaultdict(LatencyHistogram)
+        self.threads = []
+
+    def pick(self):
+        with self.lock:
+            n = len(self.names)
+            if self.policy == 'round_robin':
+                i = self.next
+                self.next = (i + 1) % n
+            elif None in self.ewma or random.random() < READ_PROBE:
+                unknown = [j for j, e in enumerate(self.ewma) if e is None]
+                i = random.choice(unknown or range(n))
+            else:
+                i = min(range(n), key=lambda j: self.ewma[j] * (1 + self.inflight[j]))
+            self.inflight[i] += 1
+            return i
+
+    @contextmanager
+    def conn(self):
+        i = self.pick()
+        pool = self.pools[i]
+        conn = None
+        ok = False
+        start = time.perf_counter()
+        try:
+            conn = pool.getconn()
+            yield conn
+            ok = True
+        finally:
+            elapsed = time.perf_counter() - start
+            if conn is not None:
+                pool.putconn(conn)
+            with self.lock:
+                self.inflight[i] -= 1
+                e = self.ewma[i]
+                # ошибка быстрее удачного чтения — не даём упавшей реплике притягивать запросы
+                sample = elapsed if ok else max(2 * (e or elapsed), elapsed)
+                self.ewma[i] = sample if e is None else e + READ_EWMA_ALPHA * (sample - e)
+            if ok:
+                self.reads.record(self.names[i], elapsed)
+
+    def start(self):
+        with psycopg2.connect(**self.primary_kwargs) as conn:
+            conn.cursor().execute(HEARTBEAT_SCHEMA)
+        conn.close()
+        self.threads = [threading.Thread(target=self.heartbeat, daemon=True, name="heartbeat")]
+        self.threads += [threading.Thread(target=self.poll, args=(i,), daemon=True, name=f"lag-{name}")
+                         for i, name in enumerate(self.names)]
+        for t in self.threads:
+            t.start()
+
+    def heartbeat(self):
+        conn = None
+        try:
+            conn = psycopg2.connect(**self.primary_kwargs)
+            conn.autocommit = True  # UPDATE вернулся — COMMIT подтверждён
+            cur = conn.cursor()
+            while not STOP.is_set():
+                t0 = time.perf_counter()
+                cur.execute(HEARTBEAT_WRITE_SQL)
+                seq = cur.fetchone()[0]
+                written = time.perf_counter()
+                with self.lock:
+                    for pending in self.pending:
+                        pending.append((seq, written))
+                STOP.wait(max(0.0, self.lag_interval - (time.perf_counter() - t0)))
+        except psycopg2.Error as e:
+            print(f"[{now_ts()}] Heartbeat stopped: {str(e).strip().splitlines()[0]}", file=sys.stderr)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def poll(self, i):
+        conn = None
+        failed = False
+        while not STOP.is_set():
+            try:
+                if conn is None:
+                    conn = psycopg2.connect(**self.kwargs[i])
+                    conn.autocommit = True
+                cur = conn.cursor()
+                cur.execute(HEARTBEAT_READ_SQL)
+                row = cur.fetchone()
+                seen = time.perf_counter()
+            except psycopg2.Error as e:
+                # lt_heartbeat ещё не доехала до реплики или соединение оборвалось — опрашиваем дальше
+                if not failed:
+                    print(f"[{now_ts()}] Replica {self.names[i]} heartbeat: {str(e).strip().splitlines()[0]}", file=sys.stderr)
+                    failed = True
+                if conn is not None and conn.closed:
+                    conn = None
+                STOP.wait(LAG_POLL * 10)
+                continue
+            if row:
+                with self.lock:
+                    pending = self.pending[i]
+                    n = 0
+                    while n < len(pending) and pending[n][0] <= row[0]:
+                        n += 1
+                    lags = [seen - written for _, written in pending[:n]]
+                    del pending[:n]
+                for lag in lags:
+                    self.lag.record(self.names[i], lag)
+            STOP.wait(LAG_POLL)
+        if conn is not None:
+            conn.close()
+
+    def staleness(self, i):
+        """Возраст самого старого heartbeat, ещё не видимого на реплике i (0 — реплика догнала primary)."""
+        with self.lock:
+            pending = self.pending[i]
+            return time.perf_counter() - pending[0][1] if pending else 0.0
+
+    def interval(self, span):
+        """Строка отчёта и сводка за интервал: чтения и задержка по репликам."""
+        reads, lag = self.reads.swap_interval(), self.lag.swap_interval()
+        parts, summary = [], {}
+        for i, name in enumerate(self.names):
+            r, l = reads.get(name, LatencyHistogram()), lag.get(name, LatencyHistogram())
+            self.total_reads[name].merge(r)
+            self.total_lag[name].merge(l)
+            stale = self.staleness(i)
+            summary[name] = {"reads": r.total, "read_p99": r.percentile(99), "lag_p50": l.percentile(50),
+                             "lag_p99": l.percentile(99), "lag_max": l.max_us / 1000000.0, "lag_now": stale}
+            parts.append(f"{name} reads/s={r.total / span if span > 0 else 0:.1f} p99={r.percentile(99) * 1000:.2f}ms "
+                         f"lag p50={l.percentile(50) * 1000:.1f} p99={l.percentile(99) * 1000:.1f} "
+                         f"max={l.max_us / 1000:.1f} now={stale * 1000:.1f}ms")
+        return " | ".join(parts), summary
+
+    def final_report(self, elapsed):
+        self.interval(elapsed)
+        print(f"[{now_ts()}] Reads per replica (--read_policy {self.policy}):")
+        print(format_latency_table(self.total_reads, elapsed))
+        print(f"[{now_ts()}] Replication lag per replica (heartbeat every {self.lag_interval:g}s, "
+              f"from COMMIT on primary to visible on replica):")
+        print(format_latency_table(self.total_lag, elapsed, total_row=False))
+
+    def summary(self):
+        """Для result.json: политика и итоговые гистограммы чтений и задержки по репликам."""
+        return {"policy": self.policy, "lag_interval": self.lag_interval,
+                "replicas": {name: {"host": f"{kw['host']}:{kw['port']}/{kw['dbname']}",
+                                    "reads": self.total_reads[name].encode(), "lag": self.total_lag[name].encode()}
+                             for name, kw in zip(self.names, self.kwargs)}}
+
+    def close(self):
+        for t in self.threads:
+            t.join(timeout=5)
+        for pool in self.pools:
+            pool.closeall()
+
+
+class ProdSimParams:
+    """
+    Случайные таблица и параметры операций prod_sim из генератора клиента self.rng — общие для DBWorker
+    (и MySQLWorker) и AsyncDBWorker, чтобы при одном --random_seed движки слали одинаковые значения.
+    """
+
+    def pick_table(self):
+        return self.rng.choice(self.table_names)
+
+    def new_row(self, data_len, value=None):
+        rng = self.rng
+        return f"k_{rng.randint(1, 1000000)}", rand_string(data_len, rng), rng.randint(1, 1000000) if value is None else value
+
+    def unique_row(self):
+        rng = self.rng
+        return f"unique_k_{rng.randint(1, 2000000)}", rand_string(64, rng), rng.randint(1, 1000000)
+
+    def update_values(self, key):
+        return rand_string(80, self.rng), self.rng.randint(1, 1000000), key
+
+    def range_bounds(self):
+        low = self.rng.randint(1, 1000)
+        return low, low + self.rng.randint(1, 200)
+
+    def join_bounds(self):
+        return self.rng.randint(1, 10000), self.rng.randint(10001, 20000)
+
+
+class DBWorker(ProdSimParams):
+    quote = staticmethod(quote_ident)
+
+    def __init__(self, pool, table_names, batch_insert=100, keys=None, protocol=DEFAULT_PROTOCOL, conn_kwargs=None):
+        self.pool = pool
+        self.table_names = table_names
+        self.batch_insert = batch_insert
+        self.keys = keys or KeySampler()
+        self.protocol = protocol
+        self.conn_kwargs = conn_kwargs
+        self.lock = threading.Lock()
+        self.queries = {}
+        self.prepared = weakref.WeakKeyDictionary()  # psycopg2 connection -> имена подготовленных запросов
+        self.local = threading.local()
+        self.pipeline_conns = []
+        self.statements = STATEMENTS
+        # --churn: доля операций на новом соединении (ConnectTracer) вместо пула
+        self.churn = 0.0
+        self.tracer = None
+        # --replica: Replicas, на которые уходят читающие операции (conn(read=True))
+        self.replicas = None
+        # время запросов, берущих блокировку строки (FOR UPDATE, UPDATE горячей строки), по операциям
+        self.lock_waits = OpRecorder()
+
+    @property
+    def rng(self):
+        """Генератор клиента, в потоке которого идёт операция (OpRunner.run, --random_seed), иначе общий random."""
+        return getattr(self.local, 'rng', random)
+
+    def ops_map(self):
+        return {
+            'select_point': self.op_select_point,
+            'select_range': self.op_select_range,
+            'insert': self.op_insert_single,
+            'batch_insert': self.op_batch_insert,
+            'update': self.op_update,
+            'delete': self.op_delete,
+            'upsert': self.op_upsert,
+            'transaction': self.op_transaction,
+            'join': self.op_join
+        }
+
+    @contextmanager
+    def conn(self, read=False):
+        if read and self.replicas:
+            with self.replicas.conn() as conn:
+                yield conn
+            return
+        if self.churn and self.rng.random() < self.churn:
+            conn = self.tracer.connect()
+            start = time.perf_counter()
+            try:
+                yield conn
+            finally:
+                self.tracer.record('query', time.perf_counter() - start)
+                conn.close()
+            return
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    def setup_schema(self):
+        with self.conn() as conn:
+            cur = conn.cursor()
+            # create tables with UNIQUE on key_text to allow ON CONFLICT
+            for t in self.table_names:
+                cur.execute(
+                    sql.SQL(
+                        """
+                        CREATE TABLE IF NOT EXISTS {tbl} (
+                            id SERIAL PRIMARY KEY,
+                            key_text TEXT NOT NULL UNIQUE,
+                            data TEXT,
+                            value INT,
+                            created TIMESTAMP WITH TIME ZONE DEFAULT now()
+                        );
+                        """
+                    ).format(tbl=sql.Identifier(t))
+                )
+                # helpful indexes
+                cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {idx} ON {tbl} (value);").format(
+                    idx=sql.Identifier(f"{t}_value_idx"), tbl=sql.Identifier(t)
+                ))
+            # lookup table
+            cur.execute(
+                """
+                CREATE TABLE IF NOT EXISTS lookup_table (
+                    id SERIAL PRIMARY KEY,
+                    name TEXT UNIQUE,
+                    meta TEXT
+                );
+                """
+            )
+            conn.commit()
+            cur.close()
+
+    def seed_initial_data(self, rows_per_table=1000, jobs=DEFAULT_SEED_JOBS):
+        """
+        Догоняет каждую таблицу до rows_per_table строк потоковым COPY. id берутся блоком из sequence
+        таблицы, key_text = seed_<id> — без коллизий, ровно столько строк, сколько не хватает.
+        Задачи по SEED_CHUNK_ROWS строк идут параллельно в jobs процессах на своих соединениях;
+        пустую большую таблицу грузим без индексов и ограничений и строим их после загрузки.
+        """
+        tasks = []
+        rebuild = {}
+        with self.conn() as conn:
+            cur = conn.cursor()
+            # seed lookup_table
+            cur.execute("SELECT count(*) FROM lookup_table;")
+            cnt = cur.fetchone()[0]
+            if cnt < 200:
+                vals = [(f"name_{i}", f"meta_{rand_string(8)}") for i in range(1, 401)]
+                execute_values(cur, "INSERT INTO lookup_table (name, meta) VALUES %s ON CONFLICT (name) DO NOTHING;", vals)
+
+            for t in self.table_names:
+                cur.execute(sql.SQL("SELECT count(*) FROM {tbl};").format(tbl=sql.Identifier(t)))
+                existing = cur.fetchone()[0]
+                to_insert = max(0, rows_per_table - existing)
+                if to_insert <= 0:
+                    continue
+                # резервируем id [lo, hi] одним вызовом: воркеры и соседние задачи в этот блок не попадут
+                cur.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), nextval(pg_get_serial_sequence(%s, 'id')) + %s - 1)",
+                            (t, t, to_insert))
+                hi = cur.fetchone()[0]
+                lo = hi - to_insert + 1
+                if existing == 0 and to_insert >= SEED_REBUILD_INDEXES_MIN:
+                    rebuild[t] = drop_table_indexes(cur, t)
+                for start in range(lo, hi + 1, SEED_CHUNK_ROWS):
+                    tasks.append((self.conn_kwargs, t, start, min(hi + 1, start + SEED_CHUNK_ROWS), rows_per_table * 10))
+            conn.commit()
+            cur.close()
+        if not tasks:
+            return
+        total = sum(task[3] - task[2] for task in tasks)
+        t0 = time.time()
+        jobs = max(1, min(jobs, len(tasks)))
+        pool = None
+        try:
+            if jobs > 1 and self.conn_kwargs:
+                # spawn, как и у --processes: генерация строк упирается в GIL, поэтому процессы, а не потоки
+                pool = multiprocessing.get_context("spawn").Pool(jobs)
+                done = 0
+                for t, n in pool.imap_unordered(seed_copy_task, tasks):
+                    done += n
+                    print(f"[{now_ts()}]   {t}: +{n} rows ({done}/{total}, {done / max(time.time() - t0, 1e-9):,.0f} rows/s)")
+            else:
+                with self.conn() as conn:
+                    for _, t, lo, hi, value_max in tasks:
+                        seed_copy_rows(conn, t, lo, hi, value_max)
+        finally:
+            # индексы возвращаем и при ошибке загрузки — таблицы без PK ломают все операции
+            if rebuild:
+                print(f"[{now_ts()}] Building indexes on {', '.join(rebuild)}...")
+                items = [(self.conn_kwargs, t, stmts) for t, stmts in rebuild.items()]
+                if pool is not None:
+                    pool.map(restore_table_indexes, items)
+                else:
+                    with self.conn() as conn:
+                        for _, t, stmts in items:
+                            run_maintenance(conn, stmts)
+            if pool is not None:
+                pool.close()
+                pool.join()
+        elapsed = time.time() - t0
+        print(f"[{now_ts()}] Seeded {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s, {jobs} jobs)")
+
+    def query(self, name, t):
+        q = self.queries.get((name, t))
+        if q is None:
+            q = self.queries[(name, t)] = self.statements[name].format(tbl=self.quote(t))
+        return q
+
+    def run(self, cur, name, t, params=()):
+        """Выполняет шаблон self.statements[name] для таблицы t в текущем --protocol (simple или prepared)."""
+        if self.protocol != 'prepared':
+            cur.execute(self.query(name, t), params)
+            return
+        stmt = f"lt_{name}_{t}"
+        with self.lock:
+            done = self.prepared.setdefault(cur.connection, set())
+        if stmt not in done:
+            # PREPARE не транзакционный: переживает ROLLBACK и живёт до закрытия соединения
+            cur.execute(f"PREPARE {quote_ident(stmt)} AS {to_dollar_params(self.query(name, t))}")
+            done.add(stmt)
+        args = f" ({', '.join(['%s'] * len(params))})" if params else ""
+        cur.execute(f"EXECUTE {quote_ident(stmt)}{args}", params)
+
+    def pipeline_conn(self):
+        """Отдельное соединение psycopg 3 на поток для --protocol pipeline (psycopg2 не умеет pipeline mode)."""
+        conn = getattr(self.local, 'pconn', None)
+        if conn is None or conn.closed:
+            kw = self.conn_kwargs
+            # prepare_threshold=None: без автоподготовки psycopg 3, чтобы мерить именно экономию round trip
+            conn = psycopg.connect(host=kw['host'], port=kw['port'], user=kw['user'], password=kw['password'],
+                                   dbname=kw['dbname'], autocommit=True, prepare_threshold=None)
+            self.local.pconn = conn
+            with self.lock:
+                self.pipeline_conns.append(conn)
+        return conn
+
+    def close_pipeline_conns(self):
+        with self.lock:
+            conns, self.pipeline_conns = self.pipeline_conns, []
+        for conn in conns:
+            conn.close()
+
+    def plan(self, op, cur):
+        """
+        Один запрос операции для pipeline: (name, table, params, after) или None, если выполнять нечего.
+        Повторов при промахе по ключу нет — следующий запрос уже отправлен, промах просто считается.
+        """
+        t = self.pick_table()
+
+        def key_check(ok):
+            if ok:
+                self.keys.hit()
+            else:
+                self.keys.miss()
+
+        if op in ('select_point', 'update', 'delete'):
+            key = self.keys.pick(t, cur, op, self.rng.random)
+            if key is None:
+                return None
+            if op == 'select_point':
+                return op, t, (key,), lambda c: key_check(c.fetchone() is not None)
+            params = self.update_values(key) if op == 'update' else (key,)
+            return op, t, params, lambda c: key_check(c.rowcount > 0)
+        if op == 'select_range':
+            return op, t, self.range_bounds(), lambda c: c.fetchall()
+        if op == 'join':
+            return op, t, self.join_bounds(), lambda c: c.fetchall()
+        if op == 'insert':
+            name = 'insert_pipelined'
+            params = self.new_row(128)
+        else:
+            name = op
+            params = self.unique_row()
+
+        def note(c):
+            row = c.fetchone()
+            self.keys.note_insert(t, row[0] if row else None)
+        return name, t, params, note
+
+    def run_pipeline(self, ops):
+        """
+        Отправляет независимые операции одной пачкой в pipeline mode и ждёт результаты за один round trip.
+        До Sync пачка — одна неявная транзакция: ошибка любого запроса отменяет всю пачку.
+        """
+        conn = self.pipeline_conn()
+        cur = conn.cursor()
+        plans = [p for p in (self.plan(op, cur) for op in ops) if p is not None]
+        cursors = []
+        with conn.pipeline():
+            for name, t, params, after in plans:
+                c = conn.cursor()
+                c.execute(self.query(name, t), params)
+                cursors.append((c, after))
+        for c, after in cursors:
+            after(c)
+
+    def with_existing_key(self, cur, t, fn, op=None):
+        """Вызывает fn(id) для случайных id таблицы, пока fn не вернёт True (строка нашлась) или не кончатся попытки."""
+        for _ in range(self.keys.max_retries):
+            key = self.keys.pick(t, cur, op, self.rng.random)
+            if key is None:
+                return False
+            if fn(key):
+                self.keys.hit()
+                return True
+            self.keys.miss()
+        return False
+
+    def pick(self, cur, table, op=None):
+        """Случайный id таблицы по --key_dist операции op; таблица со сплошными id, пустая — ошибка."""
+        key = self.keys.pick(table, cur, op, self.rng.random)
+        if key is None:
+            # на старте границы таблицы может ещё загружать другой поток
+            self.keys.refresh(table, cur)
+            key = self.keys._pick_cached(table, op, self.rng.random)
+        if key is None:
+            raise RuntimeError(f"table {table} is empty")
+        return key
+
+    def locked(self, cur, op, name, t, params):
+        """Запрос, берущий блокировку строки; под конкуренцией его время — в основном ожидание блокировки (lock_waits)."""
+        start = time.perf_counter()
+        try:
+            self.run(cur, name, t, params)
+        finally:
+            # и неудачные попытки: serialization/deadlock случаются как раз после ожидания
+            self.lock_waits.record(op, time.perf_counter() - start)
+
+    # Operation implementations
+    def op_select_point(self):
+        t = self.pick_table()
+        with self.conn(read=True) as conn:
+            cur = conn.cursor()
+
+            def lookup(key):
+                self.run(cur, 'select_point', t, (key,))
+                return cur.fetchone() is not None
+            self.with_existing_key(cur, t, lookup, 'select_point')
+            cur.close()
+
+    def op_select_range(self):
+        t = self.pick_table()
+        with self.conn(read=True) as conn:
+            cur = conn.cursor()
+            self.run(cur, 'select_range', t, self.range_bounds())
+            _ = cur.fetchall()
+            cur.close()
+
+    def op_insert_single(self):
+        t = self.pick_table()
+        with self.conn() as conn:
+            cur = conn.cursor()
+            self.run(cur, 'insert', t, self.new_row(128))
+            row = cur.fetchone()
+            conn.commit()
+            self.keys.note_insert(t, row[0])
+            cur.close()
+
+    def op_batch_insert(self, batch_size=None):
+        batch_size = batch_size or self.batch_insert
+        t = self.pick_table()
+        with self.conn() as conn:
+            cur = conn.cursor()
+            vals = [self.new_row(64) for _ in range(batch_size)]
+            q = sql.SQL("INSERT INTO {tbl} (key_text, data, value) VALUES %s ON CONFLICT (key_text) DO NOTHING;").format(tbl=sql.Identifier(t))
+            execute_values(cur, q.as_string(cur), vals, template=None, page_size=100)
+            conn.commit()
+            cur.close()
+
+    def op_update(self):
+        t = self.pick_table()
+        with self.conn() as conn:
+            cur = conn.cursor()
+
+            def update(key):
+                self.run(cur, 'update', t, self.update_values(key))
+                return cur.rowcount > 0
+            self.with_existing_key(cur, t, update, 'update')
+            conn.commit()
+            cur.close()
+
+    def op_delete(self):
+        t = self.pick_table()
+        with self.conn() as conn:
+            cur = conn.cursor()
+
+            def delete(key):
+                self.run(cur, 'delete', t, (key,))
+                return cur.rowcount > 0
+            self.with_existing_key(cur, t, delete, 'delete')
+            conn.commit()
+            cur.close()
+
+    def op_upsert(self):
+        t = self.pick_table()
+        with self.conn() as conn:
+            cur = conn.cursor()
+            self.run(cur, 'upsert', t, self.unique_row())
+            row = cur.fetchone()
+            conn.commit()
+            cur.close()
+            self.keys.note_insert(t, row[0])
+
+    def op_transaction(self):
+        t = self.pick_table()
+        with self.conn() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("BEGIN;")
+                found = []
+
+                def lock_row(key):
+                    self.locked(cur, 'transaction', 'lock_row', t, (key,))
+                    r = cur.fetchone()
+                    if r:
+                        found.append(r)
+                    return r is not None
+                if self.with_existing_key(cur, t, lock_row, 'transaction'):
+                    self.run(cur, 'bump', t, (found[0][0],))
+                else:
+                    self.run(cur, 'insert_plain', t, self.new_row(40, value=1))
+                cur.execute("COMMIT;")
+            except Exception:
+                cur.execute("ROLLBACK;")
+                raise
+            finally:
+                cur.close()
+
+    def op_join(self):
+        t = self.pick_table()
+        with self.conn(read=True) as conn:
+            cur = conn.cursor()
+            self.run(cur, 'join', t, self.join_bounds())
+            _ = cur.fetchall()
+            cur.close()
+
+
+class SeedRows:
+    """
+    Файлоподобный источник для cursor.copy_expert: строки COPY text-формата для id из [lo, hi),
+    генерируются по SEED_BATCH_ROWS на каждый read() — в памяти не больше одной пачки.
+    """
+
+    def __init__(self, lo, hi, value_max, data_len=64):
+        self.next = lo
+        self.hi = hi
+        self.value_max = value_max
+        self.data_len = data_len
+        # генератор от начала блока id: на одинаковых (свежих) базах, например --target, данные совпадают
+        self.rng = random.Random(lo)
+        # data — срез случайного буфера со случайного смещения: в разы дешевле rand_string() на строку
+        self.pool = "".join(self.rng.choices(string.ascii_letters + string.digits, k=1 << 20))
+
+    def read(self, size=-1):
+        # copy_expert отправляет столько, сколько вернули, — size можно не соблюдать
+        lo = self.next
+        hi = min(self.hi, lo + SEED_BATCH_ROWS)
+        if lo >= hi:
+            return b""
+        self.next = hi
+        rnd, pool, n, top, vmax = self.rng.random, self.pool, self.data_len, len(self.pool) - self.data_len, self.value_max
+        rows = []
+        for i in range(lo, hi):
+            o = int(rnd() * top)
+            rows.append(f"{i}\tseed_{i}\t{pool[o:o + n]}\t{1 + int(rnd() * vmax)}\n")
+        return "".join(rows).encode()
+
+    def batches(self):
+        """Те же строки пачками кортежей (id, key_text, data, value) — для INSERT там, где нет COPY (--backend mysql)."""
+        rnd, pool, n, top, vmax = self.rng.random, self.pool, self.data_len, len(self.pool) - self.data_len, self.value_max
+        while self.next < self.hi:
+            lo, hi = self.next, min(self.hi, self.next + SEED_BATCH_ROWS)
+            self.next = hi
+            batch = []
+            for i in range(lo, hi):
+                o = int(rnd() * top)
+                batch.append((i, f"seed_{i}", pool[o:o + n], 1 + int(rnd() * vmax)))
+            yield batch
+
+
+def seed_copy_rows(conn, table, lo, hi, value_max):
+    cur = conn.cursor()
+    cur.copy_expert(f"COPY {quote_ident(table)} (id, key_text, data, value) FROM STDIN", SeedRows(lo, hi, value_max),
+                    size=1 << 20)
+    conn.commit()
+    cur.close()
+
+
+def seed_copy_task(task):
+    """Одна COPY-задача --seed в отдельном процессе со своим соединением."""
+    conn_kwargs, table, lo, hi, value_max = task
+    conn = psycopg2.connect(**conn_kwargs)
+    try:
+        seed_copy_rows(conn, table, lo, hi, value_max)
+    finally:
+        conn.close()
+    return table, hi - lo
+
+
+def drop_table_indexes(cur, table):
+    """Снимает PK/UNIQUE и индексы таблицы; возвращает SQL, которым их вернуть (restore_table_indexes)."""
+    cur.execute("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('p', 'u')""", (table,))
+    constraints = cur.fetchall()
+    cur.execute("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE i.indrelid = %s::regclass
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid)""", (table,))
+    indexes = cur.fetchall()
+    tbl = quote_ident(table)
+    restore = []
+    for name, definition in constraints:
+        cur.execute(f"ALTER TABLE {tbl} DROP CONSTRAINT {quote_ident(name)}")
+        restore.append(f"ALTER TABLE {tbl} ADD CONSTRAINT {quote_ident(name)} {definition}")
+    for name, definition in indexes:
+        cur.execute(f"DROP INDEX {quote_ident(name)}")
+        restore.append(definition)
+    return restore
+
+
+def run_maintenance(conn, statements):
+    cur = conn.cursor()
+    cur.execute("SET maintenance_work_mem = %s", (SEED_MAINTENANCE_WORK_MEM,))
+    for stmt in statements:
+        cur.execute(stmt)
+    conn.commit()
+    cur.close()
+
+
+def restore_table_indexes(item):
+    conn_kwargs, table, statements = item
+    conn = psycopg2.connect(**conn_kwargs)
+    try:
+        run_maintenance(conn, statements)
+    finally:
+        conn.close()
+    return table
+
+
+class EcommerceWorker(DBWorker):
+    """
+    --workload ecommerce: запросы реального вида над схемой synth_prod_db.py вместо prod_sim_N.
+    Данные не создаёт (сначала synth_prod_db.py); setup_schema() только готовит sequence для новых id,
+    партиции orders/events на время прогона и индексы, которые используют операции.
+    """
+
+    def __init__(self, pool, table_names=None, batch_insert=100, keys=None, protocol=DEFAULT_PROTOCOL, conn_kwargs=None,
+                 run_seconds=DEFAULT_DURATION):
+        super().__init__(pool, [''], batch_insert=batch_insert, keys=keys, protocol=protocol, conn_kwargs=conn_kwargs)
+        self.statements = ECOMMERCE_STATEMENTS
+        self.run_seconds = run_seconds
+
+    def ops_map(self):
+        return {
+            'login': self.op_login,
+            'browse': self.op_browse,
+            'cart_add': self.op_cart_add,
+            'checkout': self.op_checkout,
+            'order_history': self.op_order_history,
+            'event_insert': self.op_event_insert,
+            'jsonb_search': self.op_jsonb_search
+        }
+
+    def setup_schema(self):
+        with self.conn() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT to_regclass('accounts'), to_regclass('orders'), to_regclass('events')")
+            if None in cur.fetchone():
+                raise RuntimeError("ecommerce workload needs the synth_prod_db.py schema (accounts, orders, events, ...)")
+            for table in ECOMMERCE_ID_SEQUENCES:
+                seq = quote_ident(f"lt_{table}_id_seq")
+                cur.execute(f"CREATE SEQUENCE IF NOT EXISTS {seq}")
+                cur.execute(f"SELECT setval(%s, greatest((SELECT coalesce(max(id), 0) FROM {quote_ident(table)}), "
+                            f"(SELECT last_value FROM {seq}), 1))", (f"lt_{table}_id_seq",))
+            # events.id — BIGSERIAL, но synth_prod_db грузит id явно через COPY, sequence остаётся на 1
+            cur.execute("SELECT setval(pg_get_serial_sequence('events', 'id'), (SELECT coalesce(max(id), 0) + 1 FROM events), false)")
+            for parent in ECOMMERCE_PARTITIONED:
+                self.ensure_partition(cur, parent)
+            cur.execute(ECOMMERCE_INDEXES)
+            conn.commit()
+            cur.close()
+
+    def ensure_partition(self, cur, parent):
+        """
+        synth_prod_db.py режет orders/events помесячно назад от даты генерации: новых строк с now()
+        партиции могут уже не принимать. Достраиваем одну партицию от последней границы до конца прогона + запас.
+        """
+        cur.execute(r"""
+            SELECT max(substring(pg_get_expr(c.relpartbound, c.oid) from 'TO \(''([^'']+)''\)')::timestamptz)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+        """, (parent,))
+        upper = cur.fetchone()[0]
+        days = int(self.run_seconds // 86400) + 7
+        cur.execute("SELECT now(), now() + %s * interval '1 day'", (days,))
+        now, until = cur.fetchone()
+        if upper is not None and upper >= until:
+            return
+        lower = upper if upper is not None else now
+        name = f"{parent}_lt_{until:%Y%m%d}"
+        print(f"[{now_ts()}] Adding partition {name} [{lower}, {until}) so new {parent} rows fit")
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {quote_ident(name)} PARTITION OF {quote_ident(parent)} FOR VALUES FROM (%s) TO (%s)",
+                    (lower, until))
+
+    def seed_initial_data(self, rows_per_table=1000, jobs=DEFAULT_SEED_JOBS):
+        print(f"[{now_ts()}] --seed is not used by the ecommerce workload: generate data with synth_prod_db.py")
+
+    def event(self, cur, account_id, event_type):
+        self.run(cur, 'event', '', (account_id, event_type, EVENT_PAYLOAD_DOC.render()))
+
+    def op_login(self):
+        with self.conn() as conn:
+            cur = conn.cursor()
+            account_id = self.pick(cur, 'accounts', 'login')
+            self.run(cur, 'login_lookup', '', (f"user{account_id - 1}@example.com",))
+            if cur.fetchone() is None:
+                self.keys.miss()  # неактивный аккаунт или база не от synth_prod_db
+                conn.rollback()
+                return
+            self.keys.hit()
+            self.run(cur, 'login_touch', '', (account_id,))
+            ip = ".".join(str(self.rng.randint(1, 254)) for _ in range(4))
+            # id сессии — первичный ключ: uuid4, а не из генератора клиента, иначе повтор с тем же --random_seed упрётся в дубликаты
+            self.run(cur, 'session_start', '', (str(uuid.uuid4()), account_id, ip, self.rng.choice(USER_AGENTS)))
+            self.event(cur, account_id, 'auth.login')
+            conn.commit()
+            cur.close()
+
+    def op_browse(self):
+        with self.conn(read=True) as conn:
+            cur = conn.cursor()
+            page = min(int(self.rng.expovariate(1.0)), 9)  # чаще первая страница
+            self.run(cur, 'browse', '', (self.pick(cur, 'categories', 'browse'), 24, page * 24))
+            cur.fetchall()
+            conn.commit()
+            cur.close()
+
+    def op_cart_add(self):
+        with self.conn() as conn:
+            cur = conn.cursor()
+            self.run(cur, 'product', '', (self.pick(cur, 'products', 'cart_add'),))
+            cur.fetchone()
+            self.event(cur, self.pick(cur, 'accounts', 'cart_add'), 'cart.add')
+            conn.commit()
+            cur.close()
+
+    def op_checkout(self):
+        """Заказ одной транзакцией: резерв на складе, orders, order_items, payments и событие order.create."""
+        with self.conn() as conn:
+            cur = conn.cursor()
+            try:
+                account_id = self.pick(cur, 'accounts', 'checkout')
+                # одинаковый порядок блокировок inventory у всех клиентов — без взаимных deadlock
+                product_ids = sorted({self.pick(cur, 'products', 'checkout') for _ in range(self.rng.randint(1, 5))})
+                self.run(cur, 'product_prices', '', (product_ids,))
+                items = []
+                currency = None
+                for product_id, price, currency in cur.fetchall():
+                    qty = self.rng.randint(1, 3)
+                    self.run(cur, 'reserve', '', (qty, product_id, product_id, qty))
+                    if cur.rowcount:
+                        items.append((product_id, qty, price))
+                if not items:
+                    conn.rollback()  # нет на складе
+                    return
+                total = sum(qty * price for _, qty, price in items)
+                self.run(cur, 'order_insert', '', (account_id, total, currency, ORDER_META_DOC.render()))
+                order_id, created = cur.fetchone()
+                for product_id, qty, price in items:
+                    self.run(cur, 'item_insert', '', (order_id, created, product_id, qty, price))
+                method = self.rng.choices(PAYMENT_METHODS, weights=PAYMENT_WEIGHTS)[0]
+                self.run(cur, 'payment_insert', '', (order_id, created, total, method, PAYMENT_DETAILS_DOC.render()))
+                self.event(cur, account_id, 'order.create')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def op_order_history(self):
+        with self.conn(read=True) as conn:
+            cur = conn.cursor()
+            page = min(int(self.rng.expovariate(1.5)), 5)
+            self.run(cur, 'order_history', '', (self.pick(cur, 'accounts', 'order_history'), 20, page * 20))
+            cur.fetchall()
+            conn.commit()
+            cur.close()
+
+    def op_event_insert(self):
+        with self.conn() as conn:
+            cur = conn.cursor()
+            account_id = self.pick(cur, 'accounts', 'event_insert') if self.rng.random() < 0.8 else None
+            self.event(cur, account_id, self.rng.choice(EVENT_TYPES))
+            conn.commit()
+            cur.close()
+
+    def op_jsonb_search(self):
+        kind = self.rng.choice(('search_product_attrs', 'search_product_tags', 'search_account_prefs', 'search_events'))
+        if kind == 'search_product_attrs':
+            keys = self.rng.sample(list(PRODUCT_ATTRS), self.rng.randint(1, 2))
+            param = json.dumps({k: self.rng.choice(PRODUCT_ATTRS[k]) for k in keys})
+        elif kind == 'search_product_tags':
+            param = self.rng.choice(PRODUCT_TAGS)
+        elif kind == 'search_account_prefs':
+            param = json.dumps({"lang": self.rng.choice(["en", "de", "pl", "fr", "es", "it"]), "theme": self.rng.choice(["light", "dark"])})
+        else:
+            param = json.dumps({"ab": self.rng.choice(["A", "B", "C"]), "ua": self.rng.choice(USER_AGENTS)})
+        with self.conn(read=True) as conn:
+            cur = conn.cursor()
+            self.run(cur, kind, '', (param,))
+            cur.fetchall()
+            conn.commit()
+            cur.close()
+
+
+class AnalyticalWorker:
+    """
+    --olap: тяжёлые аналитические запросы (OLAP_STATEMENTS: агрегации, оконные функции, большие join) над
+    orders/order_items/payments/events схемы synth_prod_db рядом с OLTP-нагрузкой. Клиент — поток со своим
+    соединением вне пула OLTP; работают первые level клиентов (set_level по фазам), лишние отменяют запрос и ждут.
+    Окно каждого запроса — случайные window_days дней внутри диапазона created_at таблицы. Время запросов
+    пишется в свой рекордер и в таблицы задержек OLTP не попадает.
+    """
+
+    def __init__(self, conn_kwargs, clients, window_days=DEFAULT_OLAP_WINDOW, timeout=DEFAULT_OLAP_TIMEOUT, seed=None):
+        self.conn_kwargs = conn_kwargs
+        self.clients = clients
+        self.seed = seed
+        self.window = window_days * 86400.0
+        self.timeout = timeout
+        self.level = 0
+        self.lock = threading.Lock()
+        self.ranges = {}
+        self.conns = [None] * clients
+        self.threads = []
+        self.recorder = OpRecorder()
+        self.total = defaultdict(LatencyHistogram)
+        self.phase = defaultdict(LatencyHistogram)
+        self.errors = 0
+        self.phase_errors = 0
+        self.status_errors = 0
+
+    def setup(self):
+        """Диапазоны created_at таблиц запросов; без данных synth_prod_db — RuntimeError."""
+        conn = psycopg2.connect(**self.conn_kwargs)
+        try:
+            cur = conn.cursor()
+            for table in sorted({table for table, _ in OLAP_STATEMENTS.values()}):
+                cur.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+                if not cur.fetchone()[0]:
+                    raise RuntimeError(f"--olap needs the synth_prod_db.py schema: no table {table}")
+                cur.execute(f"SELECT min(created_at), max(created_at) FROM {quote_ident(table)}")
+                lo, hi = cur.fetchone()
+                if lo is None:
+                    raise RuntimeError(f"--olap: table {table} is empty")
+                self.ranges[table] = (lo, hi)
+        finally:
+            conn.close()
+
+    def start(self):
+        self.threads = [threading.Thread(target=self.client, args=(i,), daemon=True, name=f"olap-{i + 1}")
+                        for i in range(self.clients)]
+        for t in self.threads:
+            t.start()
+
+    def set_level(self, level):
+        """Число работающих клиентов; у выключаемых текущий запрос отменяется, чтобы не тянуть его в следующую фазу."""
+        self.level = level
+        self.cancel(self.conns[level:])
+
+    @staticmethod
+    def cancel(conns):
+        for conn in conns:
+            if conn is not None and not conn.closed:
+                try:
+                    conn.cancel()
+                except psycopg2.Error:
+                    pass  # соединение закрылось между проверкой и отменой
+
+    def params(self, table, rng=random):
+        lo, hi = self.ranges[table]
+        span = (hi - lo).total_seconds()
+        start = lo + timedelta(seconds=rng.random() * max(0.0, span - self.window))
+        return start, start + timedelta(seconds=self.window)
+
+    def client(self, i):
+        conn = None
+        rng = random.Random(f"{self.seed}:olap{i + 1}") if self.seed is not None else random
+        while not STOP.is_set():
+            if i >= self.level:
+                STOP.wait(0.1)
+                continue
+            name, (table, query) = rng.choice(list(OLAP_STATEMENTS.items()))
+            start = time.perf_counter()
+            try:
+                if conn is None:
+                    conn = psycopg2.connect(**self.conn_kwargs, options=f"-c statement_timeout={int(self.timeout * 1000)}")
+                    conn.autocommit = True
+                    self.conns[i] = conn
+                cur = conn.cursor()
+                cur.execute(query, self.params(table, rng))
+                cur.fetchall()
+                cur.close()
+            except psycopg2.Error as e:
+                if STOP.is_set() or i >= self.level:
+                    continue  # отменён при остановке или смене фазы
+                with self.lock:
+                    self.errors += 1
+                    self.phase_errors += 1
+                    self.status_errors += 1
+                print(f"[{now_ts()}] Analytical client {i + 1} {name}: {str(e).strip().splitlines()[0]}", file=sys.stderr)
+                if conn.closed:
+                    conn = self.conns[i] = None
+                STOP.wait(1.0)
+                continue
+            self.recorder.record(name, time.perf_counter() - start)
+
+    def _collect(self):
+        for name, h in self.recorder.swap_interval().items():
+            self.total[name].merge(h)
+            self.phase[name].merge(h)
+
+    def status(self):
+        """Для строки отчёта: клиенты, завершённые запросы и ошибки с прошлого вызова."""
+        before = sum(h.total for h in self.total.values())
+        self._collect()
+        done = sum(h.total for h in self.total.values()) - before
+        with self.lock:
+            errors, self.status_errors = self.status_errors, 0
+        return f"olap_clients={self.level} olap_queries={done} olap_errors={errors}"
+
+    def end_phase(self):
+        """Гистограммы запросов и число ошибок с прошлого вызова — для сравнения фаз по числу клиентов."""
+        self._collect()
+        hists, self.phase = self.phase, defaultdict(LatencyHistogram)
+        with self.lock:
+            errors, self.phase_errors = self.phase_errors, 0
+        return hists, errors
+
+    def stop(self):
+        self.cancel(self.conns)
+        for t in self.threads:
+            t.join(timeout=5)
+        for conn in self.conns:
+            if conn is not None:
+                conn.close()
+        self._collect()
+
+
+class ContentionWorker(DBWorker):
+    """
+    --workload contention: клиенты конкурируют за одни и те же строки. counter_bump — инкремент счётчика
+    lt_counters, transfer — перенос между двумя счётчиками, stock_decrement — остаток lt_stock под
+    SELECT ... FOR UPDATE со списанием (или пополнением, если не хватает), job_push/job_pop — очередь lt_jobs,
+    которую потребители разбирают через FOR UPDATE SKIP LOCKED. Насколько горячи строки — --key_dist
+    по операциям, уровень изоляции транзакций — --isolation.
+    """
+
+    def __init__(self, pool, table_names=None, batch_insert=100, keys=None, protocol=DEFAULT_PROTOCOL, conn_kwargs=None,
+                 isolation='read_committed'):
+        super().__init__(pool, [''], batch_insert=batch_insert, keys=keys, protocol=protocol, conn_kwargs=conn_kwargs)
+        self.statements = CONTENTION_STATEMENTS
+        self.isolation = ISOLATION_LEVELS[isolation]
+
+    def ops_map(self):
+        return {
+            'counter_bump': self.op_counter_bump,
+            'transfer': self.op_transfer,
+            'stock_decrement': self.op_stock_decrement,
+            'job_push': self.op_job_push,
+            'job_pop': self.op_job_pop
+        }
+
+    def setup_schema(self):
+        with self.conn() as conn:
+            cur = conn.cursor()
+            cur.execute(CONTENTION_SCHEMA)
+            cur.execute("INSERT INTO lt_counters (id) SELECT g FROM generate_series(1, %s) g ON CONFLICT DO NOTHING",
+                        (CONTENTION_COUNTERS,))
+            cur.execute("INSERT INTO lt_stock (id, qty) SELECT g, %s FROM generate_series(1, %s) g ON CONFLICT DO NOTHING",
+                        (CONTENTION_STOCK, CONTENTION_SKUS))
+            conn.commit()
+            cur.close()
+
+    def seed_initial_data(self, rows_per_table=1000, jobs=DEFAULT_SEED_JOBS):
+        """Счётчики и остатки создаёт setup_schema(); --seed добавляет rows_per_table задач в очередь."""
+        with self.conn() as conn:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO lt_jobs (payload) SELECT md5(g::text) FROM generate_series(1, %s) g", (rows_per_table,))
+            conn.commit()
+            cur.close()
+
+    def begin(self, conn, cur):
+        """
+        Начало транзакции операции. Выбор ключа мог уже открыть транзакцию (обновление границ KeySampler):
+        commit() её закрывает (на простаивающем соединении это no-op), иначе SET TRANSACTION не сработает.
+        """
+        conn.commit()
+        if self.isolation != 'READ COMMITTED':
+            cur.execute(f"SET TRANSACTION ISOLATION LEVEL {self.isolation}")
+
+    @contextmanager
+    def transaction(self):
+        with self.conn() as conn:
+            cur = conn.cursor()
+            try:
+                yield conn, cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def op_counter_bump(self):
+        with self.transaction() as (conn, cur):
+            key = self.pick(cur, 'lt_counters', 'counter_bump')
+            self.begin(conn, cur)
+            self.locked(cur, 'counter_bump', 'counter_bump', '', (key,))
+
+    def op_transfer(self):
+        with self.transaction() as (conn, cur):
+            src = self.pick(cur, 'lt_counters', 'transfer')
+            dst = self.pick(cur, 'lt_counters', 'transfer')
+            if dst == src:
+                dst = src % CONTENTION_COUNTERS + 1
+            amount = self.rng.randint(1, 10)
+            self.begin(conn, cur)
+            # порядок блокировок намеренно не упорядочен (в отличие от checkout): встречные переносы дают deadlock
+            self.locked(cur, 'transfer', 'counter_move', '', (-amount, src))
+            self.locked(cur, 'transfer', 'counter_move', '', (amount, dst))
+
+    def op_stock_decrement(self):
+        with self.transaction() as (conn, cur):
+            key = self.pick(cur, 'lt_stock', 'stock_decrement')
+            qty = self.rng.randint(1, 3)
+            self.begin(conn, cur)
+            self.locked(cur, 'stock_decrement', 'stock_lock', '', (key,))
+            row = cur.fetchone()
+            if row is None:
+                self.keys.miss()
+                return
+            self.keys.hit()
+            if row[0] >= qty:
+                self.run(cur, 'stock_take', '', (qty, qty, key))
+            else:
+                self.run(cur, 'stock_refill', '', (CONTENTION_STOCK, key))
+
+    def op_job_push(self):
+        with self.transaction() as (conn, cur):
+            self.begin(conn, cur)
+            self.run(cur, 'job_push', '', (rand_string(64, self.rng),))
+
+    def op_job_pop(self):
+        with self.transaction() as (conn, cur):
+            self.begin(conn, cur)
+            self.locked(cur, 'job_pop', 'job_pop', '', ())
+            # пустая очередь (или все задачи заняты другими потребителями) считается промахом
+            if cur.fetchone() is None:
+                self.keys.miss()
+            else:
+                self.keys.hit()
+
+
+class MySQLWorker(DBWorker):
+    """
+    --backend mysql: те же операции prod_sim на InnoDB через PyMySQL/mysqlclient. Отличия от PostgreSQL —
+    только в SQL (MYSQL_STATEMENTS, MYSQL_TABLE_DDL) и в том, как получить id вставленной строки;
+    выбор операций, ключи, планировщик и статистика общие, так что цифры прямо сравнимы с --backend postgres.
+    """
+    quote = staticmethod(quote_mysql_ident)
+
+    def __init__(self, pool, table_names, batch_insert=100, keys=None, protocol=DEFAULT_PROTOCOL, conn_kwargs=None):
+        super().__init__(pool, table_names, batch_insert=batch_insert, keys=keys, protocol=protocol, conn_kwargs=conn_kwargs)
+        self.statements = MYSQL_STATEMENTS
+
+    @contextmanager
+    def conn(self, read=False):
+        # --replica с MySQL не поддерживается: все операции на одном сервере; откат — в MySQLPool.putconn
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    def setup_schema(self):
+        with self.conn() as conn:
+            cur = conn.cursor()
+            for t in self.table_names:
+                cur.execute(MYSQL_TABLE_DDL.format(tbl=self.quote(t)))
+            cur.execute(MYSQL_LOOKUP_DDL)
+            conn.commit()
+            cur.close()
+
+    def seed_initial_data(self, rows_per_table=1000, jobs=DEFAULT_SEED_JOBS):
+        """
+        Догоняет таблицы до rows_per_table строк многострочными INSERT по SEED_BATCH_ROWS (executemany драйвера
+        склеивает VALUES), в одном соединении: id идут подряд за max(id), key_text = seed_<id>.
+        """
+        with self.conn() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT count(*) FROM lookup_table")
+            if cur.fetchone()[0] < 200:
+                cur.executemany("INSERT INTO lookup_table (name, meta) VALUES (%s, %s) ON DUPLICATE KEY UPDATE id = id",
+                                [(f"name_{i}", f"meta_{rand_string(8)}") for i in range(1, 401)])
+            for t in self.table_names:
+                tbl = self.quote(t)
+                cur.execute(f"SELECT count(*), coalesce(max(id), 0) FROM {tbl}")
+                existing, max_id = cur.fetchone()
+                to_insert = max(0, rows_per_table - existing)
+                if to_insert <= 0:
+                    continue
+                t0 = time.time()
+                q = f"INSERT INTO {tbl} (id, key_text, data, value) VALUES (%s, %s, %s, %s)"
+                for batch in SeedRows(max_id + 1, max_id + 1 + to_insert, rows_per_table * 10).batches():
+                    cur.executemany(q, batch)
+                    conn.commit()
+                print(f"[{now_ts()}]   {t}: +{to_insert} rows ({to_insert / max(time.time() - t0, 1e-9):,.0f} rows/s)")
+            conn.commit()
+            cur.close()
+
+    def op_insert_single(self):
+        t = self.pick_table()
+        with self.conn() as conn:
+            cur = conn.cursor()
+            self.run(cur, 'insert', t, self.new_row(128))
+            conn.commit()
+            self.keys.note_insert(t, cur.lastrowid)
+            cur.close()
+
+    def op_batch_insert(self, batch_size=None):
+        batch_size = batch_size or self.batch_insert
+        t = self.pick_table()
+        with self.conn() as conn:
+            cur = conn.cursor()
+            vals = [self.new_row(64) for _ in range(batch_size)]
+            cur.executemany(self.query('batch_insert', t), vals)
+            conn.commit()
+            cur.close()
+
+    def op_upsert(self):
+        t = self.pick_table()
+        with self.conn() as conn:
+            cur = conn.cursor()
+            self.run(cur, 'upsert', t, self.unique_row())
+            conn.commit()
+            self.keys.note_insert(t, cur.lastrowid)
+            cur.close()
+
+
+def make_dbworker(args, pool, table_names, keys, protocol, conn_kwargs):
+    if args.backend == 'mysql':
+        return MySQLWorker(pool, table_names, batch_insert=args.batch_insert, keys=keys, protocol=protocol, conn_kwargs=conn_kwargs)
+    if args.workload == 'ecommerce':
+        return EcommerceWorker(pool, batch_insert=args.batch_insert, keys=keys, protocol=protocol,
+                               conn_kwargs=conn_kwargs, run_seconds=args.duration)
+    if args.workload == 'contention':
+        return ContentionWorker(pool, batch_insert=args.batch_insert, keys=keys, protocol=protocol,
+                                conn_kwargs=conn_kwargs, isolation=args.isolation)
+    return DBWorker(pool, table_names, batch_insert=args.batch_insert, keys=keys, protocol=protocol, conn_kwargs=conn_kwargs)
+
+
+def make_key_sampler(args):
+    return KeySampler(dist=args.key_dist, mode=args.key_mode, refresh_interval=args.key_refresh,
+                      sample_size=args.key_sample_size, max_retries=args.key_retries,
+                      quote=quote_mysql_ident if args.backend == 'mysql' else quote_ident)
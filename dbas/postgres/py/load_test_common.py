@@ -0,0 +1,62 @@
+"""
+load_test_common.py
+Общее для модулей load_test_prod.py: флаг остановки прогона, время для логов, имена и параметры SQL.
+"""
+
+import random
+import re
+import string
+import threading
+from datetime import datetime
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    import psycopg  # psycopg 3, только для --protocol pipeline
+except ImportError:
+    psycopg = None
+
+# --backend mysql: PyMySQL или mysqlclient (MySQLdb) — DB-API с теми же %s-параметрами, что у psycopg2
+try:
+    import pymysql as mysql_driver
+    from pymysql.constants import CLIENT as MYSQL_CLIENT
+except ImportError:
+    try:
+        import MySQLdb as mysql_driver
+        from MySQLdb.constants import CLIENT as MYSQL_CLIENT
+    except ImportError:
+        mysql_driver = MYSQL_CLIENT = None
+
+
+STOP = threading.Event()
+
+
+def now_ts():
+    return datetime.utcnow().isoformat()
+
+
+def rand_string(n=12, rng=random):
+    return ''.join(rng.choices(string.ascii_letters + string.digits, k=n))
+
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_mysql_ident(name):
+    return '`' + name.replace('`', '``') + '`'
+
+
+def to_dollar_params(query):
+    """%s -> $1, $2, ... и %% -> % для PREPARE."""
+    n = [0]
+
+    def sub(m):
+        if m.group(0) == '%%':
+            return '%'
+        n[0] += 1
+        return f"${n[0]}"
+    return re.sub(r"%%|%s", sub, query)
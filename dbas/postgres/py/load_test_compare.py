@@ -0,0 +1,293 @@
+"""
+load_test_compare.py
+Хранилище результатов load_test_prod.py (<results_dir>/<run_id>/result.json) и сравнение двух прогонов
+тестом Уэлча: python3 load_test_prod.py compare BASELINE CANDIDATE.
+"""
+
+import argparse
+import json
+import math
+import platform
+import re
+import os
+import socket
+import subprocess
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extensions
+
+from load_test_common import asyncpg, mysql_driver
+from load_test_stats import PERCENTILES, LatencyHistogram
+from load_test_backends import mysql_connect
+
+
+# хранилище результатов: <results_dir>/<run_id>/result.json на каждый прогон, compare сравнивает два прогона
+DEFAULT_RESULTS_DIR = "load_test_results"
+RESULT_FILE = "result.json"
+BASELINE_FILE = "BASELINE"  # id прогона, на который указывает имя baseline
+DEFAULT_ALPHA = 0.05
+DEFAULT_MIN_CHANGE = 2.0    # %: статистически значимые изменения меньше этого не считаются регрессией
+DEFAULT_SKIP_INTERVALS = 1  # первые интервалы (разогрев, пустой кэш) не входят в выборки compare
+# настройки сервера, которые пишутся в результат и сравниваются в compare
+SERVER_SETTINGS = ('max_connections', 'shared_buffers', 'effective_cache_size', 'work_mem', 'maintenance_work_mem',
+                   'synchronous_commit', 'fsync', 'full_page_writes', 'wal_level', 'wal_buffers', 'wal_compression',
+                   'commit_delay', 'max_wal_size', 'checkpoint_timeout', 'checkpoint_completion_target',
+                   'random_page_cost', 'effective_io_concurrency', 'jit', 'huge_pages', 'max_worker_processes',
+                   'max_parallel_workers_per_gather', 'default_transaction_isolation', 'autovacuum',
+                   'deadlock_timeout', 'lock_timeout', 'statement_timeout')
+
+MYSQL_SETTINGS = ('max_connections', 'innodb_buffer_pool_size', 'innodb_redo_log_capacity', 'innodb_log_file_size',
+                  'innodb_flush_log_at_trx_commit', 'sync_binlog', 'log_bin', 'binlog_format', 'innodb_flush_method',
+                  'innodb_io_capacity', 'innodb_doublewrite', 'transaction_isolation', 'innodb_lock_wait_timeout',
+                  'innodb_deadlock_detect', 'thread_handling')
+
+
+def collect_environment():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        rev = None
+    return {"hostname": socket.gethostname(), "platform": platform.platform(), "python": platform.python_version(),
+            "cpu_count": os.cpu_count(), "psycopg2": psycopg2.__version__.split()[0],
+            "asyncpg": getattr(asyncpg, '__version__', None), "script_rev": rev}
+
+
+def collect_server_info(conn_kwargs, backend='postgres'):
+    """Версия и SERVER_SETTINGS (MYSQL_SETTINGS) целевого сервера; без соединения — ошибка вместо данных."""
+    if backend == 'mysql':
+        try:
+            conn = mysql_connect(conn_kwargs)
+        except mysql_driver.MySQLError as e:
+            return {"error": str(e).strip()}
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT VERSION()")
+            version = f"MySQL {cur.fetchone()[0]}"
+            cur.execute("SHOW GLOBAL VARIABLES WHERE Variable_name IN (" + ", ".join(["%s"] * len(MYSQL_SETTINGS)) + ")",
+                        MYSQL_SETTINGS)
+            return {"version": version, "settings": {name: str(value) for name, value in cur.fetchall()}}
+        finally:
+            conn.close()
+    try:
+        conn = psycopg2.connect(**conn_kwargs)
+    except psycopg2.Error as e:
+        return {"error": str(e).strip()}
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT version(), current_setting('server_version_num')::int")
+        version, version_num = cur.fetchone()
+        cur.execute("SELECT name, setting, unit FROM pg_settings WHERE name = ANY(%s)", (list(SERVER_SETTINGS),))
+        settings = {name: setting + (f" {unit}" if unit else "") for name, setting, unit in cur.fetchall()}
+        conn.rollback()
+        return {"version": version, "version_num": version_num, "settings": settings}
+    finally:
+        conn.close()
+
+
+def redact_config(args):
+    config = dict(vars(args))
+    if config.get('password'):
+        config['password'] = "***"
+    # пароли в DSN --target и --replica: user:secret@host и password=secret
+    for key in ('target', 'replica'):
+        config[key] = [re.sub(r"(password=)\S+", r"\1***", re.sub(r"(://[^:/@]*:)[^@]*@", r"\1***@", t))
+                       for t in config.get(key) or []]
+    return config
+
+
+def save_result(args, name, server, started, elapsed, stats, totals, series, extra=None):
+    """
+    Пишет <args.results_dir>/<run_id>/result.json: конфигурация, окружение, сервер (версия, настройки),
+    итоги, временной ряд интервалов и гистограммы по операциям. Возвращает путь каталога прогона.
+    """
+    data, by_type, _ = stats.snapshot()
+    slug = re.sub(r"[^\w.-]+", "_", name)
+    run_id = f"{datetime.fromtimestamp(started):%Y%m%d-%H%M%S}-{slug}"
+    path = os.path.join(args.results_dir, run_id)
+    all_ops = LatencyHistogram()
+    for h in totals.values():
+        all_ops.merge(h)
+    result = {
+        "run_id": run_id, "name": name, "started": started, "elapsed": elapsed,
+        "config": redact_config(args), "environment": collect_environment(), "server": server,
+        "summary": {
+            "ops": data.get('ops', 0), "errors": data.get('errors', 0), "ops_per_sec": data.get('ops', 0) / elapsed if elapsed > 0 else 0.0,
+            "conflicts": stats.conflicts(), "errors_by_op": stats.errors_snapshot(),
+            "percentiles": {format(p, 'g'): all_ops.percentile(p) for p in PERCENTILES}, "max": all_ops.max_us / 1e6,
+        },
+        "ops": {op: {"count": h.total, "percentiles": {format(p, 'g'): h.percentile(p) for p in PERCENTILES},
+                     "max": h.max_us / 1e6, "hist": h.encode()} for op, h in totals.items()},
+        "series": series,
+        **(extra or {}),
+    }
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, RESULT_FILE), 'w') as f:
+        json.dump(result, f, indent=1, default=str)
+    return path
+
+
+def resolve_run(ref, results_dir):
+    """Путь к result.json по ссылке: каталог или файл, id прогона в results_dir, 'latest' или 'baseline'."""
+    if ref == 'latest':
+        runs = sorted(d for d in os.listdir(results_dir) if os.path.isfile(os.path.join(results_dir, d, RESULT_FILE))) \
+            if os.path.isdir(results_dir) else []
+        if not runs:
+            raise ValueError(f"no runs in {results_dir}")
+        ref = runs[-1]
+    elif ref == 'baseline':
+        try:
+            with open(os.path.join(results_dir, BASELINE_FILE)) as f:
+                ref = f.read().strip()
+        except OSError:
+            raise ValueError(f"no baseline in {results_dir}: set one with compare --set_baseline RUN")
+    for path in (ref, os.path.join(ref, RESULT_FILE), os.path.join(results_dir, ref, RESULT_FILE)):
+        if os.path.isfile(path):
+            return path
+    raise ValueError(f"run {ref!r} not found (neither a path nor a run id in {results_dir})")
+
+
+def load_run(ref, results_dir):
+    with open(resolve_run(ref, results_dir)) as f:
+        return json.load(f)
+
+
+def _betacf(a, b, x, iterations=300, eps=3e-14):
+    """Цепная дробь неполной бета-функции (метод Ленца)."""
+    tiny = 1e-300
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, iterations + 1):
+        m2 = 2 * m
+        for aa in (m * (b - m) * x / ((qam + m2) * (a + m2)), -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))):
+            d = 1.0 + aa * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + aa / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < eps:
+            break
+    return h
+
+
+def betainc(a, b, x):
+    """Регуляризованная неполная бета-функция I_x(a, b)."""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1.0 - x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def welch_test(a, b):
+    """
+    t-тест Уэлча (разные дисперсии) для двух выборок: (t, df, двусторонний p) или None, если меньше двух точек.
+    p по распределению Стьюдента: 2 * P(T > |t|) = I_{df/(df+t^2)}(df/2, 1/2).
+    """
+    if len(a) < 2 or len(b) < 2:
+        return None
+    ma, mb = sum(a) / len(a), sum(b) / len(b)
+    va = sum((x - ma) ** 2 for x in a) / (len(a) - 1) / len(a)
+    vb = sum((x - mb) ** 2 for x in b) / (len(b) - 1) / len(b)
+    if va + vb == 0:
+        return (0.0, float('inf'), 1.0) if ma == mb else (math.copysign(float('inf'), mb - ma), float('inf'), 0.0)
+    t = (mb - ma) / math.sqrt(va + vb)
+    df = (va + vb) ** 2 / ((va ** 2 / (len(a) - 1) if va else 0.0) + (vb ** 2 / (len(b) - 1) if vb else 0.0))
+    return t, df, betainc(df / 2.0, 0.5, df / (df + t * t))
+
+
+def mean_sd(xs):
+    m = sum(xs) / len(xs) if xs else 0.0
+    return m, math.sqrt(sum((x - m) ** 2 for x in xs) / (len(xs) - 1)) if len(xs) > 1 else 0.0
+
+
+def compare_runs(base, cand, alpha=DEFAULT_ALPHA, min_change=DEFAULT_MIN_CHANGE, skip=DEFAULT_SKIP_INTERVALS, indent="   "):
+    """
+    Сравнение двух прогонов по интервалам: ops/s, p50/p99 всех операций и p99 каждой операции. Выборки —
+    значения интервалов после skip первых; изменение значимо при p < alpha (Уэлч) и |изменение| >= min_change %.
+    Возвращает (текст, число регрессий).
+    """
+    lines = []
+    for label, run in (("baseline", base), ("candidate", cand)):
+        server = run.get("server", {})
+        version = server.get("version", server.get("error", "?")).split(",")[0]
+        lines.append(f"{indent}{label:<10} {run['run_id']}  {version}  {run['summary']['ops_per_sec']:.1f} ops/s "
+                     f"over {run['elapsed']:.0f}s, {len(run['series'])} intervals")
+    diffs = []
+    for section in ("settings",):
+        a, b = base.get("server", {}).get(section, {}), cand.get("server", {}).get(section, {})
+        diffs += [f"{k}: {a.get(k)} -> {b.get(k)}" for k in sorted(set(a) | set(b)) if a.get(k) != b.get(k)]
+    ignore = {'results_dir', 'run_name', 'baseline', 'hist_out', 'password', 'target'}
+    ca, cb = base.get("config", {}), cand.get("config", {})
+    diffs += [f"--{k}: {ca.get(k)} -> {cb.get(k)}" for k in sorted(set(ca) | set(cb)) if k not in ignore and ca.get(k) != cb.get(k)]
+    if diffs:
+        lines.append(f"{indent}differences: " + "; ".join(diffs))
+
+    def samples(run, fn):
+        return [v for v in (fn(pt) for pt in run["series"][skip:]) if v is not None]
+
+    metrics = [("ops/s", lambda pt: pt["ops_per_sec"], True, 1.0),
+               ("p50 all, ms", lambda pt: pt["p50"] if pt["ops"] else None, False, 1000.0),
+               ("p99 all, ms", lambda pt: pt["p99"] if pt["ops"] else None, False, 1000.0)]
+    ops = sorted(set(base["ops"]) & set(cand["ops"]), key=lambda op: -cand["ops"][op]["count"])
+    for op in ops:
+        metrics.append((f"p99 {op}, ms", lambda pt, op=op: pt["by_op"][op]["p99"] if op in pt["by_op"] else None, False, 1000.0))
+    lines.append(f"{indent}{'metric':<26}{'baseline':>20}{'candidate':>20}{'change':>9}{'p':>9}  verdict")
+    regressions = 0
+    for name, fn, higher_better, scale in metrics:
+        a, b = samples(base, fn), samples(cand, fn)
+        if not a or not b:
+            continue
+        (ma, sa), (mb, sb) = mean_sd(a), mean_sd(b)
+        change = (mb - ma) / ma * 100.0 if ma else 0.0
+        test = welch_test(a, b)
+        p = test[2] if test else None
+        if p is None:
+            verdict = "too few intervals"
+        elif p >= alpha or abs(change) < min_change:
+            verdict = "no significant change"
+        elif (change > 0) == higher_better:
+            verdict = "better"
+        else:
+            verdict = "REGRESSION"
+            regressions += 1
+        lines.append(f"{indent}{name:<26}{f'{ma * scale:.2f}±{sa * scale:.2f}':>20}{f'{mb * scale:.2f}±{sb * scale:.2f}':>20}"
+                     f"{change:>+8.1f}%{'-' if p is None else format(p, '.4f'):>9}  {verdict}")
+    return "\n".join(lines), regressions
+
+
+def compare_main(argv):
+    """python3 load_test_prod.py compare BASELINE CANDIDATE | compare --set_baseline RUN"""
+    parser = argparse.ArgumentParser(prog="load_test_prod.py compare",
+                                     description="Compare two stored runs (path, run id, 'latest' or 'baseline').")
+    parser.add_argument("runs", nargs="*", help="BASELINE CANDIDATE (default: baseline latest)")
+    parser.add_argument("--results_dir", default=DEFAULT_RESULTS_DIR)
+    parser.add_argument("--set_baseline", metavar="RUN", help="remember RUN as 'baseline' and exit")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="significance level of Welch's t-test")
+    parser.add_argument("--min_change", type=float, default=DEFAULT_MIN_CHANGE, help="ignore significant changes below this %%")
+    parser.add_argument("--skip_intervals", type=int, default=DEFAULT_SKIP_INTERVALS, help="warm-up intervals to leave out")
+    args = parser.parse_args(argv)
+    try:
+        if args.set_baseline:
+            run = load_run(args.set_baseline, args.results_dir)
+            os.makedirs(args.results_dir, exist_ok=True)
+            with open(os.path.join(args.results_dir, BASELINE_FILE), 'w') as f:
+                f.write(run["run_id"] + "\n")
+            print(f"baseline = {run['run_id']}")
+            return 0
+        refs = args.runs or ["baseline", "latest"]
+        if len(refs) != 2:
+            parser.error("expected BASELINE CANDIDATE")
+        base, cand = (load_run(r, args.results_dir) for r in refs)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    text, regressions = compare_runs(base, cand, args.alpha, args.min_change, args.skip_intervals)
+    print(text)
+    print(f"{regressions} significant regression(s)" if regressions else "no significant regressions")
+    return 1 if regressions else 0
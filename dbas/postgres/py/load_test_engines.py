@@ -0,0 +1,965 @@
+"""
+load_test_engines.py
+Движки нагрузки load_test_prod.py: планировщик поступления операций, профиль и свип скорости,
+потоки (threads), asyncio (asyncpg) и процессы (processes) со сбором их статистики.
+"""
+
+import asyncio
+import math
+import random
+import re
+import time
+import queue
+import os
+import threading
+import signal
+import sys
+from collections import defaultdict
+
+from load_test_common import asyncpg, STOP, now_ts, quote_ident, to_dollar_params
+from load_test_stats import SafeStats, LatencyHistogram, OpRecorder
+from load_test_backends import STATEMENTS, make_pool, KeySampler, ProdSimParams, make_dbworker, make_key_sampler
+
+
+DEFAULT_BATCH_INSERT = 100
+
+DEFAULT_ARRIVAL = "fixed"
+
+DEFAULT_PIPELINE_DEPTH = 16
+
+# --sweep: ступень идёт не меньше --sweep_step_time и до стабильности последних интервалов отчёта
+DEFAULT_SWEEP_STEPS = 10          # ступеней, если шаг в --sweep не задан
+DEFAULT_MAX_ERROR_RATE = 0.01
+SWEEP_WARMUP_INTERVALS = 1        # первые интервалы ступени (переходный процесс) в оценку не входят
+SWEEP_STEADY_INTERVALS = 3        # по стольким последним интервалам судим о стабильности и считаем итог ступени
+SWEEP_STEADY_CV = 0.1             # стабильно: коэффициент вариации ops/s не больше
+SWEEP_STEADY_P99_GROWTH = 1.5     # и p99 не растёт от интервала к интервалу больше чем во столько раз (очередь копится)
+SWEEP_MIN_ACHIEVED = 0.9          # rate=: выполнено (с ошибками) меньше этой доли заданной скорости — насыщение
+SWEEP_MAX_STEP_FACTOR = 3         # без стабильности дольше step_time * factor — ступень не держится, свип заканчивается
+
+# операции из одного независимого запроса — их --protocol pipeline отправляет пачкой
+PIPELINE_OPS = ('select_point', 'select_range', 'insert', 'update', 'delete', 'upsert', 'join')
+
+
+class ArrivalSchedule:
+    """
+    Намеченные моменты старта операций (time.perf_counter) для общей скорости rate ops/s.
+    mode='fixed' — равные интервалы, mode='poisson' — экспоненциальные интервалы (случайные приходы).
+    rate может быть числом или функцией от секунд с начала -> ops/s.
+    """
+    IDLE_STEP = 0.05
+    HORIZON = 1.0
+
+    def __init__(self, rate, mode=DEFAULT_ARRIVAL, start=None, rng=random):
+        if mode not in ('fixed', 'poisson'):
+            raise ValueError(f"Bad arrival mode {mode!r}: expected fixed or poisson")
+        self.rate_fn = rate if callable(rate) else (lambda _t, r=float(rate): r)
+        self.mode = mode
+        self.start = time.perf_counter() if start is None else start
+        self.t = self.start
+        self.need = None
+        self.rng = rng
+
+    def next(self):
+        """
+        Следующий намеченный момент или None, если в ближайшие HORIZON секунд приходов нет (спросить позже).
+        Скорость интегрируется шагами не длиннее IDLE_STEP: при меняющейся скорости (--profile) редкий
+        приход на медленном участке не перепрыгивает начало быстрого, а при нулевой — время идёт без операций.
+        """
+        if self.need is None:
+            self.need = self.rng.expovariate(1.0) if self.mode == 'poisson' else 1.0
+        horizon = time.perf_counter() + self.HORIZON
+        while self.t < horizon:
+            rate = self.rate_fn(self.t - self.start)
+            if rate > 0 and self.need / rate <= self.IDLE_STEP:
+                self.t += self.need / rate
+                self.need = None
+                return self.t
+            self.need -= max(rate, 0.0) * self.IDLE_STEP
+            self.t += self.IDLE_STEP
+        return None
+
+
+def parse_duration(text):
+    """'90', '90s', '5m', '1h' -> секунды."""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)([smh]?)", text.strip())
+    if not m:
+        raise ValueError(f"Bad duration {text!r}: expected e.g. 90s, 5m, 1h")
+    return float(m.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[m.group(2)]
+
+
+class LoadProfile:
+    """
+    Целевая скорость (ops/s) и число активных клиентов как функции времени (--profile).
+    Сегменты идут друг за другом, по одному на строку или через ';':
+        вид длительность параметры [conc=N | conc=A..B]
+      hold 5m 1000             — постоянно 1000 ops/s
+      ramp 10m 100 3000        — линейно от 100 до 3000 (поиск колена)
+      steps 10m 500 2500 5     — лестница из 5 ступеней от 500 до 2500
+      spike 2m 500 5000 15s    — 500 ops/s, в середине сегмента 15 секунд по 5000
+      diurnal 24m 200 2000     — сжатые сутки: минимум в начале и в конце ("ночь"), максимум в середине
+    conc= задаёт число активных клиентов (A..B — линейно по сегменту), по умолчанию --concurrency.
+    """
+    ARGS = {'hold': 1, 'ramp': 2, 'steps': 3, 'spike': 3, 'diurnal': 2}
+
+    def __init__(self, text, default_concurrency):
+        self.segments = []
+        start = 0.0
+        for raw in re.split(r"[;\n]", text):
+            line = raw.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            kind = parts[0]
+            if kind not in self.ARGS:
+                raise ValueError(f"Bad profile segment {line!r}: expected one of {', '.join(self.ARGS)}")
+            conc = [p[5:] for p in parts[2:] if p.startswith('conc=')]
+            params = [p for p in parts[2:] if not p.startswith('conc=')]
+            if len(parts) < 2 or len(params) != self.ARGS[kind]:
+                raise ValueError(f"Bad profile segment {line!r}: {kind} takes duration and {self.ARGS[kind]} values")
+            length = parse_duration(parts[1])
+            if kind == 'spike':
+                values = [float(params[0]), float(params[1]), parse_duration(params[2])]
+            elif kind == 'steps':
+                values = [float(params[0]), float(params[1]), max(1, int(params[2]))]
+            else:
+                values = [float(v) for v in params]
+            c_from = c_to = default_concurrency
+            if conc:
+                lo, _, hi = conc[0].partition('..')
+                c_from, c_to = int(lo), int(hi or lo)
+            self.segments.append((start, length, kind, values, c_from, c_to))
+            start += length
+        if not self.segments:
+            raise ValueError("Empty load profile")
+        self.duration = start
+        self.max_concurrency = max(max(s[4], s[5]) for s in self.segments)
+
+    @classmethod
+    def load(cls, spec, default_concurrency):
+        """spec — путь к файлу профиля или сам профиль строкой."""
+        if os.path.isfile(spec):
+            with open(spec) as f:
+                spec = f.read()
+        return cls(spec, default_concurrency)
+
+    def _segment(self, t):
+        for seg in self.segments:
+            if t < seg[0] + seg[1]:
+                return seg, max(0.0, t - seg[0]) / seg[1] if seg[1] > 0 else 1.0
+        return None, 1.0
+
+    def rate(self, t):
+        seg, f = self._segment(t)
+        if seg is None:
+            return 0.0
+        _, length, kind, v, _, _ = seg
+        if kind == 'hold':
+            return v[0]
+        if kind == 'ramp':
+            return v[0] + (v[1] - v[0]) * f
+        if kind == 'steps':
+            n = v[2]
+            return v[0] if n == 1 else v[0] + (v[1] - v[0]) * min(n - 1, int(f * n)) / (n - 1)
+        if kind == 'spike':
+            return v[1] if abs(f * length - length / 2) < v[2] / 2 else v[0]
+        return v[0] + (v[1] - v[0]) * (1 - math.cos(2 * math.pi * f)) / 2
+
+    def concurrency(self, t):
+        seg, f = self._segment(t)
+        if seg is None:
+            seg, f = self.segments[-1], 1.0
+        return max(1, int(round(seg[4] + (seg[5] - seg[4]) * f)))
+
+    def mean_rate(self, t0, t1, points=20):
+        if t1 <= t0:
+            return self.rate(t0)
+        step = (t1 - t0) / points
+        return sum(self.rate(t0 + (i + 0.5) * step) for i in range(points)) / points
+
+    def share(self, part=0, parts=1, offset=0.0):
+        """
+        Доля профиля для одного процесса из parts: (rate_fn для ArrivalSchedule, active_fn -> число
+        активных клиентов этого процесса). offset — на сколько секунд процесс стартовал позже общего начала.
+        """
+        t0 = time.perf_counter() - offset
+
+        def rate_fn(t):
+            return self.rate(t + offset) / parts
+
+        def active_fn():
+            return split_evenly(self.concurrency(time.perf_counter() - t0), parts)[part]
+        return rate_fn, active_fn
+
+
+def parse_sweep(text):
+    """
+    --sweep 'rate=100..2000:+100,conc=4..64:x2' -> {'rate': [...], 'conc': [...]}.
+    Шаг +N — прибавлять N, xF — умножать на F; без шага — DEFAULT_SWEEP_STEPS равных ступеней.
+    """
+    dims = {}
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        m = re.fullmatch(r"(rate|conc)=(\d+(?:\.\d+)?)\.\.(\d+(?:\.\d+)?)(?::([+x])(\d+(?:\.\d+)?))?", part)
+        if not m or m.group(1) in dims:
+            raise ValueError(f"Bad sweep dimension {part!r}: expected rate=A..B[:+N|:xF] or conc=A..B[:+N|:xF], each once")
+        lo, hi = float(m.group(2)), float(m.group(3))
+        op, step = m.group(4) or '+', float(m.group(5) or (hi - lo) / (DEFAULT_SWEEP_STEPS - 1))
+        if hi < lo or (op == '+' and step <= 0 and hi > lo) or (op == 'x' and step <= 1) or lo <= 0:
+            raise ValueError(f"Bad sweep dimension {part!r}: need 0 < A <= B and a step that grows")
+        values, v = [], lo
+        while v <= hi * (1 + 1e-9):
+            values.append(int(round(v)) if m.group(1) == 'conc' else v)
+            if step <= 0:
+                break
+            v = v + step if op == '+' else v * step
+        dims[m.group(1)] = [v for i, v in enumerate(values) if i == 0 or v != values[i - 1]]
+    if not dims:
+        raise ValueError("Empty --sweep: expected rate=A..B and/or conc=A..B")
+    return dims
+
+
+def find_knee(points):
+    """
+    Колено кривой задержки (x — ops/s, y — p99) по Kneedle: обе оси нормируются в [0, 1],
+    колено — точка, дальше всех лежащая под хордой от первой точки до последней. Индекс или None.
+    """
+    if len(points) < 3:
+        return None
+    xs, ys = [x for x, _ in points], [y for _, y in points]
+    dx, dy = (max(xs) - min(xs)) or 1.0, (max(ys) - min(ys)) or 1.0
+    norm = [((x - xs[0]) / dx, (y - ys[0]) / dy) for x, y in points]
+    x_last, y_last = norm[-1]
+    # расстояние под хордой (0,0)-(x_last,y_last) с точностью до множителя
+    gaps = [x * y_last - y * x_last for x, y in norm]
+    best = max(range(1, len(points) - 1), key=gaps.__getitem__)
+    return best if gaps[best] > 0 else None
+
+
+class Sweep:
+    """
+    --sweep: ступени скорости прихода и/или числа клиентов до насыщения. Для исполнителей выглядит как
+    LoadProfile (rate/concurrency/mean_rate/share), но ступени переключает главный цикл через observe()
+    после каждого интервала отчёта: ступень длится не меньше step_time и заканчивается, когда последние
+    SWEEP_STEADY_INTERVALS интервалов стабильны (разброс ops/s, нет роста p99), или через step_time * SWEEP_MAX_STEP_FACTOR
+    без стабильности. Свип останавливается на нарушении --slo_p99, доле ошибок выше --max_error_rate,
+    недостигнутой скорости (rate=), ступени без стабильности или после последней ступени.
+    """
+
+    def __init__(self, spec, ops_per_sec, concurrency, step_time, slo_p99=None, max_error_rate=DEFAULT_MAX_ERROR_RATE):
+        dims = parse_sweep(spec)
+        n = max(len(v) for v in dims.values())
+        rates = dims.get('rate', [float(ops_per_sec)])
+        concs = dims.get('conc', [concurrency])
+        # короткое измерение держит последнее значение, пока длинное идёт дальше
+        self.steps = [(rates[min(i, len(rates) - 1)], concs[min(i, len(concs) - 1)]) for i in range(n)]
+        self.spec = spec
+        self.sweeps_rate = 'rate' in dims
+        self.step_time = step_time
+        self.slo_p99 = slo_p99
+        self.max_error_rate = max_error_rate
+        self.max_concurrency = max(c for _, c in self.steps)
+        self.segments = []  # печать сегментов --profile
+        self.idx = 0
+        self.step_start = 0.0
+        self.history = [(0.0, 0)]  # (секунды от старта, индекс ступени)
+        self.samples = []
+        self.results = []
+        self.stop_reason = None
+
+    def _step_at(self, t):
+        for start, idx in reversed(self.history):
+            if t >= start:
+                return self.steps[idx]
+        return self.steps[0]
+
+    def rate(self, t):
+        return self._step_at(t)[0]
+
+    def concurrency(self, t):
+        return self._step_at(t)[1]
+
+    def mean_rate(self, t0, t1, points=20):
+        return LoadProfile.mean_rate(self, t0, t1, points)
+
+    def share(self, part=0, parts=1, offset=0.0):
+        """Как LoadProfile.share для единственного процесса; без rate= в --sweep скорость — постоянная --ops_per_sec."""
+        t0 = time.perf_counter() - offset
+
+        def active_fn():
+            return self.concurrency(time.perf_counter() - t0)
+        return (self.rate if self.sweeps_rate else self.steps[0][0]), active_fn
+
+    def describe(self, idx):
+        rate, conc = self.steps[idx]
+        return f"step {idx + 1}/{len(self.steps)}: " + (f"rate={rate:g} " if self.sweeps_rate else "") + f"conc={conc}"
+
+    @staticmethod
+    def steady(window):
+        rates = [p["ops_per_sec"] for p in window]
+        mean = sum(rates) / len(rates)
+        cv = (sum((r - mean) ** 2 for r in rates) / len(rates)) ** 0.5 / mean if mean > 0 else float('inf')
+        # разовые выбросы p99 на коротких интервалах — шум; копящаяся очередь — монотонный рост
+        p99s = [p["p99"] for p in window]
+        growing = all(b >= a for a, b in zip(p99s, p99s[1:])) and p99s[-1] > SWEEP_STEADY_P99_GROWTH * p99s[0]
+        return cv <= SWEEP_STEADY_CV and not growing
+
+    def observe(self, point):
+        """Точка interval_point очередного интервала отчёта; False — свип закончен."""
+        self.samples.append(point)
+        in_step = point["t"] - self.step_start
+        window = self.samples[SWEEP_WARMUP_INTERVALS:][-SWEEP_STEADY_INTERVALS:]
+        steady = len(window) == SWEEP_STEADY_INTERVALS and self.steady(window)
+        if in_step < self.step_time or (not steady and in_step < self.step_time * SWEEP_MAX_STEP_FACTOR):
+            return True
+        window = window or self.samples
+        h = LatencyHistogram()
+        for p in window:
+            h.merge(LatencyHistogram.decode(p["hist"]))
+        span = sum(p["span"] for p in window)
+        errors = sum(p["errors"] for p in window)
+        rate, conc = self.steps[self.idx]
+        result = {"step": self.idx + 1, "rate": rate if self.sweeps_rate else None, "concurrency": conc,
+                  "duration": in_step, "steady": steady, "ops_per_sec": h.total / span if span > 0 else 0.0,
+                  "p50": h.percentile(50), "p99": h.percentile(99), "p99.9": h.percentile(99.9),
+                  "error_rate": errors / max(1, h.total + errors)}
+        if self.slo_p99 and result["p99"] * 1000 > self.slo_p99:
+            result["breach"] = f"p99 {result['p99'] * 1000:.2f}ms > SLO {self.slo_p99:g}ms"
+        elif result["error_rate"] > self.max_error_rate:
+            result["breach"] = f"errors {100 * result['error_rate']:.2f}% > {100 * self.max_error_rate:g}%"
+        elif self.sweeps_rate and (h.total + errors) / max(span, 1e-9) < SWEEP_MIN_ACHIEVED * rate:
+            result["breach"] = f"achieved {(h.total + errors) / max(span, 1e-9):.0f} of {rate:g} ops/s"
+        elif not steady:
+            result["breach"] = f"no steady state within {in_step:.0f}s"
+        self.results.append(result)
+        print(f"[{now_ts()}] Sweep {self.describe(self.idx)} -> ops/s={result['ops_per_sec']:.1f} "
+              f"p50={result['p50'] * 1000:.2f}ms p99={result['p99'] * 1000:.2f}ms errors={100 * result['error_rate']:.2f}% "
+              f"{'steady' if steady else 'unsteady'} after {in_step:.0f}s" + (f"; stop: {result['breach']}" if "breach" in result else ""))
+        if "breach" in result or self.idx + 1 == len(self.steps):
+            self.stop_reason = result.get("breach", "last step done")
+            return False
+        self.idx += 1
+        self.step_start = point["t"]
+        self.history.append((point["t"], self.idx))
+        self.samples = []
+        print(f"[{now_ts()}] Sweep {self.describe(self.idx)}")
+        return True
+
+    def knee(self):
+        return find_knee([(r["ops_per_sec"], r["p99"]) for r in self.results])
+
+    def max_sustainable(self):
+        """Индекс ступени с наибольшим ops/s среди выдержавших SLO и порог ошибок."""
+        ok = [i for i, r in enumerate(self.results) if "breach" not in r]
+        return max(ok, key=lambda i: self.results[i]["ops_per_sec"]) if ok else None
+
+    def report(self, indent="   "):
+        knee, best = self.knee(), self.max_sustainable()
+        peak = max([r["p99"] for r in self.results] + [1e-9])
+        width = 30
+        lines = [f"{indent}{'step':>4}{'rate':>9}{'conc':>6}{'ops/s':>10}{'p50':>9}{'p99':>9}{'p99.9':>9}{'err%':>7}"
+                 f"{'steady':>8}  p99 (ms)"]
+        for i, r in enumerate(self.results):
+            rate = f"{r['rate']:g}" if r["rate"] is not None else "-"
+            marks = [m for m, j in (("knee", knee), ("max", best)) if j == i] + ([r["breach"]] if "breach" in r else [])
+            lines.append(f"{indent}{r['step']:>4}{rate:>9}{r['concurrency']:>6}{r['ops_per_sec']:>10.1f}{r['p50'] * 1000:>9.2f}"
+                         f"{r['p99'] * 1000:>9.2f}{r['p99.9'] * 1000:>9.2f}{100 * r['error_rate']:>7.2f}"
+                         f"{'yes' if r['steady'] else 'no':>8}  {'#' * max(1, int(round(r['p99'] / peak * width))):<{width}}"
+                         + (f" <- {', '.join(marks)}" if marks else ""))
+        if knee is not None:
+            r = self.results[knee]
+            lines.append(f"{indent}knee: step {r['step']} at {r['ops_per_sec']:.1f} ops/s, p99 {r['p99'] * 1000:.2f}ms")
+        if best is not None:
+            r = self.results[best]
+            lines.append(f"{indent}max sustainable: step {r['step']} at {r['ops_per_sec']:.1f} ops/s, p99 {r['p99'] * 1000:.2f}ms"
+                         + (f" (SLO {self.slo_p99:g}ms)" if self.slo_p99 else ""))
+        lines.append(f"{indent}stopped: {self.stop_reason or 'interrupted'}")
+        return "\n".join(lines)
+
+    def summary(self):
+        return {"spec": self.spec, "slo_p99_ms": self.slo_p99, "max_error_rate": self.max_error_rate,
+                "step_time": self.step_time, "steps": self.results, "knee": self.knee(),
+                "max_sustainable": self.max_sustainable(), "stop_reason": self.stop_reason}
+
+
+class Dispatcher(threading.Thread):
+    """Open-loop генератор нагрузки: кладёт намеченные моменты старта в очередь, не дожидаясь воркеров."""
+
+    def __init__(self, schedule, arrivals):
+        super().__init__(daemon=True, name="dispatcher")
+        self.schedule = schedule
+        self.arrivals = arrivals
+        self.dispatched = 0
+
+    def backlog(self):
+        return self.arrivals.qsize()
+
+    def run(self):
+        nxt = self.schedule.next()
+        while not STOP.is_set():
+            now = time.perf_counter()
+            while nxt is not None and nxt <= now:
+                self.arrivals.put(nxt)
+                self.dispatched += 1
+                nxt = self.schedule.next()
+            STOP.wait(0.1 if nxt is None else min(nxt - now, 0.1))
+            if nxt is None:
+                nxt = self.schedule.next()
+
+
+def build_cdf(ratios):
+    keys = list(ratios.keys())
+    weights = [ratios[k] for k in keys]
+    total = sum(weights)
+    if total <= 0:
+        raise ValueError("Ratios sum must be > 0")
+    cdf = []
+    acc = 0.0
+    for k in keys:
+        acc += ratios[k] / total
+        cdf.append((acc, k))
+    return cdf
+
+
+def choose_from_cdf(cdf, rnd=random.random):
+    r = rnd()
+    for thresh, k in cdf:
+        if r <= thresh:
+            return k
+    return cdf[-1][1]
+
+
+class OpRunner(threading.Thread):
+    def __init__(self, name, dbworker, ratios, ops_per_sec, stats, arrivals=None, pipeline_depth=DEFAULT_PIPELINE_DEPTH,
+                 index=0, active_fn=None, seed=None):
+        super().__init__(daemon=True)
+        self.pipeline_depth = pipeline_depth
+        # --profile: воркер с index >= active_fn() простаивает, пока профиль не поднимет число клиентов
+        self.index = index
+        self.active_fn = active_fn
+        self.name = name
+        self.dbworker = dbworker
+        self.ratios = ratios
+        self.ops_per_sec = ops_per_sec
+        self.stats = stats
+        self.arrivals = arrivals
+        self.recorder = OpRecorder()
+        self.ops_map = dbworker.ops_map()
+        self.cdf = build_cdf(ratios)
+        # --random_seed: у клиента с тем же именем та же последовательность операций (и на каждой --target)
+        self.rng = random.Random(f"{seed}:{name}") if seed is not None else random
+
+    def choose_op(self):
+        return choose_from_cdf(self.cdf, self.rng.random)
+
+    def execute(self, op, intended=None):
+        """Выполняет операцию; задержка считается от намеченного момента старта, если он задан."""
+        self.stats.incr('in_flight', 1)
+        try:
+            start = time.perf_counter()
+            self.ops_map[op]()
+            end = time.perf_counter()
+            self.recorder.record(op, end - (start if intended is None else intended))
+            self.stats.incr('ops', 1)
+            self.stats.incr_type(op)
+            self.stats.add_time(end - start)
+        except Exception as e:
+            self.stats.incr_error(op, exc=e)
+            # print occasional errors
+            if self.stats.data['errors'] % 10 == 1:
+                print(f"[{now_ts()}] Worker {self.name} error: {repr(e)}", file=sys.stderr)
+        finally:
+            self.stats.incr('in_flight', -1)
+
+    def execute_batch(self, batch):
+        """
+        --protocol pipeline: операции из PIPELINE_OPS уходят одной пачкой, остальные выполняются по одной.
+        batch — список (op, intended); задержка каждой операции — до получения результатов всей пачки.
+        """
+        piped = [(op, intended) for op, intended in batch if op in PIPELINE_OPS]
+        for op, intended in batch:
+            if op not in PIPELINE_OPS:
+                self.execute(op, intended)
+        if not piped:
+            return
+        self.stats.incr('in_flight', len(piped))
+        try:
+            start = time.perf_counter()
+            self.dbworker.run_pipeline([op for op, _ in piped])
+            end = time.perf_counter()
+            for op, intended in piped:
+                self.recorder.record(op, end - (start if intended is None else intended))
+                self.stats.incr_type(op)
+            self.stats.incr('ops', len(piped))
+            self.stats.add_time(end - start)
+        except Exception as e:
+            for op, _ in piped:
+                self.stats.incr_error(op, exc=e)
+            if self.stats.data['errors'] % 10 < len(piped):
+                print(f"[{now_ts()}] Worker {self.name} pipeline error: {repr(e)}", file=sys.stderr)
+        finally:
+            self.stats.incr('in_flight', -len(piped))
+
+    def run(self):
+        self.dbworker.local.rng = self.rng
+        if self.arrivals is not None:
+            self.run_open_loop()
+        else:
+            self.run_closed_loop()
+
+    def run_open_loop(self):
+        while not STOP.is_set():
+            if self.active_fn is not None and self.index >= self.active_fn():
+                STOP.wait(0.1)
+                continue
+            try:
+                intended = self.arrivals.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            self.stats.observe_max('start_delay', time.perf_counter() - intended)
+            if self.dbworker.protocol != 'pipeline':
+                self.execute(self.choose_op(), intended)
+                continue
+            # в пачку идут уже наступившие моменты старта, не больше pipeline_depth
+            batch = [(self.choose_op(), intended)]
+            while len(batch) < self.pipeline_depth:
+                try:
+                    batch.append((self.choose_op(), self.arrivals.get_nowait()))
+                except queue.Empty:
+                    break
+            self.execute_batch(batch)
+
+    def run_closed_loop(self):
+        sleep_interval = 0.0
+        if self.ops_per_sec > 0:
+            sleep_interval = 1.0 / self.ops_per_sec
+        last = time.time()
+        while not STOP.is_set():
+            if self.active_fn is not None and self.index >= self.active_fn():
+                STOP.wait(0.1)  # --sweep conc= без скорости: лишние клиенты ждут своей ступени
+                last = time.time()
+                continue
+            n = 1
+            if self.dbworker.protocol == 'pipeline':
+                n = self.pipeline_depth
+                self.execute_batch([(self.choose_op(), None) for _ in range(n)])
+            else:
+                self.execute(self.choose_op())
+            # pacing
+            if sleep_interval > 0:
+                end = last + sleep_interval * n
+                to_sleep = end - time.time()
+                if to_sleep > 0:
+                    STOP.wait(to_sleep)
+                last = time.time()
+            else:
+                STOP.wait(0.001)
+
+
+class AsyncDBWorker(ProdSimParams):
+    """
+    Те же операции, что у DBWorker, на asyncpg: шаблоны STATEMENTS с плейсхолдерами $n (to_dollar_params),
+    транзакции через conn.transaction(). Экземпляр на клиента-корутину: rng — его генератор (--random_seed).
+    """
+
+    def __init__(self, pool, table_names, batch_insert=100, keys=None, rng=random, queries=None):
+        self.pool = pool
+        self.table_names = table_names
+        self.batch_insert = batch_insert
+        self.keys = keys or KeySampler()
+        self.rng = rng
+        self.queries = {} if queries is None else queries  # общий на движок кэш текста запросов
+
+    def query(self, name, t):
+        q = self.queries.get((name, t))
+        if q is None:
+            q = self.queries[(name, t)] = to_dollar_params(STATEMENTS[name].format(tbl=quote_ident(t)))
+        return q
+
+    @staticmethod
+    def affected(status):
+        # asyncpg возвращает тег команды: 'UPDATE 1', 'DELETE 0'
+        return int(status.rsplit(' ', 1)[-1])
+
+    async def with_existing_key(self, conn, t, fn, op=None):
+        for _ in range(self.keys.max_retries):
+            key = await self.keys.pick_async(t, conn, op, self.rng.random)
+            if key is None:
+                return False
+            if await fn(key):
+                self.keys.hit()
+                return True
+            self.keys.miss()
+        return False
+
+    async def op_select_point(self):
+        t = self.pick_table()
+        async with self.pool.acquire() as conn:
+            async def lookup(key):
+                return await conn.fetchrow(self.query('select_point', t), key) is not None
+            await self.with_existing_key(conn, t, lookup, 'select_point')
+
+    async def op_select_range(self):
+        t = self.pick_table()
+        async with self.pool.acquire() as conn:
+            await conn.fetch(self.query('select_range', t), *self.range_bounds())
+
+    async def op_insert_single(self):
+        t = self.pick_table()
+        async with self.pool.acquire() as conn:
+            new_id = await conn.fetchval(self.query('insert', t), *self.new_row(128))
+        self.keys.note_insert(t, new_id)
+
+    async def op_batch_insert(self, batch_size=None):
+        batch_size = batch_size or self.batch_insert
+        t = self.pick_table()
+        vals = [self.new_row(64) for _ in range(batch_size)]
+        async with self.pool.acquire() as conn:
+            await conn.executemany(self.query('batch_insert', t), vals)
+
+    async def op_update(self):
+        t = self.pick_table()
+        async with self.pool.acquire() as conn:
+            async def update(key):
+                return self.affected(await conn.execute(self.query('update', t), *self.update_values(key))) > 0
+            await self.with_existing_key(conn, t, update, 'update')
+
+    async def op_delete(self):
+        t = self.pick_table()
+        async with self.pool.acquire() as conn:
+            async def delete(key):
+                return self.affected(await conn.execute(self.query('delete', t), key)) > 0
+            await self.with_existing_key(conn, t, delete, 'delete')
+
+    async def op_upsert(self):
+        t = self.pick_table()
+        async with self.pool.acquire() as conn:
+            new_id = await conn.fetchval(self.query('upsert', t), *self.unique_row())
+        self.keys.note_insert(t, new_id)
+
+    async def op_transaction(self):
+        t = self.pick_table()
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                found = []
+
+                async def lock_row(key):
+                    r = await conn.fetchrow(self.query('lock_row', t), key)
+                    if r is not None:
+                        found.append(r)
+                    return r is not None
+                if await self.with_existing_key(conn, t, lock_row, 'transaction'):
+                    await conn.execute(self.query('bump', t), found[0][0])
+                else:
+                    await conn.execute(self.query('insert_plain', t), *self.new_row(40, value=1))
+
+    async def op_join(self):
+        t = self.pick_table()
+        async with self.pool.acquire() as conn:
+            await conn.fetch(self.query('join', t), *self.join_bounds())
+
+
+class AsyncEngine(threading.Thread):
+    """
+    asyncio-движок: тысячи виртуальных клиентов-корутин в одном потоке поверх ограниченного
+    пула asyncpg (--pool_size соединений). Свой event loop в отдельном потоке, чтобы отчёты
+    в главном потоке работали так же, как для потокового движка.
+    """
+
+    def __init__(self, conn_kwargs, table_names, ratios, stats, keys, concurrency, ops_per_sec,
+                 arrival=DEFAULT_ARRIVAL, pool_size=100, batch_insert=DEFAULT_BATCH_INSERT, active_fn=None, seed=None,
+                 prefix="w"):
+        super().__init__(daemon=True, name="asyncio-engine")
+        self.conn_kwargs = conn_kwargs
+        self.table_names = table_names
+        self.cdf = build_cdf(ratios)
+        self.stats = stats
+        self.keys = keys
+        self.concurrency = concurrency
+        self.ops_per_sec = ops_per_sec
+        self.arrival = arrival
+        self.pool_size = pool_size
+        self.batch_insert = batch_insert
+        self.recorder = OpRecorder()
+        self.queries = {}
+        self.arrivals = None
+        self.dispatched = 0
+        self.active_fn = active_fn
+        # --random_seed: клиент idx — "{prefix}{idx+1}", как OpRunner у потокового движка
+        self.seed = seed
+        self.prefix = prefix
+        # ops_per_sec может быть функцией времени (--profile), тогда нагрузка всегда open-loop
+        self.open_loop = arrival != 'closed' and (callable(ops_per_sec) or ops_per_sec > 0)
+
+    def backlog(self):
+        return self.arrivals.qsize() if self.arrivals is not None else 0
+
+    def run(self):
+        try:
+            asyncio.run(self.main())
+        except Exception as e:
+            print(f"[{now_ts()}] asyncio engine failed: {e!r}", file=sys.stderr)
+            STOP.set()
+
+    async def main(self):
+        kw = self.conn_kwargs
+        print(f"[{now_ts()}] Opening asyncpg pool of {self.pool_size} connections...")
+        self.pool = await asyncpg.create_pool(host=kw['host'], port=kw['port'], user=kw['user'], password=kw['password'],
+                                              database=kw['dbname'], min_size=self.pool_size, max_size=self.pool_size)
+        tasks = []
+        if self.open_loop:
+            self.arrivals = asyncio.Queue()
+            schedule = ArrivalSchedule(self.ops_per_sec, self.arrival, rng=self.make_rng(f"{self.prefix}arrivals"))
+            tasks.append(asyncio.create_task(self.dispatch(schedule)))
+        tasks += [asyncio.create_task(self.client(i)) for i in range(self.concurrency)]
+        try:
+            while not STOP.is_set():
+                await asyncio.sleep(0.1)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.pool.close()
+
+    def make_rng(self, name):
+        return random.Random(f"{self.seed}:{name}") if self.seed is not None else random
+
+    def ops_map(self, worker):
+        return {
+            'select_point': worker.op_select_point,
+            'select_range': worker.op_select_range,
+            'insert': worker.op_insert_single,
+            'batch_insert': worker.op_batch_insert,
+            'update': worker.op_update,
+            'delete': worker.op_delete,
+            'upsert': worker.op_upsert,
+            'transaction': worker.op_transaction,
+            'join': worker.op_join
+        }
+
+    async def dispatch(self, schedule):
+        nxt = schedule.next()
+        while True:
+            now = time.perf_counter()
+            while nxt is not None and nxt <= now:
+                self.arrivals.put_nowait(nxt)
+                self.dispatched += 1
+                nxt = schedule.next()
+            await asyncio.sleep(0.1 if nxt is None else min(nxt - now, 0.1))
+            if nxt is None:
+                nxt = schedule.next()
+
+    async def execute(self, ops, op, intended=None):
+        self.stats.incr('in_flight', 1)
+        try:
+            start = time.perf_counter()
+            await ops[op]()
+            end = time.perf_counter()
+            self.recorder.record(op, end - (start if intended is None else intended))
+            self.stats.incr('ops', 1)
+            self.stats.incr_type(op)
+            self.stats.add_time(end - start)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats.incr_error(op, exc=e)
+            if self.stats.data['errors'] % 10 == 1:
+                print(f"[{now_ts()}] Async client error: {repr(e)}", file=sys.stderr)
+        finally:
+            self.stats.incr('in_flight', -1)
+
+    async def client(self, idx):
+        rng = self.make_rng(f"{self.prefix}{idx + 1}")
+        ops = self.ops_map(AsyncDBWorker(self.pool, self.table_names, batch_insert=self.batch_insert, keys=self.keys,
+                                         rng=rng, queries=self.queries))
+        if self.open_loop:
+            while True:
+                if self.active_fn is not None and idx >= self.active_fn():
+                    await asyncio.sleep(0.1)
+                    continue
+                intended = await self.arrivals.get()
+                self.stats.observe_max('start_delay', time.perf_counter() - intended)
+                await self.execute(ops, choose_from_cdf(self.cdf, rng.random), intended)
+        interval = self.concurrency / self.ops_per_sec if self.ops_per_sec > 0 else 0.0
+        while True:
+            if self.active_fn is not None and idx >= self.active_fn():
+                await asyncio.sleep(0.1)
+                continue
+            last = time.perf_counter()
+            await self.execute(ops, choose_from_cdf(self.cdf, rng.random))
+            await asyncio.sleep(max(0.0, last + interval - time.perf_counter()) if interval else 0)
+
+
+def raise_nofile_limit(needed):
+    """Тысячи соединений упираются в ulimit -n: поднимаем мягкий лимит до жёсткого, если нужно."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < needed:
+            new_soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+            if new_soft < needed:
+                print(f"[{now_ts()}] Warning: open files limit {new_soft} < {needed}, raise ulimit -n", file=sys.stderr)
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def split_evenly(total, parts):
+    """Делит целое total на parts слагаемых, отличающихся не больше чем на 1; сумма ровно total."""
+    base, extra = divmod(total, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+
+def default_pool_size(engine, concurrency):
+    return min(concurrency, 500) if engine == 'asyncio' else concurrency + 2
+
+
+def build_runners(args, ratios, table_names, stats, keys, dbworker, conn_kwargs, concurrency, ops_per_sec, pool_size,
+                  profile=None, part=0, parts=1, offset=0.0):
+    """
+    Исполнители одного процесса. Возвращает (threads, dispatcher, recorders):
+    threads — что запустить и дождаться, dispatcher — источник backlog()/dispatched (или None для closed-loop).
+    С profile скорость и число активных клиентов берутся из его доли part из parts.
+    """
+    rate, active_fn = ops_per_sec, None
+    # имена клиентов — ключ их генераторов при --random_seed: у процессов --processes они разные
+    prefix = f"p{part + 1}w" if parts > 1 else "w"
+    if profile is not None:
+        rate, active_fn = profile.share(part, parts, offset)
+    if args.engine == 'asyncio':
+        engine = AsyncEngine(conn_kwargs, table_names, ratios, stats, keys, concurrency, rate,
+                             arrival=args.arrival, pool_size=pool_size, batch_insert=args.batch_insert, active_fn=active_fn,
+                             seed=args.random_seed, prefix=prefix)
+        return [engine], (engine if engine.open_loop else None), [engine.recorder]
+    dispatcher = None
+    arrivals = None
+    if args.arrival != 'closed' and (callable(rate) or rate > 0):
+        arrivals = queue.Queue()
+        rng = random.Random(f"{args.random_seed}:{prefix}arrivals") if args.random_seed is not None else random
+        dispatcher = Dispatcher(ArrivalSchedule(rate, args.arrival, rng=rng), arrivals)
+    per_worker_ops = float(ops_per_sec) / max(1, concurrency)
+    runners = [OpRunner(f"{prefix}{i+1}", dbworker, ratios, per_worker_ops, stats, arrivals=arrivals, pipeline_depth=args.pipeline_depth,
+                        index=i, active_fn=active_fn, seed=args.random_seed)
+               for i in range(concurrency)]
+    threads = runners + ([dispatcher] if dispatcher else [])
+    return threads, dispatcher, [r.recorder for r in runners]
+
+
+def worker_process(idx, args, ratios, table_names, concurrency, ops_per_sec, pool_size, outbox, stop_event, run_start):
+    """
+    Дочерний процесс --processes: свой GIL, свой пул соединений и свои исполнители.
+    Раз в секунду отправляет родителю накопленные гистограммы и счётчики (см. ProcessAggregator).
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # останавливает родитель через stop_event
+    keys = make_key_sampler(args)
+    conn_kwargs = dict(host=args.host, port=args.port, user=args.user, password=args.password, dbname=args.dbname)
+    if args.engine == 'asyncio':
+        raise_nofile_limit(pool_size + 256)
+    pool = make_pool(args.backend, 1, 2 if args.engine == 'asyncio' else max(2, pool_size), conn_kwargs)
+    dbworker = make_dbworker(args, pool, table_names, keys, args.protocol, conn_kwargs)
+    stats = SafeStats()
+    profile = LoadProfile.load(args.profile, args.concurrency) if args.profile else None
+    # --target: все цели начинают в общий момент run_start
+    delay = run_start - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    threads, dispatcher, recorders = build_runners(args, ratios, table_names, stats, keys, dbworker, conn_kwargs,
+                                                   concurrency, ops_per_sec, pool_size, profile=profile,
+                                                   part=idx, parts=args.processes, offset=time.time() - run_start)
+    for t in threads:
+        t.start()
+
+    def send(final=False):
+        hists = defaultdict(LatencyHistogram)
+        for rec in recorders:
+            for op, h in rec.swap_interval().items():
+                hists[op].merge(h)
+        data, by_type, _ = stats.snapshot()
+        outbox.put({
+            "proc": idx, "final": final,
+            "hists": {op: h.encode() for op, h in hists.items()},
+            "data": data, "by_type": by_type, "errors_by_type": stats.errors_snapshot(),
+            "lock_waits": {op: h.encode() for op, h in dbworker.lock_waits.swap_interval().items()},
+            "start_delay": stats.pop_max('start_delay', None),
+            "keys": keys.snapshot(),
+            "backlog": dispatcher.backlog() if dispatcher else 0,
+            "dispatched": dispatcher.dispatched if dispatcher else 0,
+        })
+
+    while not stop_event.wait(1.0) and not STOP.is_set():
+        send()
+    STOP.set()
+    for t in threads:
+        t.join(timeout=5)
+    send(final=True)
+    dbworker.close_pipeline_conns()
+    pool.closeall()
+
+
+class ProcessAggregator:
+    """
+    Сводит сообщения дочерних процессов в статистику родителя. Для Reporter выглядит как OpRecorder
+    (swap_interval), для отчёта — как диспетчер (backlog/dispatched) и KeySampler (snapshot).
+    Счётчики приходят накопленными — в SafeStats родителя добавляется разница с прошлым сообщением.
+    """
+
+    def __init__(self, inbox, stats):
+        self.inbox = inbox
+        self.stats = stats
+        self.pending = defaultdict(LatencyHistogram)
+        self.lock_waits = OpRecorder()  # как DBWorker.lock_waits, но сведённый из всех процессов
+        self.last = {}
+        self.finished = set()
+
+    def _apply(self, msg):
+        for op, enc in msg["hists"].items():
+            self.pending[op].merge(LatencyHistogram.decode(enc))
+        for op, enc in msg["lock_waits"].items():
+            self.lock_waits.merge(op, LatencyHistogram.decode(enc))
+        prev = self.last.get(msg["proc"], {"data": {}, "by_type": {}, "errors_by_type": {}})
+        for k, v in msg["data"].items():
+            self.stats.incr(k, v - prev["data"].get(k, 0))
+        for op, v in msg["by_type"].items():
+            self.stats.incr_type(op, v - prev["by_type"].get(op, 0))
+        for op, v in msg["errors_by_type"].items():
+            # общий счётчик errors уже пришёл в data
+            self.stats.incr_error(op, v - prev["errors_by_type"].get(op, 0), count_total=False)
+        if msg["start_delay"] is not None:
+            self.stats.observe_max('start_delay', msg["start_delay"])
+        self.last[msg["proc"]] = msg
+        if msg["final"]:
+            self.finished.add(msg["proc"])
+
+    def drain(self, timeout=None):
+        """Забирает всё, что уже пришло; с timeout — ждёт хотя бы одно сообщение."""
+        try:
+            if timeout is not None:
+                self._apply(self.inbox.get(timeout=timeout))
+            while True:
+                self._apply(self.inbox.get_nowait())
+        except queue.Empty:
+            pass
+
+    def wait_final(self, procs, timeout=15):
+        deadline = time.time() + timeout
+        while len(self.finished) < len(procs) and time.time() < deadline:
+            if not any(p.is_alive() for p in procs) and self.inbox.empty():
+                break
+            self.drain(timeout=0.2)
+
+    def swap_interval(self):
+        self.drain()
+        current = self.pending
+        self.pending = defaultdict(LatencyHistogram)
+        return current
+
+    def backlog(self):
+        return sum(m["backlog"] for m in self.last.values())
+
+    @property
+    def dispatched(self):
+        return sum(m["dispatched"] for m in self.last.values())
+
+    def snapshot(self):
+        hits = sum(m["keys"][0] for m in self.last.values())
+        misses = sum(m["keys"][1] for m in self.last.values())
+        return hits, misses
@@ -0,0 +1,529 @@
+"""
+load_test_replay.py
+--replay для load_test_prod.py: разбор csvlog PostgreSQL или CSV-выгрузки pg_stat_statements в шаблоны запросов;
+csvlog воспроизводится по исходным сессиям и моментам, pgss — взвешенной смесью.
+"""
+
+import csv
+import json
+import re
+import time
+import threading
+import sys
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import psycopg2
+import psycopg2.extensions
+
+from load_test_common import STOP, now_ts, rand_string, to_dollar_params
+from load_test_stats import LatencyHistogram, OpRecorder
+from load_test_backends import DEFAULT_PROTOCOL, DBWorker
+
+
+# --replay: разбор лога запросов
+DEFAULT_REPLAY_SPEED = 1.0
+
+# csvlog: "duration: 0.123 ms  statement: ..." (log_min_duration_statement=0), "execute <unnamed>: ..."
+# (extended protocol, значения — в DETAIL "parameters: $1 = '5'"), отдельные "duration: ..." (log_duration)
+CSVLOG_MESSAGE_RE = re.compile(r"^(?:duration: (?P<ms>[\d.]+) ms\s*)?(?:(?P<kind>statement|execute [^:]*): (?P<sql>.*))?$", re.S)
+LOG_TIME_RE = re.compile(r"^\s*(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d{3}(?:\d{3})?)?)")
+CSVLOG_BIND_RE = re.compile(r"\$(\d+) = (NULL|'((?:[^']|'')*)')")
+SQL_TOKEN_RE = re.compile(r"""
+      (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<dollar>\$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=tag)\$)
+    | (?P<param>\$\d+)
+    | (?P<estring>[eE]'(?:[^'\\]|\\.|'')*')
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<ident>"(?:[^"]|"")*")
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[A-Za-z_][\w$]*)
+    | (?P<space>\s+)
+    | (?P<other>::|.)
+""", re.S | re.X)
+# type 'literal' (interval '1 day', date '2024-01-01', ...) — литерал часть синтаксиса, в параметр не выносится
+TYPED_LITERAL_WORDS = {'interval', 'date', 'time', 'timestamp', 'timestamptz', 'timetz', 'zone', 'json', 'jsonb', 'uuid',
+                       'inet', 'cidr', 'bool', 'boolean', 'numeric', 'int', 'integer', 'bigint', 'text', 'varchar',
+                       'bytea', 'point', 'b', 'x', 'n'}
+# PREPARE умеет только эти команды; остальное (BEGIN, SET, DDL, несколько запросов сразу) уходит simple query
+PREPARABLE_WORDS = ('select', 'insert', 'update', 'delete', 'with', 'values', 'merge', 'table')
+# в --replay_format pgss взвешенная смесь выполняется вне исходных транзакций — управляющие команды пропускаются
+PGSS_SKIP_WORDS = ('begin', 'start', 'commit', 'end', 'rollback', 'abort', 'savepoint', 'release', 'set', 'reset',
+                   'discard', 'deallocate', 'prepare', 'execute', 'listen', 'unlisten', 'show', 'close', 'fetch', 'declare')
+# pgss: текст нормализован ($1, $2, ...). Для "колонка op $n" значения берутся из выборки колонки на целевой базе,
+# остальные генерируются по типу параметра, который сервер выводит при PREPARE (pg_prepared_statements, PG14+)
+PGSS_SAMPLE_ROWS = 1000
+PGSS_NAME = r'(?:"(?:[^"]|"")+"|[A-Za-z_]\w*)'
+PGSS_COLUMN_RE = r'({name}(?:\.{name})?)\s*(?:=|<>|!=|<=|>=|<|>|\bin\b|\blike\b|\bilike\b|=\s*any)\s*\(?\s*\${n}(?!\d)'
+PGSS_TABLE_RE = re.compile(rf"\b(?:from|join|update|into)\s+(?:only\s+)?({PGSS_NAME}(?:\.{PGSS_NAME})?)"
+                           rf"(?:\s+(?:as\s+)?(?!(?:on|where|join|inner|left|right|full|cross|natural|lateral|using|group|order|"
+                           rf"limit|offset|set|values|returning|for|union|having|window|tablesample|select|default|inner|outer)\b)({PGSS_NAME}))?", re.I)
+
+
+def sql_escape_template(text):
+    """Кусок исходного SQL -> часть шаблона: % и {} не должны трогать ни psycopg2, ни str.format (DBWorker.query)."""
+    return text.replace('%', '%%').replace('{', '{{').replace('}', '}}')
+
+
+def parameterize_sql(text, binds=None):
+    """
+    Литералы запроса -> %s. Возвращает (шаблон, параметры). binds — значения $n из DETAIL "parameters: ...";
+    $n без значения — ValueError. Не трогает typed literals (interval '1 day'), E'' и $$-строки,
+    номера колонок в ORDER BY/GROUP BY и модификаторы типов (::varchar(20)).
+    """
+    out, params, prev = [], [], []
+    in_by = typmod = False
+    for m in SQL_TOKEN_RE.finditer(text):
+        kind, tok = m.lastgroup, m.group()
+        if kind in ('space', 'comment'):
+            if out and out[-1] != ' ':
+                out.append(' ')
+            continue
+        last = prev[-1] if prev else ''
+        if kind == 'param':
+            n = int(tok[1:])
+            if binds is None or n not in binds:
+                raise ValueError(f"no value for {tok}")
+            out.append('%s')
+            params.append(binds[n])
+        elif kind == 'string' and last not in TYPED_LITERAL_WORDS:
+            out.append('%s')
+            params.append(tok[1:-1].replace("''", "'"))
+        elif kind == 'number' and not typmod and not (in_by and last in ('by', ',')):
+            out.append('%s')
+            params.append(Decimal(tok) if any(c in tok for c in '.eE') else int(tok))
+        else:
+            if kind == 'word':
+                lw = tok.lower()
+                if lw == 'by':
+                    in_by = True
+                elif lw not in ('asc', 'desc', 'nulls', 'first', 'last'):
+                    in_by = False
+                prev.append(lw)
+                out.append(sql_escape_template(tok))
+                continue
+            if tok == '(' and len(prev) >= 2 and prev[-2] == '::':
+                typmod = True
+            elif tok in (')', ';'):
+                typmod = in_by = False
+            out.append(sql_escape_template(tok))
+        prev.append(tok)
+    return ''.join(out).strip().rstrip(';').strip(), params
+
+
+class PgssParam:
+    """Место $n нормализованного запроса pg_stat_statements — значение подставляет ReplayWorker.bind."""
+    __slots__ = ('n',)
+
+    def __init__(self, n):
+        self.n = n
+
+
+class PgssSlots(dict):
+    """binds для parameterize_sql: значение есть у любого $n — это его PgssParam."""
+
+    def __contains__(self, n):
+        return True
+
+    def __missing__(self, n):
+        return PgssParam(n)
+
+
+def pgss_generator(typ, clause=None):
+    """
+    Генератор значений $n — функция от random.Random клиента — по типу из pg_prepared_statements
+    (regtype::text); LIMIT/OFFSET — небольшие числа.
+    """
+    base = typ[:-2] if typ.endswith('[]') else typ
+    if clause == 'limit':
+        gen = lambda rng: rng.randint(1, 100)
+    elif clause == 'offset':
+        gen = lambda rng: rng.randint(0, 100)
+    elif base in ('smallint', 'integer', 'bigint', 'oid'):
+        gen = lambda rng: rng.randint(1, 1000)
+    elif base in ('numeric', 'real', 'double precision', 'money'):
+        gen = lambda rng: round(rng.uniform(0, 1000), 2)
+    elif base == 'boolean':
+        gen = lambda rng: rng.random() < 0.5
+    elif base.startswith('timestamp'):
+        gen = lambda rng: datetime.utcnow() - timedelta(seconds=rng.uniform(0, 30 * 86400))
+    elif base == 'date':
+        gen = lambda rng: (datetime.utcnow() - timedelta(days=rng.randint(0, 30))).date()
+    elif base == 'interval':
+        gen = lambda rng: timedelta(minutes=rng.randint(1, 1440))
+    elif base == 'uuid':
+        gen = lambda rng: str(uuid.uuid4())  # идентификатор: уникален и при повторе с тем же --random_seed
+    elif base in ('json', 'jsonb'):
+        gen = lambda rng: '{}'
+    else:
+        gen = lambda rng: rand_string(12, rng)
+    if base != typ:
+        return lambda rng: [gen(rng)]
+    return gen
+
+
+def parse_log_time(text):
+    """'2024-05-01 12:00:00.123 UTC' -> datetime (зона одна на весь лог, её можно отбросить)."""
+    m = LOG_TIME_RE.match(text)
+    if not m:
+        raise ValueError(f"bad log_time: {text!r}")
+    return datetime.fromisoformat(m.group(1))
+
+
+class ReplayLog:
+    """
+    Разобранный лог для --replay: шаблоны запросов q1..qN (по убыванию частоты) и исходные задержки.
+    csvlog даёт сессии [(старт, [(сдвиг от начала лога, qid, параметры), ...])], pgss — веса для смеси.
+    """
+
+    def __init__(self, fmt):
+        self.format = fmt
+        self.statements = {}
+        self.preparable = set()
+        self.source = defaultdict(LatencyHistogram)
+        self.source_calls = {}
+        self.source_mean = {}
+        self.weights = {}
+        self.mix_params = {}
+        self.sessions = []
+        self.peak_sessions = 0
+        self.span = 0.0
+        self.skipped = 0
+
+    @classmethod
+    def load(cls, path, fmt):
+        log = cls(fmt)
+        csv.field_size_limit(1 << 30)  # длинные запросы не влезают в стандартные 128 КБ на поле
+        with open(path, newline='', encoding='utf-8', errors='replace') as f:
+            if fmt == 'csvlog':
+                log._load_csvlog(csv.reader(f))
+            else:
+                log._load_pgss(csv.DictReader(f))
+        if not log.statements:
+            raise ValueError(f"{path}: no replayable statements ({log.skipped} skipped)")
+        return log
+
+    def _assign(self, counts):
+        """Шаблон -> qid по убыванию числа вызовов."""
+        ids = {}
+        for i, template in enumerate(sorted(counts, key=lambda t: -counts[t])):
+            qid = ids[template] = f"q{i + 1}"
+            self.statements[qid] = template
+            words = template.split(None, 1)
+            if words and words[0].lower() in PREPARABLE_WORDS and ';' not in template:
+                self.preparable.add(qid)
+        return ids
+
+    def _load_csvlog(self, rows):
+        entries = []
+        pending = {}
+        for row in rows:
+            if len(row) < 15 or row[11] != 'LOG':
+                continue
+            session, msg, detail = row[5], row[13], row[14]
+            m = CSVLOG_MESSAGE_RE.match(msg)
+            if not m:
+                continue
+            duration = float(m.group('ms')) / 1000.0 if m.group('ms') else None
+            if m.group('sql') is None:
+                # log_duration: длительность приходит отдельной строкой после "statement: ..."
+                i = pending.pop(session, None)
+                if i is not None and duration is not None:
+                    entries[i][4] = duration
+                continue
+            binds = None
+            if m.group('kind').startswith('execute'):
+                binds = {int(n): (None if v == 'NULL' else s.replace("''", "'")) for n, v, s in CSVLOG_BIND_RE.findall(detail)}
+            try:
+                template, params = parameterize_sql(m.group('sql'), binds)
+            except ValueError:
+                self.skipped += 1
+                continue
+            if not template:
+                continue
+            if duration is None:
+                pending[session] = len(entries)
+            entries.append([session, parse_log_time(row[0]), template, params, duration])
+        if not entries:
+            return
+        counts = defaultdict(int)
+        for e in entries:
+            counts[e[2]] += 1
+        ids = self._assign(counts)
+        # время в csvlog — момент записи строки, т.е. конец запроса: старт = время - длительность
+        starts = [(e[1] - datetime.min).total_seconds() - (e[4] or 0.0) for e in entries]
+        t0 = min(starts)
+        sessions = defaultdict(list)
+        bounds = {}
+        for (session, _, template, params, duration), start in zip(entries, starts):
+            qid = ids[template]
+            offset = start - t0
+            sessions[session].append((offset, qid, params))
+            if duration is not None:
+                self.source[qid].record(duration)
+            lo, hi = bounds.get(session, (offset, offset))
+            bounds[session] = (min(lo, offset), max(hi, offset + (duration or 0.0)))
+        self.sessions = sorted(((bounds[s][0], sorted(stmts, key=lambda x: x[0])) for s, stmts in sessions.items()),
+                               key=lambda x: x[0])
+        self.span = max(hi for _, hi in bounds.values())
+        edges = sorted([(lo, 1) for lo, _ in bounds.values()] + [(hi, -1) for _, hi in bounds.values()],
+                       key=lambda x: (x[0], -x[1]))
+        active = 0
+        for _, d in edges:
+            active += d
+            self.peak_sessions = max(self.peak_sessions, active)
+        for qid in self.statements:
+            self.source_calls[qid] = self.source[qid].total or counts[self.statements[qid]]
+            if self.source[qid].total:
+                self.source_mean[qid] = self.source[qid].mean()
+
+    def _load_pgss(self, rows):
+        counts = defaultdict(int)
+        time_total = defaultdict(float)
+        params = {}
+        for row in rows:
+            query = (row.get('query') or '').strip()
+            calls = int(float(row.get('calls') or 0))
+            mean_ms = float(row.get('mean_exec_time') or row.get('mean_time') or 0.0)
+            words = query.split(None, 1)
+            if not words or calls <= 0 or words[0].lower() in PGSS_SKIP_WORDS:
+                continue
+            try:
+                template, values = parameterize_sql(query, PgssSlots())
+            except ValueError:
+                self.skipped += 1
+                continue
+            # одинаковые запросы разных пользователей/баз — одна строка смеси
+            counts[template] += calls
+            time_total[template] += calls * mean_ms / 1000.0
+            params[template] = values
+        ids = self._assign(counts)
+        for template, qid in ids.items():
+            self.weights[qid] = counts[template]
+            self.mix_params[qid] = params[template]
+            self.source_calls[qid] = counts[template]
+            self.source_mean[qid] = time_total[template] / counts[template]
+
+
+class ReplayWorker(DBWorker):
+    """Выполняет шаблоны ReplayLog через DBWorker.run (--protocol simple/prepared); схему и данные не трогает."""
+
+    def __init__(self, pool, log, protocol=DEFAULT_PROTOCOL, conn_kwargs=None):
+        super().__init__(pool, [''], protocol=protocol, conn_kwargs=conn_kwargs)
+        self.log = log
+        self.statements = log.statements
+        self.slots = {}  # qid -> [(позиция в параметрах, n, генератор)] для $n из pgss
+
+    def prepare_pgss(self):
+        """
+        Значения $n для pgss: тип — из PREPARE шаблона на целевой базе, значения — выборка колонки
+        из "колонка op $n" (иначе генерация по типу). Шаблоны, которые не готовятся, убираются из смеси.
+        """
+        dropped = []
+        with self.conn() as conn:
+            cur = conn.cursor()
+            try:
+                for qid in list(self.log.weights):
+                    params = self.log.mix_params[qid]
+                    positions = [(i, p.n) for i, p in enumerate(params) if isinstance(p, PgssParam)]
+                    if not positions:
+                        continue
+                    text = to_dollar_params(self.query(qid, ''))
+                    try:
+                        cur.execute(f"PREPARE lt_pgss AS {text}")
+                        cur.execute("SELECT parameter_types::text[] FROM pg_prepared_statements WHERE name = 'lt_pgss'")
+                        types = cur.fetchone()[0]
+                        cur.execute("DEALLOCATE lt_pgss")
+                        conn.commit()
+                    except psycopg2.Error:
+                        conn.rollback()
+                        dropped.append(qid)
+                        del self.log.weights[qid]
+                        continue
+                    self.slots[qid] = [(i, n, self.slot_generator(cur, text, i + 1, types[i])) for i, n in positions]
+            finally:
+                conn.rollback()
+                cur.close()
+        return dropped
+
+    @staticmethod
+    def slot_generator(cur, text, pos, typ):
+        """Генератор для $pos шаблона text: случайное значение из выборки колонки, с которой он сравнивается."""
+        m = re.search(rf"\b(limit|offset)\s+\${pos}(?!\d)", text, re.I)
+        if m:
+            return pgss_generator(typ, m.group(1).lower())
+        m = re.search(PGSS_COLUMN_RE.format(name=PGSS_NAME, n=pos), text, re.I)
+        if m:
+            qualifier, _, column = m.group(1).rpartition('.')
+            tables = {}
+            for t in PGSS_TABLE_RE.finditer(text):
+                tables.setdefault(t.group(2) or t.group(1).rsplit('.', 1)[-1], t.group(1))
+            candidates = [tables[qualifier]] if qualifier in tables else list(dict.fromkeys(tables.values()))
+            for table in candidates:
+                for sample in ("TABLESAMPLE SYSTEM (1)", ""):
+                    try:
+                        cur.execute(f"SELECT {column} FROM {table} {sample} WHERE {column} IS NOT NULL LIMIT {PGSS_SAMPLE_ROWS}")
+                        values = [json.dumps(v) if isinstance(v, (dict, list)) and not typ.endswith('[]') else v
+                                  for v, in cur.fetchall()]
+                    except psycopg2.Error:
+                        cur.connection.rollback()
+                        continue
+                    if values:
+                        if typ.endswith('[]'):
+                            values = [[v] for v in values]
+                        return lambda rng: rng.choice(values)
+        return pgss_generator(typ)
+
+    def bind(self, qid):
+        """Параметры шаблона со свежими значениями $n (одинаковые $n в одном запросе — одно значение)."""
+        params = self.log.mix_params[qid]
+        slots = self.slots.get(qid)
+        if not slots:
+            return params
+        params = list(params)
+        values = {}
+        for i, n, gen in slots:
+            if n not in values:
+                values[n] = gen(self.rng)
+            params[i] = values[n]
+        return params
+
+    def ops_map(self):
+        return {qid: (lambda qid=qid: self.op_statement(qid)) for qid in self.log.weights}
+
+    def execute(self, cur, qid, params):
+        if qid in self.log.preparable:
+            self.run(cur, qid, '', params)
+        else:
+            cur.execute(self.query(qid, ''), params)
+        if cur.description is not None:
+            cur.fetchall()
+
+    def op_statement(self, qid):
+        with self.conn() as conn:
+            cur = conn.cursor()
+            try:
+                self.execute(cur, qid, self.bind(qid))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+
+class ReplayDriver(threading.Thread):
+    """
+    --replay_format csvlog: открывает исходные сессии в их моменты старта (сжатые в --replay_speed раз),
+    каждая — поток со своим autocommit-соединением, запросы сессии идут по порядку в исходные моменты.
+    Задержка — время выполнения запроса (как duration в логе); опоздание старта — в max_start_delay.
+    """
+
+    def __init__(self, worker, stats, speed=DEFAULT_REPLAY_SPEED):
+        super().__init__(daemon=True, name="replay")
+        self.worker = worker
+        self.log = worker.log
+        self.stats = stats
+        self.speed = speed
+        self.recorders = []  # тот же список читает Reporter; новые сессии добавляют сюда свои OpRecorder
+        self.lock = threading.Lock()
+        self.active = 0
+        self.started = 0
+
+    def status(self):
+        with self.lock:
+            return f"sessions active={self.active} started={self.started}/{len(self.log.sessions)}"
+
+    def run(self):
+        start = time.perf_counter()
+        threads = []
+        for offset, stmts in self.log.sessions:
+            delay = start + offset / self.speed - time.perf_counter()
+            if delay > 0 and STOP.wait(delay):
+                break
+            if STOP.is_set():
+                break
+            recorder = OpRecorder()
+            self.recorders.append(recorder)
+            t = threading.Thread(target=self.run_session, args=(stmts, start, recorder), daemon=True)
+            with self.lock:
+                self.active += 1
+                self.started += 1
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        print(f"[{now_ts()}] Replay finished: {self.started} of {len(self.log.sessions)} sessions")
+        STOP.set()
+
+    def getconn(self):
+        # при --replay_speed > 1 или медленной цели сессий одновременно больше, чем в исходном логе
+        while not STOP.is_set():
+            try:
+                return self.worker.pool.getconn()
+            except psycopg2.pool.PoolError:
+                STOP.wait(0.01)
+        return None
+
+    def run_session(self, stmts, start, recorder):
+        conn = self.getconn()
+        try:
+            if conn is None:
+                return
+            conn.autocommit = True
+            cur = conn.cursor()
+            for offset, qid, params in stmts:
+                late = time.perf_counter() - (start + offset / self.speed)
+                if late < 0 and STOP.wait(-late):
+                    break
+                if STOP.is_set():
+                    break
+                self.stats.observe_max('start_delay', max(0.0, late))
+                self.stats.incr('in_flight', 1)
+                try:
+                    t0 = time.perf_counter()
+                    self.worker.execute(cur, qid, params)
+                    t1 = time.perf_counter()
+                    recorder.record(qid, t1 - t0)
+                    self.stats.incr('ops', 1)
+                    self.stats.incr_type(qid)
+                    self.stats.add_time(t1 - t0)
+                except psycopg2.Error as e:
+                    self.stats.incr_error(qid, exc=e)
+                    if self.stats.data['errors'] % 10 == 1:
+                        print(f"[{now_ts()}] Replay {qid} error: {repr(e)}", file=sys.stderr)
+                    if conn.closed:
+                        break
+                finally:
+                    self.stats.incr('in_flight', -1)
+        finally:
+            with self.lock:
+                self.active -= 1
+            if conn is not None:
+                if not conn.closed:
+                    # сессия в логе оборвалась внутри BEGIN ... — не отдаём в пул открытую транзакцию
+                    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.cursor().execute("ROLLBACK")
+                    conn.autocommit = False
+                self.worker.pool.putconn(conn, close=conn.closed)
+
+
+def format_replay_table(log, hists, errors, width=60, indent="   "):
+    """Исходные и целевые задержки по шаблонам --replay (ms); ratio — отношение средних цель/источник."""
+    lines = [f"{indent}{'stmt':<7}{'src_n':>9}{'src_mean':>10}{'src_p50':>9}{'src_p99':>9}"
+             f"{'tgt_n':>9}{'tgt_mean':>10}{'tgt_p50':>9}{'tgt_p99':>9}{'ratio':>8}{'errors':>8}  query"]
+    for qid in log.statements:
+        src, tgt = log.source.get(qid), hists.get(qid, LatencyHistogram())
+        src_mean = log.source_mean.get(qid)
+        src_pcts = (f"{src.percentile(50) * 1000:>9.2f}{src.percentile(99) * 1000:>9.2f}" if src is not None and src.total
+                    else f"{'-':>9}{'-':>9}")
+        ratio = f"{tgt.mean() / src_mean:>7.2f}x" if src_mean and tgt.total else f"{'-':>8}"
+        text = ' '.join(log.statements[qid].split()).replace('%%', '%')
+        text = text if len(text) <= width else text[:width - 3] + '...'
+        lines.append(f"{indent}{qid:<7}{log.source_calls.get(qid, 0):>9}"
+                     f"{(f'{src_mean * 1000:.2f}' if src_mean is not None else '-'):>10}{src_pcts}"
+                     f"{tgt.total:>9}{tgt.mean() * 1000:>10.2f}{tgt.percentile(50) * 1000:>9.2f}{tgt.percentile(99) * 1000:>9.2f}"
+                     f"{ratio}{errors.get(qid, 0):>8}  {text}")
+    return "\n".join(lines)
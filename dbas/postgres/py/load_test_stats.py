@@ -0,0 +1,664 @@
+"""
+load_test_stats.py
+Статистика load_test_prod.py: гистограммы задержек, счётчики операций и конфликтов, периодический отчёт,
+экспорт метрик Prometheus и опрос pg_stat_* во время прогона (--server_sample).
+"""
+
+import json
+import time
+import threading
+import sys
+from collections import defaultdict
+
+import psycopg2
+import psycopg2.extensions
+
+from load_test_common import mysql_driver, STOP, now_ts
+
+
+DEFAULT_REPORT_INTERVAL = 5
+
+DEFAULT_METRICS_PORT = 9469
+
+# --server_sample: опрос pg_stat_* во время прогона
+SPIKE_P99_FACTOR = 2.0  # интервал со всплеском — p99 больше медианы p99 интервалов во столько раз
+SERVER_WAITS_SQL = """
+    SELECT coalesce(wait_event_type || ':' || wait_event, 'CPU*'), count(*)
+    FROM pg_stat_activity
+    WHERE backend_type = 'client backend' AND state = 'active' AND pid <> pg_backend_pid()
+    GROUP BY 1"""
+SERVER_DB_SQL = """
+    SELECT xact_commit, xact_rollback, blks_read, blks_hit, temp_files, temp_bytes, deadlocks,
+           tup_returned, tup_fetched, tup_inserted, tup_updated, tup_deleted
+    FROM pg_stat_database WHERE datname = current_database()"""
+SERVER_DB_COLUMNS = ('xact_commit', 'xact_rollback', 'blks_read', 'blks_hit', 'temp_files', 'temp_bytes', 'deadlocks',
+                     'tup_returned', 'tup_fetched', 'tup_inserted', 'tup_updated', 'tup_deleted')
+# PostgreSQL 17 перенёс счётчики контрольных точек из pg_stat_bgwriter в pg_stat_checkpointer
+SERVER_CKPT_SQL_17 = """
+    SELECT c.num_timed, c.num_requested, c.buffers_written, b.buffers_clean, b.maxwritten_clean, b.buffers_alloc
+    FROM pg_stat_checkpointer c, pg_stat_bgwriter b"""
+SERVER_CKPT_SQL = """
+    SELECT checkpoints_timed, checkpoints_req, buffers_checkpoint, buffers_clean, maxwritten_clean, buffers_alloc
+    FROM pg_stat_bgwriter"""
+SERVER_CKPT_COLUMNS = ('ckpt_timed', 'ckpt_req', 'ckpt_buffers', 'bgw_clean', 'bgw_maxwritten', 'buffers_alloc')
+SERVER_LOCKS_SQL = """
+    SELECT count(*), count(*) FILTER (WHERE NOT granted),
+           (SELECT count(*) FROM pg_stat_activity WHERE backend_type = 'autovacuum worker')
+    FROM pg_locks WHERE pid <> pg_backend_pid()"""
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+
+# ошибки конкуренции InnoDB (errno) -> вид, как CONFLICT_SQLSTATES
+MYSQL_CONFLICT_ERRNOS = {1213: 'deadlock', 1205: 'lock_timeout'}
+
+# SQLSTATE конфликтов между транзакциями: считаются отдельно от прочих ошибок (stats conflicts_<вид>)
+CONFLICT_SQLSTATES = {'40001': 'serialization', '40P01': 'deadlock', '55P03': 'lock_timeout'}
+
+
+def conflict_kind(e):
+    """'serialization' | 'deadlock' | 'lock_timeout' для ошибок конкуренции (psycopg2, psycopg 3, asyncpg, MySQL), иначе None."""
+    if mysql_driver is not None and isinstance(e, mysql_driver.MySQLError):
+        return MYSQL_CONFLICT_ERRNOS.get(e.args[0] if e.args else None)
+    return CONFLICT_SQLSTATES.get(getattr(e, 'pgcode', None) or getattr(e, 'sqlstate', None))
+
+
+def format_conflicts(conflicts, prev=None):
+    return " ".join(f"{k}={v}" + (f" (+{v - prev.get(k, 0)})" if prev is not None else "") for k, v in sorted(conflicts.items()))
+
+
+class SafeStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = defaultdict(int)
+        self.by_type = defaultdict(int)
+        self.errors_by_type = defaultdict(int)
+        self.time_total = 0.0
+        self.maxima = {}
+
+    def incr(self, key, n=1):
+        with self.lock:
+            self.data[key] += n
+
+    def add_time(self, t):
+        with self.lock:
+            self.time_total += t
+
+    def incr_type(self, opname, n=1):
+        with self.lock:
+            self.by_type[opname] += n
+
+    def incr_error(self, opname, n=1, count_total=True, exc=None):
+        kind = conflict_kind(exc) if exc is not None else None
+        with self.lock:
+            self.errors_by_type[opname] += n
+            if count_total:
+                self.data['errors'] += n
+            if kind:
+                self.data[f'conflicts_{kind}'] += n
+
+    def conflicts(self):
+        """Ошибки конкуренции транзакций по видам: {'serialization': n, 'deadlock': n, ...}."""
+        with self.lock:
+            return {k[len('conflicts_'):]: v for k, v in self.data.items() if k.startswith('conflicts_')}
+
+    def errors_snapshot(self):
+        with self.lock:
+            return dict(self.errors_by_type)
+
+    def observe_max(self, key, value):
+        with self.lock:
+            if value > self.maxima.get(key, float('-inf')):
+                self.maxima[key] = value
+
+    def pop_max(self, key, default=0.0):
+        """Максимум с прошлого вызова (для интервальных отчётов)."""
+        with self.lock:
+            return self.maxima.pop(key, default)
+
+    def snapshot(self):
+        with self.lock:
+            # shallow copy for reporting
+            return dict(self.data), dict(self.by_type), float(self.time_total)
+
+
+class LatencyHistogram:
+    """
+    HDR-подобная лог-линейная гистограмма задержек (целые микросекунды, до 1 часа).
+    Перцентиль — верхняя граница корзины: завышение не больше 1/2^(SUB_BITS-1), ~0.8% при SUB_BITS = 8.
+    Значения < 2^SUB_BITS хранятся точно, дальше — 2^(SUB_BITS-1) корзин на каждую степень двойки.
+    Не потокобезопасна: пишет один поток, объединение — через merge().
+    """
+    SUB_BITS = 8
+    HALF = 1 << (SUB_BITS - 1)
+    MAX_US = 3600 * 1000000
+
+    def __init__(self):
+        self.counts = [0] * (self.index(self.MAX_US) + 1)
+        self.total = 0
+        self.sum_us = 0
+        self.max_us = 0
+
+    @classmethod
+    def index(cls, v):
+        m = v.bit_length() - cls.SUB_BITS
+        if m <= 0:
+            return v
+        return m * cls.HALF + (v >> m)
+
+    @classmethod
+    def value_at(cls, idx):
+        """Верхняя граница корзины idx в микросекундах."""
+        if idx < (cls.HALF << 1):
+            return idx
+        m = (idx >> (cls.SUB_BITS - 1)) - 1
+        sub = idx - m * cls.HALF
+        return ((sub + 1) << m) - 1
+
+    def record(self, seconds):
+        v = min(max(int(seconds * 1000000), 0), self.MAX_US)
+        self.counts[self.index(v)] += 1
+        self.total += 1
+        self.sum_us += v
+        if v > self.max_us:
+            self.max_us = v
+
+    def merge(self, other):
+        if not other.total:
+            return self
+        counts = self.counts
+        for i, c in enumerate(other.counts):
+            if c:
+                counts[i] += c
+        self.total += other.total
+        self.sum_us += other.sum_us
+        self.max_us = max(self.max_us, other.max_us)
+        return self
+
+    def percentile(self, p):
+        """Задержка в секундах, ниже которой p% значений."""
+        if not self.total:
+            return 0.0
+        need = max(1, int(round(self.total * p / 100.0)))
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= need:
+                return min(self.value_at(i), self.max_us) / 1000000.0
+        return self.max_us / 1000000.0
+
+    def mean(self):
+        return (self.sum_us / self.total / 1000000.0) if self.total else 0.0
+
+    def cumulative(self, bounds_us):
+        """Число значений <= каждой границы (для корзин le у Prometheus); bounds_us по возрастанию."""
+        out = [0] * len(bounds_us)
+        b = 0
+        acc = 0
+        for i, c in enumerate(self.counts):
+            if not c:
+                continue
+            v = self.value_at(i)
+            while b < len(bounds_us) and bounds_us[b] < v:
+                out[b] = acc
+                b += 1
+            if b == len(bounds_us):
+                break
+            acc += c
+        for j in range(b, len(bounds_us)):
+            out[j] = acc
+        return out
+
+    def encode(self):
+        return {"total": self.total, "sum_us": self.sum_us, "max_us": self.max_us, "sub_bits": self.SUB_BITS,
+                "counts": {str(i): c for i, c in enumerate(self.counts) if c}}
+
+    @classmethod
+    def decode(cls, d):
+        h = cls()
+        for i, c in d["counts"].items():
+            h.counts[int(i)] = c
+        h.total, h.sum_us, h.max_us = d["total"], d["sum_us"], d["max_us"]
+        return h
+
+
+class OpRecorder:
+    """
+    Гистограммы операций за интервал; репортер забирает накопленное подменой словаря (swap_interval).
+    Запись и подмена — под одним локом: иначе исполнитель, взявший словарь до подмены, дописывает
+    в гистограмму, которую репортер уже сливает. Обычно пишет один поток, так что лок не конкурентный.
+    Писать могут и несколько потоков сразу (DBWorker.lock_waits, Replicas).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.interval = defaultdict(LatencyHistogram)
+
+    def record(self, op, seconds):
+        with self.lock:
+            self.interval[op].record(seconds)
+
+    def merge(self, op, hist):
+        with self.lock:
+            self.interval[op].merge(hist)
+
+    def swap_interval(self):
+        with self.lock:
+            current = self.interval
+            self.interval = defaultdict(LatencyHistogram)
+        return current
+
+
+def format_latency_table(hists, span, indent="   ", total_row=True):
+    lines = [f"{indent}{'op':<14}{'count':>9}{'ops/s':>10}" + "".join(f"{'p' + format(p, 'g'):>9}" for p in PERCENTILES) + f"{'max':>9}  (ms)"]
+    all_ops = LatencyHistogram()
+    rows = sorted(hists.items(), key=lambda x: -x[1].total)
+    for op, h in rows:
+        all_ops.merge(h)
+    for op, h in rows + ([("ALL", all_ops)] if total_row else []):
+        if not h.total:
+            continue
+        pcts = "".join(f"{h.percentile(p) * 1000:>9.2f}" for p in PERCENTILES)
+        lines.append(f"{indent}{op:<14}{h.total:>9}{h.total / span if span > 0 else 0:>10.1f}{pcts}{h.max_us / 1000:>9.2f}")
+    return "\n".join(lines)
+
+
+def format_phase_table(phases, title, indent="   "):
+    """phases — список (имя, гистограммы по операциям, длительность, ошибки)."""
+    lines = [f"{indent}{title:<14}{'ops':>9}{'ops/s':>10}{'errors':>8}" + "".join(f"{'p' + format(p, 'g'):>9}" for p in PERCENTILES) + "  (ms)"]
+    for name, hists, span, errors in phases:
+        h = LatencyHistogram()
+        for oh in hists.values():
+            h.merge(oh)
+        pcts = "".join(f"{h.percentile(p) * 1000:>9.2f}" for p in PERCENTILES)
+        lines.append(f"{indent}{name:<14}{h.total:>9}{h.total / span if span > 0 else 0:>10.1f}{errors:>8}{pcts}")
+    return "\n".join(lines)
+
+
+def format_olap_table(phases, olap_phases, indent="   "):
+    """
+    Задержки OLTP по фазам --olap рядом с числом аналитических клиентов; x p99 — во сколько раз p99 OLTP
+    больше, чем в первой фазе. olap_phases — (гистограммы аналитических запросов, ошибки) тех же фаз.
+    """
+    lines = [f"{indent}{'olap':>5}{'oltp ops/s':>12}{'errors':>8}{'p50':>9}{'p99':>9}{'p99.9':>9}{'x p99':>7}"
+             f"{'olap q/s':>10}{'olap p50,s':>11}{'olap err':>9}  (ms)"]
+    base = None
+    for (name, hists, span, errors), (olap_hists, olap_errors) in zip(phases, olap_phases):
+        h, q = LatencyHistogram(), LatencyHistogram()
+        for oh in hists.values():
+            h.merge(oh)
+        for oh in olap_hists.values():
+            q.merge(oh)
+        p99 = h.percentile(99)
+        base = p99 if base is None else base
+        lines.append(f"{indent}{name:>5}{h.total / span if span > 0 else 0:>12.1f}{errors:>8}{h.percentile(50) * 1000:>9.2f}"
+                     f"{p99 * 1000:>9.2f}{h.percentile(99.9) * 1000:>9.2f}{p99 / base if base else 0:>7.2f}"
+                     f"{q.total / span if span > 0 else 0:>10.2f}{q.percentile(50):>11.3f}{olap_errors:>9}")
+    return "\n".join(lines)
+
+
+class Reporter:
+    """Собирает интервальные гистограммы всех исполнителей, печатает отчёт и пишет --hist-out."""
+
+    def __init__(self, stats, recorders, hist_out=None, status_fn=None, interval=DEFAULT_REPORT_INTERVAL, target_fn=None,
+                 sampler=None, replicas=None):
+        self.stats = stats
+        # --server_sample: ServerSampler, его сводка печатается и пишется в --hist-out на тех же интервалах
+        self.sampler = sampler
+        # --replica: Replicas — чтения и задержка репликации по репликам за интервал
+        self.replicas = replicas
+        self.intervals = []
+        self.recorders = recorders
+        self.status_fn = status_fn
+        # target_fn(t0, t1) -> средняя целевая скорость за отрезок (секунды от старта), для --profile
+        self.target_fn = target_fn
+        self.timeline = []
+        self.interval = interval
+        self.total = defaultdict(LatencyHistogram)
+        self.window = defaultdict(LatencyHistogram)
+        self.phase = defaultdict(LatencyHistogram)
+        self.start = time.time()
+        self.window_start = self.start
+        self.phase_start = self.start
+        self.prev_errors = 0
+        self.prev_conflicts = {}
+        self.last_rate = 0.0
+        self.series = []  # точки для хранилища результатов (interval_point)
+        self.hist_out = open(hist_out, 'w') if hist_out else None
+        # collect() зовут и главный поток, и /metrics (MetricsExporter)
+        self.lock = threading.RLock()
+
+    def collect(self):
+        with self.lock:
+            self._collect()
+
+    def _collect(self):
+        for rec in self.recorders:
+            for op, h in rec.swap_interval().items():
+                self.window[op].merge(h)
+                self.phase[op].merge(h)
+                self.total[op].merge(h)
+
+    def _dump(self, kind, hists, t0, t1, **extra):
+        if not self.hist_out:
+            return
+        for op, h in hists.items():
+            self.hist_out.write(json.dumps({"kind": kind, "op": op, "start": t0, "end": t1, **extra, "hist": h.encode()}) + "\n")
+        self.hist_out.flush()
+
+    def total_snapshot(self):
+        """Копия накопленных гистограмм по операциям на текущий момент."""
+        with self.lock:
+            self._collect()
+            return {op: LatencyHistogram().merge(h) for op, h in self.total.items()}
+
+    def report_interval(self):
+        with self.lock:
+            self._report_interval()
+
+    def _report_interval(self):
+        self.collect()
+        now = time.time()
+        span = now - self.window_start
+        data_snap, _, _ = self.stats.snapshot()
+        errors = data_snap.get('errors', 0)
+        total_ops = data_snap.get('ops', 0)
+        elapsed = now - self.start
+        ops = sum(h.total for h in self.window.values())
+        status = f" {self.status_fn()}" if self.status_fn else ""
+        conflicts = self.stats.conflicts()
+        if conflicts:
+            status = f" conflicts: {format_conflicts(conflicts, self.prev_conflicts)}" + status
+        self.prev_conflicts = conflicts
+        print(f"[{now_ts()}] elapsed={int(elapsed)}s interval_ops/s={ops / span if span > 0 else 0:.2f} "
+              f"total_ops={total_ops} avg_ops/s={total_ops / elapsed if elapsed > 0 else 0:.2f} "
+              f"errors={errors} (+{errors - self.prev_errors}){status}")
+        print(format_latency_table(self.window, span))
+        extra = {}
+        all_ops = LatencyHistogram()
+        for h in self.window.values():
+            all_ops.merge(h)
+        if self.target_fn:
+            target = self.target_fn(self.window_start - self.start, elapsed)
+            extra["target_ops"] = target
+            self.timeline.append((elapsed, target, ops / span if span > 0 else 0, all_ops))
+        self._dump("interval", self.window, self.window_start, now, **extra)
+        self.series.append(interval_point(elapsed, span, self.window, errors - self.prev_errors))
+        if self.sampler:
+            summary, samples = self.sampler.interval(now)
+            print(f"   server: {format_server_summary(summary)}")
+            self.intervals.append((elapsed, all_ops.percentile(99) if all_ops.total else None, summary))
+            if self.hist_out:
+                for sample in samples:
+                    self.hist_out.write(json.dumps({"kind": "server_sample", **sample}) + "\n")
+                self.hist_out.write(json.dumps({"kind": "server", "start": self.window_start, "end": now, **summary}) + "\n")
+                self.hist_out.flush()
+        if self.replicas:
+            text, summary = self.replicas.interval(span)
+            print(f"   replicas: {text}")
+            self.series[-1]["replicas"] = summary
+            if self.hist_out:
+                self.hist_out.write(json.dumps({"kind": "replicas", "start": self.window_start, "end": now, "replicas": summary}) + "\n")
+                self.hist_out.flush()
+        self.prev_errors = errors
+        self.last_rate = ops / span if span > 0 else 0.0
+        self.window = defaultdict(LatencyHistogram)
+        self.window_start = now
+
+    def end_phase(self):
+        """Гистограммы и длительность с прошлого вызова — для сравнения фаз (--protocol a,b,c)."""
+        with self.lock:
+            self._collect()
+            now = time.time()
+            hists, span = self.phase, now - self.phase_start
+            self.phase = defaultdict(LatencyHistogram)
+            self.phase_start = now
+            return hists, span
+
+    def timeline_report(self, indent="   "):
+        """Достигнутая скорость и задержки по интервалам рядом с целевой кривой профиля."""
+        width = 30
+        peak = max([max(t, a) for _, t, a, _ in self.timeline] + [1.0])
+        lines = [f"{indent}{'t,s':>6}{'target/s':>10}{'actual/s':>11}{'p50':>9}{'p99':>9}{'max':>9}  (ms)  # actual, | target"]
+        for elapsed, target, achieved, h in self.timeline:
+            bar = list("#" * int(round(achieved / peak * width)) + " " * width)[:width + 1]
+            bar[min(width, int(round(target / peak * width)))] = "|"
+            lines.append(f"{indent}{int(elapsed):>6}{target:>10.1f}{achieved:>11.1f}{h.percentile(50) * 1000:>9.2f}"
+                         f"{h.percentile(99) * 1000:>9.2f}{h.max_us / 1000:>9.2f}  {''.join(bar)}")
+        return "\n".join(lines)
+
+    def spike_report(self, indent="   "):
+        """Интервалы, где p99 вырос в SPIKE_P99_FACTOR раз над медианой, с преобладающими ожиданиями сервера."""
+        p99s = sorted(p for _, p, _ in self.intervals if p)
+        if not p99s:
+            return None
+        median = p99s[len(p99s) // 2]
+        waits = defaultdict(int)
+        for _, _, summary in self.intervals:
+            for event, n in summary['wait_samples'].items():
+                waits[event] += n
+        lines = [f"{indent}interval p99 median {median * 1000:.2f}ms; server waits over the run: {format_waits(waits, 5)}"]
+        spikes = [(elapsed, p, summary) for elapsed, p, summary in self.intervals if p and p > median * SPIKE_P99_FACTOR]
+        if not spikes:
+            lines.append(f"{indent}no intervals with p99 above {SPIKE_P99_FACTOR:g}x median")
+            return "\n".join(lines)
+        lines.append(f"{indent}{'t,s':>6}{'p99,ms':>9}{'x med':>7}  server")
+        for elapsed, p, summary in spikes:
+            lines.append(f"{indent}{int(elapsed):>6}{p * 1000:>9.2f}{p / median:>7.1f}  {format_server_summary(summary)}")
+        return "\n".join(lines)
+
+    def final_report(self):
+        with self.lock:
+            self._collect()
+            now = time.time()
+            print(f"[{now_ts()}] Latency over the whole run:")
+            print(format_latency_table(self.total, now - self.start))
+            self._dump("total", self.total, self.start, now)
+            if self.hist_out:
+                self.hist_out.close()
+
+
+class MetricsExporter:
+    """
+    Встроенный HTTP-эндпоинт /metrics в текстовом формате Prometheus (--metrics_port).
+    Счётчики операций и ошибок — из SafeStats, гистограммы задержек по операциям — накопленные
+    Reporter.total (HDR-корзины сводятся к фиксированным границам BUCKETS), остальное — gauges_fn().
+    """
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    PREFIX = "load_test_"
+    # экранирование значений меток по формату экспозиции: \\, \" и \n
+    LABEL_ESCAPE = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+    def __init__(self, reporter, stats, gauges_fn=None, info=None, port=DEFAULT_METRICS_PORT, addr="0.0.0.0"):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.reporter = reporter
+        self.stats = stats
+        self.gauges_fn = gauges_fn
+        self.info = info or {}
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((addr, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True, name="metrics")
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @classmethod
+    def _labels(cls, **labels):
+        return "{" + ",".join(f'{k}="{str(v).translate(cls.LABEL_ESCAPE)}"' for k, v in labels.items()) + "}" if labels else ""
+
+    def render(self):
+        p = self.PREFIX
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {p}{name} {help_text}")
+            lines.append(f"# TYPE {p}{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{p}{name}{suffix}{self._labels(**labels)} {value}")
+
+        hists = self.reporter.total_snapshot()
+        data, by_type, _ = self.stats.snapshot()
+        errors_by_type = self.stats.errors_snapshot()
+        if self.info:
+            metric("info", "gauge", "Run settings.", [("", self.info, 1)])
+        metric("ops_total", "counter", "Completed operations.", [("", {"op": op}, n) for op, n in sorted(by_type.items())])
+        metric("errors_total", "counter", "Failed operations.", [("", {"op": op}, n) for op, n in sorted(errors_by_type.items())])
+        metric("in_flight", "gauge", "Operations currently executing.", [("", {}, data.get('in_flight', 0))])
+        for name, (value, help_text) in (self.gauges_fn() if self.gauges_fn else {}).items():
+            metric(name, "gauge", help_text, [("", {}, value)])
+
+        bounds_us = [int(b * 1000000) for b in self.BUCKETS]
+        samples = []
+        for op, h in sorted(hists.items()):
+            for le, c in zip(self.BUCKETS, h.cumulative(bounds_us)):
+                samples.append(("_bucket", {"op": op, "le": f"{le:g}"}, c))
+            samples.append(("_bucket", {"op": op, "le": "+Inf"}, h.total))
+            samples.append(("_sum", {"op": op}, f"{h.sum_us / 1000000.0:.6f}"))
+            samples.append(("_count", {"op": op}, h.total))
+        metric("op_latency_seconds", "histogram", "Operation latency from intended start (open-loop) or actual start.", samples)
+        return "\n".join(lines) + "\n"
+
+
+def format_bytes(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024 or unit == "GB":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024.0
+
+
+def format_waits(waits, top=3):
+    total = sum(waits.values())
+    if not total:
+        return "idle"
+    return ", ".join(f"{event} {n * 100.0 / total:.0f}%" for event, n in sorted(waits.items(), key=lambda x: -x[1])[:top])
+
+
+def format_server_summary(summary):
+    if summary.get('error'):
+        return f"sampling failed: {summary['error']}"
+    rates = summary['rates']
+    reads = rates.get('blks_read', 0.0)
+    hits = rates.get('blks_hit', 0.0)
+    hit_ratio = f"{hits * 100.0 / (hits + reads):.1f}%" if hits + reads > 0 else "-"
+    deltas = summary['deltas']
+    ckpt = deltas.get('ckpt_timed', 0) + deltas.get('ckpt_req', 0)
+    parts = [f"active={summary['active']:.1f}", f"waits {format_waits(summary['wait_samples'])}",
+             f"| xact/s={rates.get('xact_commit', 0.0) + rates.get('xact_rollback', 0.0):.0f}",
+             f"hit={hit_ratio}", f"read/s={reads:.0f}", f"temp={format_bytes(deltas.get('temp_bytes', 0))}",
+             f"lock_waits_max={summary['lock_waits_max']}"]
+    if ckpt:
+        parts.append(f"ckpt=+{ckpt} ({deltas.get('ckpt_buffers', 0)} buf)")
+    if deltas.get('deadlocks'):
+        parts.append(f"deadlocks=+{deltas['deadlocks']}")
+    if summary['autovacuum_max']:
+        parts.append(f"autovacuum={summary['autovacuum_max']}")
+    return " ".join(parts)
+
+
+class ServerSampler(threading.Thread):
+    """
+    --server_sample: раз в interval секунд на своём соединении снимает активные ожидания клиентских
+    бэкендов (pg_stat_activity, как ASH), счётчики pg_stat_database и bgwriter/checkpointer, число блокировок
+    и ждущих блокировок. Reporter на каждом отчёте забирает накопленное через interval().
+    Ожидания чужих сессий видны суперпользователю или роли с pg_read_all_stats.
+    """
+
+    def __init__(self, conn_kwargs, interval):
+        super().__init__(daemon=True, name="server-sampler")
+        self.conn_kwargs = conn_kwargs
+        self.period = interval
+        self.lock = threading.Lock()
+        self.samples = []
+        self.prev = None
+        self.error = None
+
+    def run(self):
+        conn = None
+        try:
+            conn = psycopg2.connect(**self.conn_kwargs)
+            conn.autocommit = True  # каждый запрос — своя транзакция, иначе pg_stat_* кэшируются до её конца
+            cur = conn.cursor()
+            cur.execute("SELECT to_regclass('pg_stat_checkpointer') IS NOT NULL")
+            ckpt_sql = SERVER_CKPT_SQL_17 if cur.fetchone()[0] else SERVER_CKPT_SQL
+            while not STOP.is_set():
+                t0 = time.time()
+                cur.execute(SERVER_WAITS_SQL)
+                waits = dict(cur.fetchall())
+                cur.execute(SERVER_DB_SQL)
+                counters = dict(zip(SERVER_DB_COLUMNS, cur.fetchone() or ()))
+                cur.execute(ckpt_sql)
+                counters.update(zip(SERVER_CKPT_COLUMNS, cur.fetchone()))
+                cur.execute(SERVER_LOCKS_SQL)
+                locks, lock_waits, autovacuum = cur.fetchone()
+                with self.lock:
+                    self.samples.append({"ts": t0, "waits": waits, "counters": counters, "locks": locks,
+                                         "lock_waits": lock_waits, "autovacuum": autovacuum})
+                STOP.wait(max(0.0, self.period - (time.time() - t0)))
+        except psycopg2.Error as e:
+            self.error = str(e).strip().splitlines()[0]
+            print(f"[{now_ts()}] Server sampling stopped: {self.error}", file=sys.stderr)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def interval(self, until):
+        """Сводка по снимкам до момента until: доли ожиданий, дельты и скорости счётчиков, максимум ждущих блокировок."""
+        with self.lock:
+            samples = [x for x in self.samples if x["ts"] < until]
+            self.samples = self.samples[len(samples):]
+        if not samples:
+            return {"error": self.error or "no samples", "wait_samples": {}}, []
+        waits = defaultdict(int)
+        for x in samples:
+            for event, n in x["waits"].items():
+                waits[event] += n
+        first = self.prev or samples[0]
+        last = samples[-1]
+        span = max(last["ts"] - first["ts"], 1e-9)
+        deltas = {k: v - first["counters"].get(k, v) for k, v in last["counters"].items()}
+        self.prev = last
+        summary = {
+            "samples": len(samples),
+            "active": sum(waits.values()) / len(samples),
+            "wait_samples": dict(waits),
+            "deltas": deltas,
+            "rates": {k: v / span for k, v in deltas.items()} if last is not first else {},
+            "lock_waits_max": max(x["lock_waits"] for x in samples),
+            "locks_max": max(x["locks"] for x in samples),
+            "autovacuum_max": max(x["autovacuum"] for x in samples),
+        }
+        return summary, samples
+
+
+def interval_point(elapsed, span, hists, errors):
+    """Точка временного ряда для result.json: скорость, ошибки и перцентили интервала (всего и по операциям)."""
+    all_ops = LatencyHistogram()
+    for h in hists.values():
+        all_ops.merge(h)
+    return {
+        "t": round(elapsed, 3), "span": round(span, 3), "ops": all_ops.total,
+        "ops_per_sec": all_ops.total / span if span > 0 else 0.0, "errors": errors,
+        "p50": all_ops.percentile(50), "p99": all_ops.percentile(99),
+        "by_op": {op: {"count": h.total, "p50": h.percentile(50), "p99": h.percentile(99)} for op, h in hists.items()},
+        "hist": all_ops.encode(),
+    }
@@ -21,6 +21,8 @@ import psycopg2
 from faker import Faker
 from tqdm import tqdm
 
+from json_synth import JsonTemplate, Choice, Bool, Nullable, Pattern, Uuid, Normal, Const
+
 # ----------------- НАСТРОЙКИ -----------------
 # Подставь своё подключение сюда (или оставь строку подключения)
 DB_CONN = "dbname=default_db user=gen_user password=JISDlsf!dn*5993) host=185.233.187.236"
@@ -65,6 +67,24 @@ USER_TAGS = ["vip","new","churn_risk","newsletter","wholesale","b2b","b2c","loya
 PRODUCT_TAGS = ["sale","new","exclusive","eco","refurbished","bundle","limited"]
 WAREHOUSE_TZS = ["UTC","Europe/Berlin","Europe/Warsaw","Europe/Paris","America/New_York","Asia/Singapore"]
 
+# ----------------- JSON-шаблоны для JSONB-колонок -----------------
+# Скелеты сериализуются один раз, на строку подставляются только случайные значения (см. json_synth.py).
+# Тяжёлые faker-значения (user agent, абзацы, слова) берутся из заранее сгенерированных пулов.
+WORD_POOL = [fake.word() for _ in range(2000)]
+UA_POOL = [fake.user_agent() for _ in range(500)]
+PATH_POOL = ["/" + "/".join(fake.words(nb=random.randint(1, 4))) for _ in range(5000)]
+PARAGRAPH_POOL = [fake.paragraph(nb_sentences=5) for _ in range(2000)]
+
+PREFS_DOC = JsonTemplate({"email_promos": Bool(0.6), "lang": Choice(["en","de","pl","fr","es","it"]),
+                          "currency": Choice(CURRENCIES), "theme": Choice(["light","dark"])})
+ATTRS_DOC = JsonTemplate({"color": Choice(["red","green","blue","black","white","silver","gold"]), "size": Choice(["XS","S","M","L","XL"]),
+                          "material": Choice(["cotton","plastic","metal","leather","glass","wood"]), "warranty_months": Choice([6,12,24,36])})
+ORDER_META_DOC = JsonTemplate({"channel": Choice(["web","mobile","support"]), "campaign": Nullable(Choice(WORD_POOL), p_null=0.8)})
+PAYMENT_DETAILS_DOC = JsonTemplate({"auth_code": Pattern("????-########")})
+PAYMENT_FAILED_DOC = JsonTemplate({"auth_code": Const(None)})
+EVENT_PAYLOAD_DOC = JsonTemplate({"request_id": Uuid(), "ua": Choice(UA_POOL), "path": Choice(PATH_POOL),
+                                  "latency_ms": Normal(120, 90), "ab": Choice(["A","B","C"]), "extra": Choice(PARAGRAPH_POOL)})
+
 # ----------------- SQL СХЕМА (без создания схемы) -----------------
 # Все таблицы будут созданы в default schema (обычно public). DROP IF EXISTS чтобы можно было запускать повторно.
 def build_schema_sql():
@@ -352,8 +372,7 @@ def gen_accounts(start, end):
     for i in range(start, end):
         created = fake.date_time_between(START_DATE, TODAY)
         last_login = created + timedelta(days=random.randint(0, 600)) if random.random() < 0.85 else None
-        prefs = {"email_promos": random.random() < 0.6, "lang": random.choice(["en","de","pl","fr","es","it"]),
-                 "currency": random.choice(CURRENCIES), "theme": random.choice(["light","dark"])}
+        prefs = PREFS_DOC.render()
         tags = list({random.choice(USER_TAGS) for _ in range(np.random.poisson(1.2))})
         out.append([i+1, str(uuid.uuid4()), fake.name(), f"user{i}@example.com",
                     fake.phone_number() if random.random() < 0.9 else None,
@@ -375,7 +394,7 @@ def gen_addresses(start, end):
 def gen_products(start, end, category_ids):
     out = []
     for i in range(start, end):
-        attrs = {"color": random.choice(["red","green","blue","black","white","silver","gold"]), "size": random.choice(["XS","S","M","L","XL"]), "material": random.choice(["cotton","plastic","metal","leather","glass","wood"]), "warranty_months": random.choice([6,12,24,36])}
+        attrs = ATTRS_DOC.render()
         tags = list({random.choice(PRODUCT_TAGS) for _ in range(np.random.poisson(1.1))})
         price = round(float(np.random.lognormal(mean=4.8, sigma=0.6)), 2)
         out.append([i+1, f"SKU-{i+1:08d}", fake.word() + " " + fake.word(), random.choice(category_ids), price, random.choice(CURRENCIES), attrs, tags if tags else None, int(abs(np.random.normal(500,300))), fake.date_time_between(START_DATE, TODAY)])
@@ -398,7 +417,7 @@ def gen_orders_chunk(start, end, account_ids):
         created = fake.date_time_between(START_DATE, TODAY)
         status = random.choices(["new","paid","processing","shipped","delivered","cancelled","returned"], weights=[5,20,10,15,30,8,2], k=1)[0]
         total = round(float(np.random.lognormal(mean=4.5, sigma=0.7)), 2)
-        meta = {"channel": random.choice(["web","mobile","support"]), "campaign": fake.word() if random.random() < 0.2 else None}
+        meta = ORDER_META_DOC.render()
         out.append([i+1, random.choice(account_ids), status, total, random.choice(CURRENCIES), created, created + timedelta(days=random.randint(0,10)), meta])
     return out
 
@@ -427,7 +446,7 @@ def gen_payments_from_orders(order_rows, start_idx):
         status = random.choices(["pending","authorized","captured","refunded","failed"], weights=[5,15,70,5,5])[0]
         method = random.choices(["card","cash","paypal","crypto","bank_transfer","apple_pay","google_pay"], weights=[60,5,15,3,10,4,3])[0]
         paid_at = created_at + timedelta(minutes=random.randint(1,60)) if status in ("authorized","captured","refunded") else None
-        details = {"auth_code": fake.bothify(text="????-########") if status != "failed" else None}
+        details = (PAYMENT_DETAILS_DOC if status != "failed" else PAYMENT_FAILED_DOC).render()
         amount = round(float(np.random.lognormal(mean=4.5, sigma=0.7)), 2)
         out.append([idx+1, order_id, created_at, amount, method, status, details, paid_at])
         idx += 1
@@ -453,7 +472,7 @@ def gen_events(start, end, account_ids):
     for i in range(start, end):
         t = random.choice(EVENT_TYPES)
         created = fake.date_time_between(START_DATE, TODAY)
-        payload = {"request_id": str(uuid.uuid4()), "ua": fake.user_agent(), "path": "/" + "/".join(fake.words(nb=random.randint(1,4))), "latency_ms": int(abs(np.random.normal(120,90))), "ab": random.choice(["A","B","C"]), "extra": fake.paragraph(nb_sentences=5)}
+        payload = EVENT_PAYLOAD_DOC.render()
         out.append([i+1, random.choice(account_ids) if random.random() < 0.8 else None, t, payload, created])
     return out
 